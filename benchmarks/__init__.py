@@ -0,0 +1 @@
+"""The micro-benchmarks of the hot paths, run as scripts, e.g. `python -m benchmarks.<name>`."""
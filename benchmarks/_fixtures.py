@@ -0,0 +1,101 @@
+"""
+The fixtures shared by the benchmarks, and the database they are created in.
+
+The benchmarks are run against the database of `DATABASE_URL` (a local Postgres with the migrations
+applied), within `rolled_back_database()`, i.e. in a transaction which is rolled back at the end, so
+the database is left as it was. The users get negative IDs and the groups random UIDs, so that they
+never collide with the real ones.
+"""
+import contextlib
+import datetime
+import typing
+import uuid
+
+from tortoise.transactions import in_transaction
+
+from models import Group, GroupPayment, MonobankAccount, MonobankClient, Paycheck, User
+from tasks import _build_paycheck_for_user
+from utils import tortoise_orm
+from utils.onboarding import onboard_users
+
+
+class _Rollback(Exception):
+    """Raised to roll the benchmark's transaction back."""
+
+
+@contextlib.asynccontextmanager
+async def rolled_back_database() -> typing.AsyncIterator[None]:
+    """Connect to the database, and roll back everything done within the context."""
+    await tortoise_orm.init(role="worker", pool_max_size=1)
+
+    try:
+        async with in_transaction("default"):
+            yield
+            raise _Rollback()
+    except _Rollback:
+        pass
+    finally:
+        await tortoise_orm.shutdown()
+
+
+async def create_users(count: int) -> list[User]:
+    """Create the users along with their profiles and settings, the way the bot onboards them."""
+    # NB: Far from the real Telegram IDs, not to collide with them
+    first_user_id: int = -(uuid.uuid4().int % 10**12) - count
+    return await onboard_users(
+        [
+            User(id=first_user_id + number, first_name=f"User {number}", language_code="uk")
+            for number in range(count)
+        ]
+    )
+
+
+async def create_monobank_client(user: User) -> MonobankClient:
+    """Create the user's Monobank client."""
+    return await MonobankClient.create(user=user, token=uuid.uuid4().hex, permissions="")
+
+
+async def create_monobank_account(monobank_client: MonobankClient) -> MonobankAccount:
+    """Create a Monobank account of the client."""
+    return await MonobankAccount.create(
+        id=uuid.uuid4().hex[:22],
+        monobank_client=monobank_client,
+        currency_code=980,
+        cashback_type="None",
+        balance=0,
+        credit_limit=0,
+        type="fop",
+        iban="UA000000000000000000000000000",
+        name="Vilnyy",
+        edrpou="0000000",
+    )
+
+
+async def create_group(created_by_user: User, users: typing.Sequence[User]) -> Group:
+    """Create a group of the users."""
+    group = await Group.create(
+        name="Vilnyy", uid=uuid.uuid4().hex[:4], created_by_user=created_by_user
+    )
+    await group.users.add(*users)
+    return group
+
+
+async def create_group_payment(group: Group) -> GroupPayment:
+    """Create a group payment of the group, due in a week."""
+    return await GroupPayment.create(
+        group=group,
+        amount=380000,
+        comment="Rent",
+        due_date=datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(days=7),
+        created_by_id=group.created_by_user_id,
+    )
+
+
+async def create_paycheck(group_payment: GroupPayment, user: User) -> Paycheck:
+    """Create the user's paycheck of the group payment, the way `send_group_payment` builds it."""
+    await group_payment.fetch_related("group")
+    await user.fetch_related("settings__monobank_account_to_pay_to")
+
+    paycheck: Paycheck = _build_paycheck_for_user(group_payment, user)
+    await paycheck.save()
+    return paycheck
@@ -0,0 +1,145 @@
+"""
+Compare the latency of the hot queries made with the ORM and on the fast path (prepared statements).
+
+The queries run on every update or every poll: the user lookup, the paycheck lookup by ID (with the
+relations its messages are rendered with), and the nearest due dates of the unpaid paychecks per
+account. They are made against the database of `DATABASE_URL` (a local Postgres with the migrations
+applied), in a transaction which is rolled back at the end (see `benchmarks/_fixtures.py`).
+
+The fast path relies on the ORM's internals (see `utils/fast_queries.py`), so the models it returns
+are checked to be the same as the ORM's first.
+
+Usage:
+    python -m benchmarks.hot_queries [--queries 1000] [--accounts 10]
+"""
+import argparse
+import asyncio
+import datetime
+import statistics
+import time
+import typing
+
+from tortoise.functions import Min
+
+from benchmarks._fixtures import (
+    create_group,
+    create_group_payment,
+    create_monobank_account,
+    create_monobank_client,
+    create_paycheck,
+    create_users,
+    rolled_back_database,
+)
+from models import Group, MonobankAccount, MonobankClient, Paycheck, Settings, User
+from tasks import PAYCHECK_RENDERING_RELATIONS
+from utils import fast_queries
+from utils.tortoise_orm import flatten_tortoise_model
+
+
+async def seed(accounts_count: int) -> tuple[User, Paycheck, list[str]]:
+    """Create a user paying the paychecks to the accounts, a paycheck (and group payment) each."""
+    [user] = await create_users(1)
+    monobank_client: MonobankClient = await create_monobank_client(user)
+    group: Group = await create_group(user, [user])
+
+    account_ids: list[str] = []
+    paychecks: list[Paycheck] = []
+    for _ in range(accounts_count):
+        monobank_account: MonobankAccount = await create_monobank_account(monobank_client)
+        account_ids.append(monobank_account.id)
+
+        # So that all the relations of the paycheck are joined
+        await Settings.filter(user=user).update(monobank_account_to_pay_to_id=monobank_account.id)
+        # NB: A group payment has only one paycheck per user
+        paychecks.append(await create_paycheck(await create_group_payment(group), user))
+
+    return user, paychecks[0], account_ids
+
+
+async def check_fast_path(user: User, paycheck: Paycheck) -> None:
+    """Check that the fast path returns the same models as the ORM, with the same relations."""
+    orm_user: User = await User.get(id=user.id)
+    fast_user: User = await fast_queries.get_user(user.id)
+    assert flatten_tortoise_model(orm_user) == flatten_tortoise_model(fast_user), "The users differ"
+
+    orm_paycheck: Paycheck = await Paycheck.get(id=paycheck.id).select_related(
+        *PAYCHECK_RENDERING_RELATIONS
+    )
+    fast_paycheck: Paycheck = await fast_queries.get_rendered_paycheck(paycheck.id)
+    assert flatten_tortoise_model(orm_paycheck) == flatten_tortoise_model(
+        fast_paycheck
+    ), "The paychecks differ"
+
+
+async def measure(query: typing.Callable[[], typing.Awaitable], queries_count: int) -> list[float]:
+    """Make the query sequentially, and get the latency of each one (in seconds)."""
+    # Warm up, e.g. prepare the statements
+    await query()
+
+    latencies: list[float] = []
+    for _ in range(queries_count):
+        started_at: float = time.perf_counter()
+        await query()
+        latencies.append(time.perf_counter() - started_at)
+
+    return latencies
+
+
+def _format_latencies(latencies: list[float]) -> str:
+    """Format the median and the 95th percentile of the latencies in microseconds."""
+    p95: float = statistics.quantiles(latencies, n=20)[-1]
+    return f"{statistics.median(latencies) * 10**6:>7.0f}µs {p95 * 10**6:>7.0f}µs"
+
+
+async def run(queries_count: int, accounts_count: int) -> None:
+    """Run the benchmark."""
+    async with rolled_back_database():
+        user, paycheck, account_ids = await seed(accounts_count)
+        await check_fast_path(user, paycheck)
+
+        queries: dict[str, tuple[typing.Callable, typing.Callable]] = {
+            "user": (
+                lambda: User.get_or_none(id=user.id),
+                lambda: fast_queries.get_user(user.id),
+            ),
+            "paycheck": (
+                lambda: Paycheck.get_or_none(id=paycheck.id).select_related(
+                    *PAYCHECK_RENDERING_RELATIONS
+                ),
+                lambda: fast_queries.get_rendered_paycheck(paycheck.id),
+            ),
+            "due dates": (
+                lambda: Paycheck.filter(is_paid=False, to_account_id__in=account_ids)
+                .annotate(nearest_due_date=Min("generated_from_group_payment__due_date"))
+                .group_by("to_account_id")
+                .values("to_account_id", "nearest_due_date"),
+                lambda: fast_queries.get_nearest_due_dates(
+                    account_ids, not_before=datetime.datetime.now(tz=datetime.timezone.utc)
+                ),
+            ),
+        }
+
+        print(f"The latencies of {queries_count} queries (the median and the 95th percentile):")
+        print(f"  {'query':<10} {'ORM':>19} {'fast path':>19} {'speedup':>8}")
+        for name, (orm_query, fast_query) in queries.items():
+            orm_latencies: list[float] = await measure(orm_query, queries_count)
+            fast_latencies: list[float] = await measure(fast_query, queries_count)
+            print(
+                f"  {name:<10} {_format_latencies(orm_latencies)} "
+                f"{_format_latencies(fast_latencies)} "
+                f"{statistics.median(orm_latencies) / statistics.median(fast_latencies):>7.2f}x"
+            )
+
+
+def main():
+    """Parse the arguments, and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--accounts", type=int, default=10, help="For the due dates query")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.queries, args.accounts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Check that the hot queries of the payments are planned with the indexes, not with sequential scans.
+
+The database of `DATABASE_URL` (a local Postgres with the migrations applied) is seeded with a
+realistic volume of data: the groups with their users, a year of the monthly group payments with
+a paycheck per user, and the account statements paying them. The hot queries are then `EXPLAIN`ed
+exactly the way they are made by the bot and the worker, and the tables each one must reach with an
+index are checked for sequential scans. Everything is done in a transaction which is rolled back at
+the end, so the database is left as it was.
+
+Exits with the status `1` if any query regresses to a sequential scan, e.g. once an index is dropped
+or a model change makes a query unable to use it.
+
+Usage:
+    python -m benchmarks.query_plans [--groups 1000] [--users-per-group 20] [--months 12]
+"""
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import sys
+import typing
+
+import tortoise
+from tortoise.functions import Sum
+
+from benchmarks._fixtures import rolled_back_database
+from models import Group, MonobankAccountStatement, Paycheck, User
+from utils import fast_queries
+
+# NB: The negative IDs and the "~" UIDs are never used by the real users and groups. The counts
+#  are formatted into the statements, e.g. `{groups}`
+_SEED_SQL: tuple[str, ...] = (
+    'INSERT INTO "user" ("id", "first_name") '
+    "SELECT -user_number, 'User ' || user_number "
+    "FROM generate_series(1, {groups} * {users_per_group}) AS user_number",
+    'INSERT INTO "group" ("name", "uid", "created_by_user_id") '
+    "SELECT 'Group ' || group_number, '~' || lpad(to_hex(group_number), 3, '0'), -group_number "
+    "FROM generate_series(1, {groups}) AS group_number",
+    'INSERT INTO "group__user" ("group_id", "user_id") '
+    'SELECT "group"."id", -(group_number - 1) * {users_per_group} - member_number FROM "group" '
+    "JOIN generate_series(1, {groups}) AS group_number "
+    "ON \"group\".\"uid\" = '~' || lpad(to_hex(group_number), 3, '0') "
+    "CROSS JOIN generate_series(1, {users_per_group}) AS member_number",
+    'INSERT INTO "group__admin" ("group_id", "user_id") '
+    'SELECT "id", "created_by_user_id" FROM "group" WHERE "uid" LIKE \'~%\'',
+    'INSERT INTO "monobank_client" ("token", "permissions", "user_id") '
+    'SELECT \'token \' || "id", \'ps\', "created_by_user_id" FROM "group" '
+    "WHERE \"uid\" LIKE '~%'",
+    'INSERT INTO "monobank_account" ("id", "currency_code", "cashback_type", "balance", '
+    '"credit_limit", "type", "iban", "monobank_client_id") '
+    "SELECT '~' || \"id\", 980, 'None', 0, 0, 'fop', 'UA000000000000000000000000000', \"id\" "
+    'FROM "monobank_client" WHERE "token" LIKE \'token %\'',
+    'INSERT INTO "group_payment" ("amount", "comment", "due_date", "created_by_id", "group_id") '
+    "SELECT 380000, 'Rent', date_trunc('month', now()) + (month_number - {months}) * INTERVAL "
+    '\'1 month\', "created_by_user_id", "id" '
+    'FROM "group" CROSS JOIN generate_series(1, {months}) AS month_number '
+    "WHERE \"uid\" LIKE '~%'",
+    # The paychecks of the previous months are paid, the ones of the current month are not
+    'INSERT INTO "paycheck" ("id", "comment", "amount", "currency_symbol", "currency_code", '
+    '"is_paid", "for_user_id", "to_account_id", "generated_from_group_payment_id") '
+    "SELECT gen_random_uuid(), 'Rent', \"group_payment\".\"amount\", 'UAH', 980, "
+    '"group_payment"."due_date" < now(), "group__user"."user_id", \'~\' || "monobank_client"."id", '
+    '"group_payment"."id" FROM "group_payment" '
+    'JOIN "group" ON "group"."id" = "group_payment"."group_id" AND "group"."uid" LIKE \'~%\' '
+    'JOIN "group__user" ON "group__user"."group_id" = "group"."id" '
+    'JOIN "monobank_client" ON "monobank_client"."user_id" = "group"."created_by_user_id"',
+    'INSERT INTO "monobank_account_statement" ("id", "time", "description", "mcc", '
+    '"original_mcc", "amount", "operation_amount", "currency_code", "commission_rate", '
+    '"cashback_amount", "balance", "hold", "monobank_account_id", "paycheck_id") '
+    "SELECT left(md5(\"id\"::TEXT), 16), \"date_added\" - random() * INTERVAL '30 days', '', "
+    '4829, 4829, "amount", "amount", 980, 0, 0, 0, FALSE, "to_account_id", "id" '
+    'FROM "paycheck" WHERE "is_paid" AND "to_account_id" LIKE \'~%\'',
+    'ANALYZE "user", "group", "group__user", "group__admin", "monobank_account", "group_payment", '
+    '"paycheck", "monobank_account_statement"',
+)
+
+
+@dataclasses.dataclass
+class QueryPlanCheck:
+    """A hot query, and the tables it must not scan sequentially."""
+
+    name: str
+    indexed_tables: tuple[str, ...]
+    # Get the SQL of the query, and its parameters
+    get_query: typing.Callable[[dict[str, typing.Any]], tuple[str, list[typing.Any]]]
+
+
+def _orm_query(queryset: typing.Any) -> tuple[str, list[typing.Any]]:
+    """Get the SQL of the ORM query, with the parameters inlined by the ORM."""
+    return queryset.sql(), []
+
+
+QUERY_PLAN_CHECKS: tuple[QueryPlanCheck, ...] = (
+    QueryPlanCheck(
+        "the existing paychecks of a group payment (`send_group_payment`)",
+        ("paycheck",),
+        lambda seed: _orm_query(
+            Paycheck.filter(generated_from_group_payment_id=seed["group_payment_id"])
+        ),
+    ),
+    QueryPlanCheck(
+        "whether a user's paycheck exists for a group payment",
+        ("paycheck",),
+        lambda seed: _orm_query(
+            Paycheck.filter(
+                generated_from_group_payment_id=seed["group_payment_id"],
+                for_user_id=seed["user_id"],
+            ).exists()
+        ),
+    ),
+    QueryPlanCheck(
+        "the oldest statement of an account (`pull_all_account_statements`)",
+        ("monobank_account_statement",),
+        lambda seed: _orm_query(
+            MonobankAccountStatement.filter(monobank_account_id=seed["account_id"])
+            .order_by("time")
+            .limit(1)
+        ),
+    ),
+    QueryPlanCheck(
+        "the newest statement of an account (`pull_all_account_statements`)",
+        ("monobank_account_statement",),
+        lambda seed: _orm_query(
+            MonobankAccountStatement.filter(monobank_account_id=seed["account_id"])
+            .order_by("-time")
+            .limit(1)
+        ),
+    ),
+    QueryPlanCheck(
+        "the amounts paid to the paychecks (`process_new_account_statements`)",
+        ("monobank_account_statement",),
+        lambda seed: _orm_query(
+            MonobankAccountStatement.filter(paycheck_id__in=[seed["paid_paycheck_id"]])
+            .annotate(paid_amount=Sum("amount"))
+            .group_by("paycheck_id")
+            .values("paycheck_id", "paid_amount")
+        ),
+    ),
+    QueryPlanCheck(
+        "the recent unmatched statements (`rematch_account_statements`)",
+        ("monobank_account_statement",),
+        lambda seed: _orm_query(
+            MonobankAccountStatement.filter(
+                paycheck_id=None,
+                amount__gt=0,
+                date_added__gte=datetime.datetime.now(tz=datetime.timezone.utc)
+                - datetime.timedelta(days=1),
+                date_added__lt=datetime.datetime.now(tz=datetime.timezone.utc),
+            )
+        ),
+    ),
+    QueryPlanCheck(
+        "the groups of an admin (`create_group_payment`)",
+        ("group__admin",),
+        lambda seed: _orm_query(Group.filter(admins__id=seed["admin_id"])),
+    ),
+    QueryPlanCheck(
+        "a group of an admin by its name (`create_group_payment_enter_group`)",
+        ("group", "group__admin"),
+        lambda seed: _orm_query(
+            Group.filter(admins__id=seed["admin_id"], name=seed["group_name"]).limit(1)
+        ),
+    ),
+    QueryPlanCheck(
+        "a group by its name",
+        ("group",),
+        lambda seed: _orm_query(Group.filter(name=seed["group_name"]).limit(1)),
+    ),
+    QueryPlanCheck(
+        "the users of a group (`send_group_payment`)",
+        ("group__user",),
+        lambda seed: _orm_query(User.filter(groups__id=seed["group_id"])),
+    ),
+    QueryPlanCheck(
+        "a user by ID (`fast_queries.get_user`)",
+        ("user",),
+        lambda seed: (fast_queries.get_user_sql(), [seed["user_id"]]),
+    ),
+    QueryPlanCheck(
+        "a paycheck to render by ID (`fast_queries.get_rendered_paycheck`)",
+        ("paycheck", "user", "group_payment", "group"),
+        lambda seed: (fast_queries.get_rendered_paycheck_sql(), [seed["paid_paycheck_id"]]),
+    ),
+    QueryPlanCheck(
+        "the nearest due dates of the accounts (`fast_queries.get_nearest_due_dates`)",
+        ("paycheck",),
+        lambda seed: (
+            fast_queries.GET_NEAREST_DUE_DATES_SQL,
+            [[seed["account_id"]], datetime.datetime.now(tz=datetime.timezone.utc)],
+        ),
+    ),
+)
+
+
+def _get_sequentially_scanned_tables(plan: dict) -> set[str]:
+    """Get the tables the plan (or any of its subplans) scans sequentially."""
+    tables: set[str] = set()
+    if plan["Node Type"] == "Seq Scan":
+        tables.add(plan["Relation Name"])
+    for subplan in plan.get("Plans", []):
+        tables |= _get_sequentially_scanned_tables(subplan)
+
+    return tables
+
+
+async def seed_data(groups_count: int, users_per_group: int, months_count: int) -> dict:
+    """Seed the data, and get the IDs of the rows to query it with."""
+    async with tortoise.connections.get("default").acquire_connection() as raw_connection:
+        for sql in _SEED_SQL:
+            await raw_connection.execute(
+                sql.format(
+                    groups=groups_count, users_per_group=users_per_group, months=months_count
+                )
+            )
+
+    group: Group = await Group.filter(uid="~001").get()
+    paid_paycheck: Paycheck = await Paycheck.filter(
+        is_paid=True, generated_from_group_payment__group=group
+    ).first()
+    return {
+        "group_id": group.id,
+        "group_name": group.name,
+        "admin_id": group.created_by_user_id,
+        "user_id": paid_paycheck.for_user_id,
+        "group_payment_id": paid_paycheck.generated_from_group_payment_id,
+        "paid_paycheck_id": paid_paycheck.id,
+        "account_id": paid_paycheck.to_account_id,
+    }
+
+
+async def check_query_plans(seed: dict) -> list[str]:
+    """Explain the hot queries, and get the failures of the checks."""
+    failures: list[str] = []
+    async with tortoise.connections.get("default").acquire_connection() as raw_connection:
+        for check in QUERY_PLAN_CHECKS:
+            sql, parameters = check.get_query(seed)
+            plan: dict = json.loads(
+                await raw_connection.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *parameters)
+            )[0]["Plan"]
+
+            if scanned_tables := _get_sequentially_scanned_tables(plan) & set(check.indexed_tables):
+                failures.append(f"{check.name}: sequential scan of {', '.join(scanned_tables)}")
+                print(f"  FAIL {check.name}")
+            else:
+                print(f"  ok   {check.name}")
+
+    return failures
+
+
+async def run(groups_count: int, users_per_group: int, months_count: int) -> list[str]:
+    """Seed the data, check the query plans, and roll the data back. Get the failures."""
+    failures: list[str] = []
+    async with rolled_back_database():
+        seed: dict = await seed_data(groups_count, users_per_group, months_count)
+        print(
+            f"Seeded {groups_count} groups of {users_per_group} users, "
+            f"{months_count} months of the group payments. The query plans:"
+        )
+        failures = await check_query_plans(seed)
+
+    return failures
+
+
+def main():
+    """Parse the arguments, and run the checks."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--groups", type=int, default=1000, help="At most 4095")
+    parser.add_argument("--users-per-group", type=int, default=20)
+    parser.add_argument("--months", type=int, default=12)
+    args = parser.parse_args()
+
+    if failures := asyncio.run(run(args.groups, args.users_per_group, args.months)):
+        print("\n".join(["", "The queries regressed to the sequential scans:", *failures]))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
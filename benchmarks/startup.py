@@ -0,0 +1,109 @@
+"""
+Measure how long it takes the bot and the worker to start up.
+
+Every run is made in a fresh Python process, so nothing is imported or connected beforehand. The
+time to import the entry point, and to initialize it (e.g. to connect to the database) are measured
+separately, as well as the whole time the process takes. The initialization needs the database, the
+Redis and the Telegram Bot API (e.g. `python -m utils.fake_telegram`) to be reachable.
+
+Usage:
+    python -m benchmarks.startup [--repeat 5] [--import-only]
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+# The entry point -> the module to import, its startup and shutdown functions
+ENTRY_POINTS: dict[str, tuple[str, str, str]] = {
+    "bot": ("main", "main.on_startup", "main.on_shutdown"),
+    "worker": ("worker", "utils.bootstrap.on_startup", "utils.bootstrap.on_shutdown"),
+}
+
+# Run in the fresh process: import the module, start it up and shut it down, print the timings
+_MEASURE_SCRIPT = """
+import asyncio, importlib, json, sys, time
+
+def get_function(path):
+    module_name, _, function_name = path.rpartition(".")
+    return getattr(importlib.import_module(module_name), function_name)
+
+_started_at = time.perf_counter()
+importlib.import_module(sys.argv[1])
+timings = {"import": time.perf_counter() - _started_at, "init": None}
+
+async def init():
+    _started_at = time.perf_counter()
+    await get_function(sys.argv[2])()
+    timings["init"] = time.perf_counter() - _started_at
+    await get_function(sys.argv[3])()
+
+if sys.argv[4] != "import-only":
+    asyncio.run(init())
+
+print(json.dumps(timings))
+"""
+
+ROOT_DIR: pathlib.Path = pathlib.Path(__file__).parent.parent
+
+
+def measure(entry_point: str, import_only: bool) -> dict[str, float | None]:
+    """Start up the entry point in a fresh process, and get the timings (in seconds)."""
+    module, startup, shutdown = ENTRY_POINTS[entry_point]
+
+    _started_at = time.perf_counter()
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            _MEASURE_SCRIPT,
+            module,
+            startup,
+            shutdown,
+            "import-only" if import_only else "init",
+        ],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings: dict[str, float | None] = json.loads(process.stdout.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - _started_at
+
+    return timings
+
+
+def _format_median(values: list[float | None]) -> str:
+    """Format the median of the timings in milliseconds."""
+    if None in values:
+        return "-"
+    return f"{statistics.median(values) * 1000:.0f}ms"
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--import-only", action="store_true", help="Do not initialize the entry")
+    parser.add_argument("entry_points", nargs="*", default=list(ENTRY_POINTS))
+    args = parser.parse_args()
+
+    print(f"The medians of {args.repeat} runs:")
+    print(f"  {'entry point':<12} {'import':>8} {'init':>8} {'process':>8}")
+    for entry_point in args.entry_points:
+        runs: list[dict[str, float | None]] = [
+            measure(entry_point, args.import_only) for _ in range(args.repeat)
+        ]
+        print(
+            f"  {entry_point:<12} "
+            f"{_format_median([run['import'] for run in runs]):>8} "
+            f"{_format_median([run['init'] for run in runs]):>8} "
+            f"{_format_median([run['process'] for run in runs]):>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
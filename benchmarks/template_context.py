@@ -0,0 +1,115 @@
+"""
+Compare building the payment template data with `flatten_tortoise_model` and the compiled builder.
+
+The 1,000 paychecks of a group payment fan-out are built in memory, with the relations the template
+needs loaded just like `send_group_payment` loads them. The group payment and its members are
+created in the database of `DATABASE_URL` (a local Postgres with the migrations applied), in a
+transaction which is rolled back at the end (see `benchmarks/_fixtures.py`).
+
+Usage:
+    python -m benchmarks.template_context [--paychecks 1000] [--repeat 5]
+"""
+import argparse
+import asyncio
+import functools
+import time
+import typing
+
+from benchmarks._fixtures import (
+    create_group,
+    create_group_payment,
+    create_monobank_account,
+    create_monobank_client,
+    create_users,
+    rolled_back_database,
+)
+from models import GroupPayment, MonobankAccount, Paycheck, Settings, User
+from tasks import _build_paycheck_for_user, _build_payment_template_data, PAYMENT_FORMATTERS
+from utils.i18n import gettext as _
+from utils.tortoise_orm import flatten_tortoise_model
+
+
+async def seed(members_count: int) -> GroupPayment:
+    """Create a group payment of a group with the members paying to the same account."""
+    admin, *members = await create_users(members_count + 1)
+    monobank_account: MonobankAccount = await create_monobank_account(
+        await create_monobank_client(admin)
+    )
+    await Settings.filter(user_id__in=[member.id for member in members]).update(
+        monobank_account_to_pay_to_id=monobank_account.id
+    )
+
+    return await create_group_payment(await create_group(admin, members))
+
+
+async def build_paychecks(group_payment_id: int) -> list[Paycheck]:
+    """Build the paychecks of the group payment in memory, the way `send_group_payment` does."""
+    group_payment = await GroupPayment.get(id=group_payment_id).select_related("group")
+    users: list[User] = await group_payment.group.users.all().select_related(
+        "settings__monobank_account_to_pay_to"
+    )
+
+    return [_build_paycheck_for_user(group_payment, user) for user in users]
+
+
+def build_with_flatten_tortoise_model(paycheck: Paycheck) -> dict[str, typing.Any]:
+    """Build the payment template data the way it was done before the builders were compiled."""
+    return {
+        key: formatter(value) if (formatter := PAYMENT_FORMATTERS.get(key)) else value
+        for key, value in flatten_tortoise_model(
+            paycheck, separator="__", prefix="paycheck__"
+        ).items()
+    }
+
+
+def measure(
+    build: typing.Callable[[Paycheck], dict[str, typing.Any]],
+    paychecks: list[Paycheck],
+    template: str,
+    repeat: int,
+) -> float:
+    """Get the best time (in seconds) it takes to build and format the messages of all paychecks."""
+    timings: list[float] = []
+    for _attempt in range(repeat):
+        _started_at = time.perf_counter()
+        for paycheck in paychecks:
+            template.format(**build(paycheck))
+        timings.append(time.perf_counter() - _started_at)
+
+    return min(timings)
+
+
+async def run(paychecks_count: int, repeat: int) -> None:
+    """Run the benchmark."""
+    async with rolled_back_database():
+        group_payment: GroupPayment = await seed(paychecks_count)
+        paychecks: list[Paycheck] = await build_paychecks(group_payment.id)
+        template: str = _("tasks.notifications.payment_created.message", "uk")
+
+        build_compiled = functools.partial(_build_payment_template_data, template=template)
+
+        assert template.format(
+            **build_with_flatten_tortoise_model(paychecks[0])
+        ) == template.format(**build_compiled(paychecks[0])), "The messages built differ"
+
+        flatten_took = measure(build_with_flatten_tortoise_model, paychecks, template, repeat)
+        compiled_took = measure(build_compiled, paychecks, template, repeat)
+
+        print(f"{paychecks_count} paychecks, the best of {repeat} runs:")
+        print(f"  flatten_tortoise_model: {flatten_took * 1000:.2f}ms")
+        print(f"  compiled builder:       {compiled_took * 1000:.2f}ms")
+        print(f"  {flatten_took / compiled_took:.1f}x faster")
+
+
+def main():
+    """Parse the arguments, and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--paychecks", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.paychecks, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,12 @@ from typing import Optional, Union
 from aiogram.dispatcher.filters import BoundFilter, FilterNotPassed
 from aiogram.types import ChatActions, Message
 from aiogram.utils.callback_data import CallbackData
+from tortoise.exceptions import DoesNotExist
 
 from models import User
+from utils import fast_queries
 from utils.loguru_logging import logger
+from utils.user_cache import user_cache
 
 
 class AuthFilter(BoundFilter):
@@ -27,20 +30,23 @@ class AuthFilter(BoundFilter):
         """Check whether the user is authenticated and allowed to use the bot."""
         obj: Union[Message, CallbackData] = args[0]
 
-        try:
-            user = self.ctx_user.get()
-        except LookupError:
-            try:
-                # Getting a user from the database might take some time, so let the user know
-                # the bot is typing (i.e. thinking).
-                await ChatActions.typing()
+        if (user := self.ctx_user.get(None)) is None:
+            # The user has most likely been cached by the `MessagesLoggingMiddleware` already
+            if (user := user_cache.get(obj.from_user.id)) is None:
+                try:
+                    # Getting a user from the database might take some time, so let the user know
+                    # the bot is typing (i.e. thinking).
+                    await ChatActions.typing()
 
-                user = await User.get(id=obj.from_user.id)
-                self.ctx_user.set(user)
+                    if (user := await fast_queries.get_user(obj.from_user.id)) is None:
+                        raise DoesNotExist(f"User [ID:{obj.from_user.id}] does not exist")
+                    user_cache.set(user)
 
-            except Exception as e:
-                logger.error(f"Exception in {self.__class__.__name__}: {e} ({e.__class__}")
-                raise e
+                except Exception as e:
+                    logger.error(f"Exception in {self.__class__.__name__}: {e} ({e.__class__}")
+                    raise e
+
+            self.ctx_user.set(user)
 
         if not user.is_active or user.is_deleted:
             logger.info(
@@ -1,27 +1,45 @@
 """The main module of the application."""
 import functools
+import multiprocessing
+import secrets
 
 import aiogram
 import arrow
-import emoji
-from aiogram.contrib.middlewares.i18n import I18nMiddleware
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import any_state
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY, WebhookRequestHandler
+from aiogram.utils.callback_data import CallbackData
+from aiohttp import web
 
 import states
 from filters.auth import AuthFilter
 from middlewares.message_logging_middleware import MessagesLoggingMiddleware
-from models import Group, GroupPayment, Profile, User
+from models import Group, GroupPayment, GroupStats, Profile, User
 from settings import settings
-from tasks import send_group_payment
 from utils import tortoise_orm
+from utils.group_directory import group_directory, register_group_directory_signals
+from utils.i18n import gettext
+from utils.job_queue import job_queue
 from utils.loguru_logging import logger
+from utils.message_log_buffer import message_log_buffer
+from utils.monobank import monobank_api
+from utils.ordered_dispatcher import UserOrderedDispatcher
+from utils.payment_qr import payment_qr_codes
+from utils.read_replica import read_replica
 from utils.redis_storage import redis_storage
+from utils.telegram_bot import bot
 from utils.tortoise_orm import flatten_tortoise_model
-
-bot = aiogram.Bot(settings.TELEGRAM_BOT_TOKEN)
-dp = aiogram.Dispatcher(bot, storage=redis_storage)
+from utils.user_cache import register_user_cache_signals, user_cache
+
+dp = UserOrderedDispatcher(
+    bot,
+    storage=redis_storage,
+    max_user_queue_size=settings.MAX_USER_UPDATE_QUEUE_SIZE,
+    lock_users_across_processes=(
+        settings.BOT_MODE == "webhook" and settings.BOT_WEBHOOK_PROCESSES > 1
+    ),
+)
 
 # region Filters
 dp.bind_filter(
@@ -40,10 +58,9 @@ dp.bind_filter(
 dp.middleware.setup(aiogram.contrib.middlewares.logging.LoggingMiddleware())
 dp.middleware.setup(MessagesLoggingMiddleware())
 
-i18n = I18nMiddleware("messages", default="uk")
-dp.middleware.setup(i18n)
-_ = functools.partial(i18n.gettext, locale="uk")
-__ = functools.partial(i18n.lazy_gettext, locale="uk")
+# NB: The bot talks in Ukrainian to everyone for now
+_ = functools.partial(gettext, language="uk")
+__ = _
 
 
 # endregion
@@ -63,7 +80,8 @@ async def start(message: aiogram.types.Message, state: FSMContext):
         logger.debug(f"Received start payload: {start_payload=}")
 
         if (group_id := start_payload.split("-")[1]) and group_id.isdigit():
-            await state.update_data(group_uid_to_add_to=int(start_payload.split("-")[1]))
+            # NB: Kept as the string it is, the UIDs may have leading zeros
+            await state.update_data(group_uid_to_add_to=group_id)
 
             logger.debug(f"User has been invited to the group: {group_id=}")
         else:
@@ -72,7 +90,7 @@ async def start(message: aiogram.types.Message, state: FSMContext):
     await states.Registration.share_phone_number.set()
 
     return await message.answer(
-        emoji.emojize(_("start.welcome")),
+        _("start.welcome"),
         reply_markup=aiogram.types.ReplyKeyboardMarkup(
             resize_keyboard=True, one_time_keyboard=True
         ).add(
@@ -95,12 +113,12 @@ async def registration_save_phone_number(message: aiogram.types.Message, user: U
 
     if user.phone_number:
         return await message.answer(
-            emoji.emojize(_("registration.phone_number.already_set")),
+            _("registration.phone_number.already_set"),
             reply_markup=aiogram.types.ReplyKeyboardRemove(),
         )
 
     if not message.contact.user_id == message.from_user.id:
-        return await message.answer(emoji.emojize(_("registration.phone_number.not_from_user")))
+        return await message.answer(_("registration.phone_number.not_from_user"))
 
     user.phone_number = message.contact.phone_number
     await user.save()
@@ -108,7 +126,7 @@ async def registration_save_phone_number(message: aiogram.types.Message, user: U
     await states.Registration.share_first_name.set()
 
     return await message.answer(
-        emoji.emojize(_("registration.share_first_name")),
+        _("registration.share_first_name"),
         reply_markup=aiogram.types.ReplyKeyboardRemove(),
     )
 
@@ -130,7 +148,7 @@ async def registration_save_first_name(
     await states.Registration.share_last_name.set()
 
     return await message.answer(
-        emoji.emojize(_("registration.share_last_name")),
+        _("registration.share_last_name"),
         reply_markup=aiogram.types.ReplyKeyboardRemove(),
     )
 
@@ -146,24 +164,22 @@ async def registration_save_last_name(
 
     if not (user_profile := await user.profile):
         logger.error(f"User doesn't have a profile: {user.pk=}")
-        return await message.answer(emoji.emojize(_("registration.error")))
+        return await message.answer(_("registration.error"))
 
     user_profile.last_name = message.text
     await user_profile.save()
 
     if group_uid_to_add_to := (await state.get_data()).get("group_uid_to_add_to"):
-        if group := await Group.get_or_none(uid=group_uid_to_add_to):
+        if group := await group_directory.get_by_uid(group_uid_to_add_to):
             await states.Registration.confirm_coliving.set()
 
             # noinspection StrFormat
             return await message.answer(
-                emoji.emojize(
-                    _("registration.confirm_coliving").format(
-                        **(
-                            flatten_tortoise_model(group, separator="__", prefix="group__")
-                            | flatten_tortoise_model(
-                                user_profile, separator="__", prefix="user__profile__"
-                            )
+                _("registration.confirm_coliving").format(
+                    **(
+                        flatten_tortoise_model(group, separator="__", prefix="group__")
+                        | flatten_tortoise_model(
+                            user_profile, separator="__", prefix="user__profile__"
                         )
                     )
                 ),
@@ -179,18 +195,14 @@ async def registration_save_last_name(
 
             # noinspection StrFormat
             return await message.answer(
-                emoji.emojize(
-                    _("registration.group_not_found").format(
-                        group_uid_to_add_to=group_uid_to_add_to
-                    )
-                ),
+                _("registration.group_not_found").format(group_uid_to_add_to=group_uid_to_add_to),
                 reply_markup=aiogram.types.ReplyKeyboardRemove(),
             )
     else:
         logger.error(f"Group UID to add to not found in the FSM context: {await state.get_data()=}")
 
         return await message.answer(
-            emoji.emojize(_("registration.group_uuid_not_found")),
+            _("registration.group_uuid_not_found"),
             reply_markup=aiogram.types.ReplyKeyboardRemove(),
         )
 
@@ -207,7 +219,7 @@ async def registration_confirm_coliving(
         if group_uid_to_add_to := (await state.get_data()).get("group_uid_to_add_to"):
             logger.debug(f"Adding the user to the group: {group_uid_to_add_to=}")
 
-            if group := await Group.get_or_none(uid=group_uid_to_add_to):
+            if group := await group_directory.get_by_uid(group_uid_to_add_to):
                 await user.groups.add(group)
                 logger.debug(f"Added the user to the group: {group.pk=}, {user.pk=}")
 
@@ -215,14 +227,12 @@ async def registration_confirm_coliving(
 
                 # noinspection StrFormat
                 return await message.answer(
-                    emoji.emojize(
-                        _("registration.complete").format(
-                            **(
-                                flatten_tortoise_model(
-                                    await user.profile, separator="__", prefix="user__profile__"
-                                )
-                                | flatten_tortoise_model(group, separator="__", prefix="group__")
+                    _("registration.complete").format(
+                        **(
+                            flatten_tortoise_model(
+                                await user.profile, separator="__", prefix="user__profile__"
                             )
+                            | flatten_tortoise_model(group, separator="__", prefix="group__")
                         )
                     ),
                     reply_markup=aiogram.types.ReplyKeyboardRemove(),
@@ -232,10 +242,8 @@ async def registration_confirm_coliving(
 
                 # noinspection StrFormat
                 return await message.answer(
-                    emoji.emojize(
-                        _("registration.group_not_found").format(
-                            group_uid_to_add_to=group_uid_to_add_to
-                        )
+                    _("registration.group_not_found").format(
+                        group_uid_to_add_to=group_uid_to_add_to
                     ),
                     reply_markup=aiogram.types.ReplyKeyboardRemove(),
                 )
@@ -243,11 +251,11 @@ async def registration_confirm_coliving(
     elif message.text == _("no"):
         await states.Registration.enter_coliving_name.set()
         return await message.answer(
-            emoji.emojize(_("registration.enter_coliving_name")),
+            _("registration.enter_coliving_name"),
             reply_markup=aiogram.types.ReplyKeyboardRemove(),
         )
     else:
-        return await message.answer(emoji.emojize(_("no_such_option")))
+        return await message.answer(_("no_such_option"))
 
 
 @dp.message_handler(
@@ -268,7 +276,7 @@ async def registration_save_coliving_name(
         )
 
     await state.finish()
-    return await message.answer(emoji.emojize(_("registration.complete")))
+    return await message.answer(_("registration.complete"))
 
 
 # endregion
@@ -276,14 +284,14 @@ async def registration_save_coliving_name(
 
 # region User settings
 @dp.message_handler(commands=["settings"], state=aiogram.filters.state.any_state)
-async def settings(message: aiogram.types.Message):
+async def show_settings(message: aiogram.types.Message):
     """Show the settings menu to the user."""
     logger.debug(f"Received the command: {message.text=}")
 
     await states.Settings.select_settings_type.set()
 
     return await message.answer(
-        emoji.emojize(_("settings")),
+        _("settings"),
         reply_markup=aiogram.types.ReplyKeyboardMarkup(
             resize_keyboard=True, row_width=1, one_time_keyboard=True
         ).add(
@@ -297,6 +305,43 @@ async def settings(message: aiogram.types.Message):
 # region Groups settings
 
 
+# The callback data of the buttons to select a group, and to show another page of the groups
+group_callback_data = CallbackData("group", "id")
+groups_page_callback_data = CallbackData("groups_page", "page")
+
+
+async def make_groups_keyboard(page: int = 0) -> aiogram.types.InlineKeyboardMarkup:
+    """Make the inline keyboard to select a group on the page of the groups, starting with `0`."""
+    groups, pages_count = await group_directory.get_page(page, settings.GROUP_SELECTION_PAGE_SIZE)
+
+    keyboard = aiogram.types.InlineKeyboardMarkup(row_width=2).add(
+        *[
+            aiogram.types.InlineKeyboardButton(
+                group.name, callback_data=group_callback_data.new(id=group.id)
+            )
+            for group in groups
+        ]
+    )
+
+    navigation_buttons: list[aiogram.types.InlineKeyboardButton] = []
+    if page > 0:
+        navigation_buttons.append(
+            aiogram.types.InlineKeyboardButton(
+                "◀️", callback_data=groups_page_callback_data.new(page=page - 1)
+            )
+        )
+    if page + 1 < pages_count:
+        navigation_buttons.append(
+            aiogram.types.InlineKeyboardButton(
+                "▶️", callback_data=groups_page_callback_data.new(page=page + 1)
+            )
+        )
+    if navigation_buttons:
+        keyboard.row(*navigation_buttons)
+
+    return keyboard
+
+
 @dp.message_handler(
     state=states.Settings.select_settings_type,
     content_types=aiogram.types.ContentType.TEXT,
@@ -309,38 +354,73 @@ async def select_group_settings(message: aiogram.types.Message):
     await states.GroupSettings.select_group.set()
 
     return await message.answer(
-        emoji.emojize(_("settings.select_new_group")),
-        reply_markup=aiogram.types.ReplyKeyboardMarkup(
-            resize_keyboard=True, row_width=3, one_time_keyboard=True
-        ).add(*[aiogram.types.KeyboardButton(group.name) for group in await Group.all()]),
+        _("settings.select_new_group"), reply_markup=await make_groups_keyboard()
+    )
+
+
+@dp.callback_query_handler(
+    groups_page_callback_data.filter(), state=states.GroupSettings.select_group
+)
+async def show_groups_page(callback_query: aiogram.types.CallbackQuery, callback_data: dict):
+    """Show another page of the groups to select from."""
+    logger.debug(f"Received the callback data: {callback_data=}")
+
+    await callback_query.message.edit_reply_markup(
+        await make_groups_keyboard(int(callback_data["page"]))
+    )
+    return await callback_query.answer()
+
+
+async def _set_user_group(user: User, group: Group) -> None:
+    """Make the group the only one of the user."""
+    # Remove the user from all the groups and add him to the new one
+    await user.groups.clear()
+    await user.groups.add(group)
+
+
+@dp.callback_query_handler(group_callback_data.filter(), state=states.GroupSettings.select_group)
+async def select_group(
+    callback_query: aiogram.types.CallbackQuery, callback_data: dict, state: FSMContext, user: User
+):
+    """Select the group."""
+    logger.debug(f"Received the callback data: {callback_data=}")
+
+    if not (group := await group_directory.get_by_id(int(callback_data["id"]))):
+        return await callback_query.answer(_("settings.group_not_found"), show_alert=True)
+
+    await _set_user_group(user, group)
+    await state.finish()
+
+    await callback_query.answer()
+    # Replace the keyboard with the result, so that the group cannot be selected again
+    # noinspection StrFormat
+    return await callback_query.message.edit_text(
+        _("settings.group_selected").format(
+            **flatten_tortoise_model(group, separator="__", prefix="group__")
+        )
     )
 
 
 @dp.message_handler(
     state=states.GroupSettings.select_group, content_types=aiogram.types.ContentType.TEXT
 )
-async def select_group(message: aiogram.types.Message, state: FSMContext, user: User):
-    """Select the group."""
+async def select_group_by_name(message: aiogram.types.Message, state: FSMContext, user: User):
+    """Select the group by its name, typed in instead of selected with the keyboard."""
     logger.debug(f"Received the text: {message.text=}")
 
-    if group := await Group.get_or_none(name=message.text):
-        # Remove the user from all the groups and add him to the new one
-        await user.groups.clear()
-        await user.groups.add(group)
-
+    if group := await group_directory.get_by_name(message.text):
+        await _set_user_group(user, group)
         await state.finish()
 
         # noinspection StrFormat
         return await message.answer(
-            emoji.emojize(
-                _("settings.group_selected").format(
-                    **flatten_tortoise_model(group, separator="__", prefix="group__")
-                )
+            _("settings.group_selected").format(
+                **flatten_tortoise_model(group, separator="__", prefix="group__")
             ),
             reply_markup=aiogram.types.ReplyKeyboardRemove(),
         )
     else:
-        return await message.answer(emoji.emojize(_("settings.group_not_found")))
+        return await message.answer(_("settings.group_not_found"))
 
 
 # endregion
@@ -361,7 +441,7 @@ async def select_profile_settings(message: aiogram.types.Message, state: FSMCont
     await state.finish()
 
     return await message.answer(
-        emoji.emojize(_("settings.not_implemented")),
+        _("settings.not_implemented"),
         reply_markup=aiogram.types.ReplyKeyboardRemove(),
     )
 
@@ -386,7 +466,7 @@ async def select_primary_bank_account_settings(message: aiogram.types.Message, s
     await state.finish()
 
     return await message.answer(
-        emoji.emojize(_("settings.not_implemented")),
+        _("settings.not_implemented"),
         reply_markup=aiogram.types.ReplyKeyboardRemove(),
     )
 
@@ -404,15 +484,29 @@ async def groups_stats(message: aiogram.types.Message, user: User):
     logger.debug(f"Received the command: {message.text=}")
 
     if not user.is_admin:
-        return await message.answer(emoji.emojize(_("no_permission")))
-
-    if not (groups := await Group.all()):
-        return await message.answer(emoji.emojize(_("no_groups")))
-
-    stats = [
-        f"<b>{group.name:<10}</b> ({group.uid}): <b>{await group.users.all().count()}</b> users"
-        for group in groups
-    ]
+        return await message.answer(_("no_permission"))
+
+    # The counters are kept up to date by the database, so it's a single query for all the groups,
+    #  made on the replica unless it lags behind the paychecks written
+    async with read_replica.reading():
+        groups: list[Group] = await Group.all().order_by("id").select_related("stats")
+    if not groups:
+        return await message.answer(_("no_groups"))
+
+    stats: list[str] = []
+    for group in groups:
+        # The groups nobody has joined yet may have no stats
+        group_stats: GroupStats = group.stats or GroupStats(group=group)
+
+        paychecks_count: int = group_stats.paid_paychecks_count + group_stats.unpaid_paychecks_count
+        paychecks_amount: int = (
+            group_stats.paid_paychecks_amount + group_stats.unpaid_paychecks_amount
+        )
+        stats.append(
+            f"<b>{group.name:<10}</b> ({group.uid}): <b>{group_stats.users_count}</b> users, "
+            f"<b>{group_stats.paid_paychecks_count}</b>/{paychecks_count} paychecks paid "
+            f"({group_stats.paid_paychecks_amount / 100:.2f}/{paychecks_amount / 100:.2f} UAH)"
+        )
 
     return await message.answer(
         "".join([f"<b>Groups stats</b>\n\n", "<pre>", "\n".join(stats), "</pre>"]),
@@ -427,15 +521,15 @@ async def create_group_payment(message: aiogram.types.Message, user: User):
 
     # TODO: [10/16/2022 by Mykola] Make a decorator for the admin commands.
     if not user.is_admin:
-        return await message.answer(emoji.emojize(_("no_permission")))
+        return await message.answer(_("no_permission"))
 
     if not (groups := await Group.filter(admins__id=user.id)):
-        return await message.answer(emoji.emojize(_("no_groups")))
+        return await message.answer(_("no_groups"))
 
     await states.CreatePayment.enter_group.set()
 
     return await message.answer(
-        emoji.emojize(_("admin.create_group_payment.enter_group")),
+        _("admin.create_group_payment.enter_group"),
         reply_markup=aiogram.types.ReplyKeyboardMarkup(
             resize_keyboard=True, one_time_keyboard=True
         ).add(
@@ -458,7 +552,7 @@ async def create_group_payment_enter_group(
     logger.debug(f"Received the group name: {message.text=}")
 
     if not (group := await Group.filter(admins__id=user.id, name=message.text).first()):
-        return await message.answer(emoji.emojize(_("no_such_group")))
+        return await message.answer(_("no_such_group"))
 
     await state.update_data(group_payment__group_id=group.pk)
 
@@ -466,7 +560,7 @@ async def create_group_payment_enter_group(
 
     return await message.answer(
         # NB: The `amount` must be specified in the smallest currency unit.
-        emoji.emojize(_("admin.create_group_payment.enter_amount")),
+        _("admin.create_group_payment.enter_amount"),
         reply_markup=aiogram.types.ReplyKeyboardRemove(),
     )
 
@@ -486,16 +580,12 @@ async def create_group_payment_enter_amount(
         try:
             amount_major_units, amount_minor_units = (int(part) for part in message.text.split("."))
         except ValueError:
-            return await message.answer(
-                emoji.emojize(_("admin.create_group_payment.invalid_amount"))
-            )
+            return await message.answer(_("admin.create_group_payment.invalid_amount"))
 
         if (amount_major_units <= 0 and amount_minor_units <= 0) or len(
             str(amount_minor_units)
         ) != 2:
-            return await message.answer(
-                emoji.emojize(_("admin.create_group_payment.invalid_amount"))
-            )
+            return await message.answer(_("admin.create_group_payment.invalid_amount"))
 
         # FIXME: [11/4/2022 by Mykola] The `f"{amount_major_units:02}"` doesn't work here.
         amount = int(f"{amount_major_units}{amount_minor_units:02}")
@@ -505,7 +595,7 @@ async def create_group_payment_enter_amount(
     await states.CreatePayment.enter_comment.set()
 
     return await message.answer(
-        emoji.emojize(_("admin.create_group_payment.enter_comment")),
+        _("admin.create_group_payment.enter_comment"),
         reply_markup=aiogram.types.ReplyKeyboardRemove(),
     )
 
@@ -525,7 +615,7 @@ async def create_group_payment_enter_comment(
 
     return await message.answer(
         # NB: The `due_date` must be specified in the format `DD.MM.YYYY` or `DD MM YYYY`.
-        emoji.emojize(_("admin.create_group_payment.enter_due_date")),
+        _("admin.create_group_payment.enter_due_date"),
         reply_markup=aiogram.types.ReplyKeyboardRemove(),
     )
 
@@ -542,11 +632,11 @@ async def create_group_payment_enter_due_date(
     try:
         due_date = arrow.get(message.text.replace(" ", "."), "DD.MM.YYYY").date()
     except ValueError:
-        return await message.answer(emoji.emojize(_("admin.create_group_payment.invalid_due_date")))
+        return await message.answer(_("admin.create_group_payment.invalid_due_date"))
 
     if due_date < arrow.now().date():
         # TODO: [10/19/2022 by Mykola] What if a payment is due today?
-        return await message.answer(emoji.emojize(_("admin.create_group_payment.invalid_due_date")))
+        return await message.answer(_("admin.create_group_payment.invalid_due_date"))
 
     await state.update_data(group_payment__due_date=due_date.isoformat())
 
@@ -562,15 +652,15 @@ async def create_group_payment_enter_due_date(
 
     await state.finish()
 
-    # TODO: [11/1/2022 by Mykola] Do this in a separate worker.
-    await send_group_payment(group_payment.pk)
+    # The paychecks are sent by the worker, which will report back once it's done
+    await job_queue.enqueue(
+        "send_group_payment", group_payment_id=group_payment.pk, notify_user_id=user.id
+    )
 
     # noinspection StrFormat
     return await message.answer(
-        emoji.emojize(
-            _("admin.create_group_payment.success").format(
-                **flatten_tortoise_model(group_payment, separator="__", prefix="group_payment__")
-            )
+        _("admin.create_group_payment.success").format(
+            **flatten_tortoise_model(group_payment, separator="__", prefix="group_payment__")
         ),
         reply_markup=aiogram.types.ReplyKeyboardRemove(),
     )
@@ -580,12 +670,25 @@ async def create_group_payment_enter_due_date(
 
 
 # region Startup and shutdown callbacks
-async def on_startup(*__, **___):
+async def on_startup(*__, database_pool_max_size: int | None = None, **___):
     """Startup the bot."""
     logger.info(f"Starting up the https://t.me/{(await bot.get_me()).username} bot...")
 
     logger.debug("Initializing the database connection...")
-    await tortoise_orm.init()
+    await tortoise_orm.init(role="bot", pool_max_size=database_pool_max_size)
+
+    logger.debug("Registering the signals of the caches...")
+    register_user_cache_signals()
+    register_group_directory_signals()
+
+    logger.debug("Listening for the user cache invalidations...")
+    user_cache.start()
+
+    logger.debug("Listening for the group directory invalidations...")
+    group_directory.start()
+
+    logger.debug("Starting the message log...")
+    message_log_buffer.start()
 
     logger.debug("Setting the bot's commands...")
     await bot.set_my_commands(
@@ -604,13 +707,136 @@ async def on_shutdown(*__, **___):
     """Shutdown the bot."""
     logger.info("Shutting down...")
 
+    logger.debug("Stopping the user cache invalidations listener...")
+    await user_cache.stop()
+
+    logger.debug("Stopping the group directory invalidations listener...")
+    await group_directory.stop()
+
+    logger.debug("Saving the logged messages...")
+    await message_log_buffer.stop()
+
+    logger.debug("Closing the Monobank API connections...")
+    await monobank_api.close()
+
+    logger.debug("Stopping the QR codes rendering processes...")
+    payment_qr_codes.close()
+
     logger.debug("Closing the database connection...")
     await tortoise_orm.shutdown()
 
+    logger.debug(f"Update queues: {dp.queues_stats}")
+    logger.debug(
+        f"FSM storage: {redis_storage.update_round_trips} Redis round trips in "
+        f"{redis_storage.updates} updates, "
+        f"at most {redis_storage.max_update_round_trips} per update"
+    )
+    logger.debug(
+        f"Read replica: {read_replica.replica_reads} reports read from the replica, "
+        f"{read_replica.primary_reads} from the primary"
+    )
     logger.info("Shutdown complete.")
 
 
+# endregion
+
+
+# region Webhook mode
+class TelegramWebhookRequestHandler(WebhookRequestHandler):
+    """The handler of the updates pushed by Telegram, rejecting the ones not sent by Telegram."""
+
+    async def post(self):
+        """Process the update, if it's been sent by Telegram."""
+        # NB: The secret token is required in the webhook mode (see `settings`)
+        if not secrets.compare_digest(
+            self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(),
+            settings.TELEGRAM_WEBHOOK_SECRET_TOKEN.encode(),
+        ):
+            raise web.HTTPUnauthorized()
+
+        return await super().post()
+
+
+async def on_webhook_startup(app: web.Application):
+    """Startup the bot's process, and make Telegram push the updates to the webhook."""
+    await on_startup(
+        database_pool_max_size=max(
+            settings.BOT_DATABASE_MAX_CONNECTIONS // settings.BOT_WEBHOOK_PROCESSES, 1
+        )
+    )
+
+    # Any process would do, but there's no need for all of them to do this
+    if app["process_number"] == 0:
+        logger.debug("Setting the webhook...")
+        await bot.set_webhook(
+            f"{settings.TELEGRAM_WEBHOOK_BASE_URL}{settings.TELEGRAM_WEBHOOK_PATH}",
+            secret_token=settings.TELEGRAM_WEBHOOK_SECRET_TOKEN,
+        )
+
+
+async def on_webhook_shutdown(_app: web.Application):
+    """Shutdown the bot's process."""
+    await on_shutdown()
+
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+
+    session = await bot.get_session()
+    await session.close()
+
+
+def make_webhook_app(process_number: int) -> web.Application:
+    """Make the web application receiving the updates."""
+    app = web.Application()
+    app[BOT_DISPATCHER_KEY] = dp
+    app["process_number"] = process_number
+
+    app.router.add_route("POST", settings.TELEGRAM_WEBHOOK_PATH, TelegramWebhookRequestHandler)
+    app.on_startup.append(on_webhook_startup)
+    app.on_shutdown.append(on_webhook_shutdown)
+
+    return app
+
+
+def run_webhook_server(process_number: int):
+    """Run one of the bot's web server processes. All of them listen on the same port."""
+    logger.info(f"Starting the bot's web server process #{process_number}...")
+    web.run_app(
+        make_webhook_app(process_number),
+        host=settings.WEB_SERVER_HOST,
+        port=settings.BOT_WEBHOOK_PORT,
+        # The kernel balances the connections between the processes
+        reuse_port=True,
+        print=None,
+    )
+
+
+def start_webhook():
+    """Run the bot's web server in `BOT_WEBHOOK_PROCESSES` processes."""
+    if not settings.TELEGRAM_WEBHOOK_BASE_URL:
+        raise RuntimeError("`TELEGRAM_WEBHOOK_BASE_URL` must be set to run the bot with a webhook")
+
+    # Spawn, not fork, so that each process makes its own connections and event loop
+    context = multiprocessing.get_context("spawn")
+    processes: list[multiprocessing.Process] = [
+        context.Process(target=run_webhook_server, args=(process_number,), daemon=True)
+        for process_number in range(1, settings.BOT_WEBHOOK_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        run_webhook_server(process_number=0)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
 # endregion
 
 if __name__ == "__main__":
-    aiogram.executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    if settings.BOT_MODE == "webhook":
+        start_webhook()
+    else:
+        aiogram.executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
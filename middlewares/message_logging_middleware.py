@@ -5,7 +5,11 @@ from aiogram.dispatcher.middlewares import BaseMiddleware
 from arrow import arrow
 
 from models import Message, User
+from utils import fast_queries
 from utils.loguru_logging import logger
+from utils.message_log_buffer import message_log_buffer
+from utils.onboarding import onboard_user
+from utils.user_cache import user_cache
 
 
 class MessagesLoggingMiddleware(BaseMiddleware):
@@ -15,34 +19,43 @@ class MessagesLoggingMiddleware(BaseMiddleware):
         """Save the message into the database _before_ processing it."""
         user_data: dict = msg.from_user.to_python()
         try:
-            # Create a user first, if not exist. Otherwise, we are unable to create a message
-            # with a foreign key.
-            user, created = await User.get_or_create(id=user_data.pop("id"), defaults=user_data)
-
-            if created:
-                if payload := msg.get_args():
-                    user.start_payload = payload
-                    await user.save()
-                logger.info(
-                    f"New user [ID:{user.pk}] [USERNAME:@{user.username}] "
-                    f"with {user.start_payload=}"
-                )
-            else:
-                # Update the user once a day
-                if user.date_updated < arrow.Arrow.utcnow().shift(days=-1).datetime:
-                    await user.update_from_dict(msg.from_user.to_python()).save()
-                    logger.debug(f"User [ID:{user.pk}] updated")
+            if (user := user_cache.get(msg.from_user.id)) is None:
+                # Almost all the users exist already, so look them up on the fast path first
+                if (user := await fast_queries.get_user(msg.from_user.id)) is None:
+                    # Create a user first, if not exist. Otherwise, we are unable to create
+                    # a message with a foreign key.
+                    user, created = await onboard_user(
+                        User(**user_data, start_payload=msg.get_args() or None)
+                    )
+
+                    if created:
+                        logger.info(
+                            f"New user [ID:{user.pk}] [USERNAME:@{user.username}] "
+                            f"with {user.start_payload=}"
+                        )
+
+                # Share the user with the `AuthFilter` and the next updates
+                user_cache.set(user)
+
+            # Update the user once a day
+            if user.date_updated < arrow.Arrow.utcnow().shift(days=-1).datetime:
+                await user.update_from_dict(msg.from_user.to_python()).save()
+                logger.debug(f"User [ID:{user.pk}] updated")
 
         except Exception as e:
             logger.error(f"Exception in {self.__class__.__name__}: {e} ({e.__class__}")
             raise e
 
-        message = await Message.create(
-            **msg.to_python(),
-            user=user,
-            chat_id=msg.chat.id,
-            content_type=msg.content_type,
-        )
-        logger.info(
-            f"Logged message [ID:{message.message_id}] in chat [{msg.chat.type}:{msg.chat.id}]"
+        if not message_log_buffer.should_log(msg.content_type):
+            return
+
+        # The message is saved in the background, so the handlers do not wait for it
+        message_log_buffer.add(
+            Message(
+                **msg.to_python(),
+                user=user,
+                chat_id=msg.chat.id,
+                content_type=msg.content_type,
+            )
         )
+        logger.info(f"Logged message [ID:{msg.message_id}] in chat [{msg.chat.type}:{msg.chat.id}]")
@@ -0,0 +1,10 @@
+-- upgrade --
+ALTER TABLE "monobank_account"
+    ADD "last_statement_time" TIMESTAMPTZ;
+ALTER TABLE "monobank_account"
+    ADD "last_statement_id" VARCHAR(16);
+-- downgrade --
+ALTER TABLE "monobank_account"
+    DROP COLUMN "last_statement_time";
+ALTER TABLE "monobank_account"
+    DROP COLUMN "last_statement_id";
@@ -0,0 +1,48 @@
+-- upgrade --
+-- NB: aerich splits the migrations by ";\n", so the `DO` blocks are kept on single lines
+SET LOCAL TIME ZONE 'UTC';
+ALTER TABLE "message"
+    RENAME TO "message_unpartitioned";
+ALTER INDEX "message_pkey" RENAME TO "message_unpartitioned_pkey";
+CREATE TABLE "message"
+(
+    "id"           INT         NOT NULL DEFAULT nextval('message_id_seq'),
+    "date_added"   TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "date_updated" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "message_id"   INT         NOT NULL,
+    "chat_id"      BIGINT,
+    "content_type" TEXT,
+    "text"         TEXT,
+    "date"         TIMESTAMPTZ NOT NULL,
+    "user_id"      BIGINT      NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+    PRIMARY KEY ("id", "date")
+) PARTITION BY RANGE ("date");
+COMMENT ON TABLE "message" IS 'The model for the Telegram message.';
+ALTER SEQUENCE "message_id_seq" OWNED BY "message"."id";
+CREATE INDEX "idx_message_user_id" ON "message" ("user_id");
+DO $$ DECLARE month_start TIMESTAMPTZ; BEGIN FOR month_start IN SELECT generate_series(date_trunc('month', coalesce((SELECT min("date") FROM "message_unpartitioned"), now())), date_trunc('month', now()) + INTERVAL '2 months', INTERVAL '1 month') LOOP EXECUTE format('CREATE TABLE %I PARTITION OF "message" FOR VALUES FROM (%L) TO (%L)', 'message_' || to_char(month_start, 'YYYY_MM'), month_start, month_start + INTERVAL '1 month'); END LOOP; END $$;
+INSERT INTO "message"
+SELECT *
+FROM "message_unpartitioned";
+DROP TABLE "message_unpartitioned";
+-- downgrade --
+ALTER TABLE "message"
+    RENAME TO "message_partitioned";
+CREATE TABLE "message"
+(
+    "id"           INT         NOT NULL DEFAULT nextval('message_id_seq') PRIMARY KEY,
+    "date_added"   TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "date_updated" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "message_id"   INT         NOT NULL,
+    "chat_id"      BIGINT,
+    "content_type" TEXT,
+    "text"         TEXT,
+    "date"         TIMESTAMPTZ NOT NULL,
+    "user_id"      BIGINT      NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE
+);
+COMMENT ON TABLE "message" IS 'The model for the Telegram message.';
+ALTER SEQUENCE "message_id_seq" OWNED BY "message"."id";
+INSERT INTO "message"
+SELECT *
+FROM "message_partitioned";
+DROP TABLE "message_partitioned";
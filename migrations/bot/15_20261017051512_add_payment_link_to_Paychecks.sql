@@ -0,0 +1,29 @@
+-- upgrade --
+ALTER TABLE "paycheck"
+    ADD "payment_link" TEXT;
+-- The same link `tasks._generate_payment_link` generates, down to the `None`s of the f-strings
+UPDATE "paycheck"
+SET "payment_link" = 'https://bank.gov.ua/qr/' || rtrim(translate(replace(encode(convert_to(
+        'BCD' || E'\n' ||
+        '002' || E'\n' ||
+        '2' || E'\n' ||
+        'UCT' || E'\n' ||
+        E'\n' ||
+        coalesce("monobank_account"."name", 'None') || E'\n' ||
+        "monobank_account"."iban" || E'\n' ||
+        'UAH' || to_char("paycheck"."amount" / 100.0, 'FM9999999990.00') || E'\n' ||
+        coalesce("monobank_account"."edrpou", 'None') || E'\n' ||
+        E'\n' ||
+        E'\n' ||
+        "paycheck"."comment" || ' [' || "group"."name" || '] [' || "paycheck"."id" || ']' || E'\n',
+        'WIN1251'
+    ), 'base64'), E'\n', ''), '+/', '-_'), '=')
+FROM "monobank_account",
+     "group_payment",
+     "group"
+WHERE "paycheck"."to_account_id" = "monobank_account"."id"
+  AND "paycheck"."generated_from_group_payment_id" = "group_payment"."id"
+  AND "group_payment"."group_id" = "group"."id";
+-- downgrade --
+ALTER TABLE "paycheck"
+    DROP COLUMN "payment_link";
@@ -0,0 +1,81 @@
+-- upgrade --
+-- NB: aerich splits the migrations by ";\n", so the functions are kept on single lines
+CREATE TABLE IF NOT EXISTS "group_stats"
+(
+    "id"                      SERIAL      NOT NULL PRIMARY KEY,
+    "date_added"              TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "date_updated"            TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "users_count"             INT         NOT NULL DEFAULT 0,
+    "paid_paychecks_count"    INT         NOT NULL DEFAULT 0,
+    "unpaid_paychecks_count"  INT         NOT NULL DEFAULT 0,
+    "paid_paychecks_amount"   BIGINT      NOT NULL DEFAULT 0,
+    "unpaid_paychecks_amount" BIGINT      NOT NULL DEFAULT 0,
+    "group_id"                INT         NOT NULL UNIQUE REFERENCES "group" ("id") ON DELETE CASCADE
+);
+COMMENT ON TABLE "group_stats" IS 'The model for the statistics of the group.';
+-- Add the deltas (`$2`-`$6`, in the order of the columns) to the counters of the group `$1`, unless it is being deleted
+CREATE OR REPLACE FUNCTION "add_to_group_stats"(INT, INT, INT, INT, BIGINT, BIGINT) RETURNS VOID AS $$ INSERT INTO "group_stats" ("group_id", "users_count", "paid_paychecks_count", "unpaid_paychecks_count", "paid_paychecks_amount", "unpaid_paychecks_amount") SELECT "id", $2, $3, $4, $5, $6 FROM "group" WHERE "id" = $1 ON CONFLICT ("group_id") DO UPDATE SET "users_count" = "group_stats"."users_count" + EXCLUDED."users_count", "paid_paychecks_count" = "group_stats"."paid_paychecks_count" + EXCLUDED."paid_paychecks_count", "unpaid_paychecks_count" = "group_stats"."unpaid_paychecks_count" + EXCLUDED."unpaid_paychecks_count", "paid_paychecks_amount" = "group_stats"."paid_paychecks_amount" + EXCLUDED."paid_paychecks_amount", "unpaid_paychecks_amount" = "group_stats"."unpaid_paychecks_amount" + EXCLUDED."unpaid_paychecks_amount", "date_updated" = CURRENT_TIMESTAMP $$ LANGUAGE sql;
+CREATE OR REPLACE FUNCTION "update_group_stats_users"() RETURNS TRIGGER AS $$ BEGIN IF TG_OP = 'INSERT' THEN PERFORM "add_to_group_stats"("group_id", count(*)::INT, 0, 0, 0, 0) FROM "new_members" GROUP BY "group_id"; ELSE PERFORM "add_to_group_stats"("group_id", -count(*)::INT, 0, 0, 0, 0) FROM "old_members" GROUP BY "group_id"; END IF; RETURN NULL; END $$ LANGUAGE plpgsql;
+CREATE TRIGGER "group_stats_users_added"
+    AFTER INSERT
+    ON "group__user"
+    REFERENCING NEW TABLE AS "new_members"
+    FOR EACH STATEMENT
+EXECUTE FUNCTION "update_group_stats_users"();
+CREATE TRIGGER "group_stats_users_removed"
+    AFTER DELETE
+    ON "group__user"
+    REFERENCING OLD TABLE AS "old_members"
+    FOR EACH STATEMENT
+EXECUTE FUNCTION "update_group_stats_users"();
+-- An updated paycheck is counted out as it was, and counted in as it is
+CREATE OR REPLACE FUNCTION "update_group_stats_paychecks"() RETURNS TRIGGER AS $$ BEGIN IF TG_OP IN ('UPDATE', 'DELETE') THEN PERFORM "add_to_group_stats"("group_payment"."group_id", 0, -(count(*) FILTER (WHERE "old_paychecks"."is_paid"))::INT, -(count(*) FILTER (WHERE NOT "old_paychecks"."is_paid"))::INT, -coalesce(sum("old_paychecks"."amount") FILTER (WHERE "old_paychecks"."is_paid"), 0), -coalesce(sum("old_paychecks"."amount") FILTER (WHERE NOT "old_paychecks"."is_paid"), 0)) FROM "old_paychecks" JOIN "group_payment" ON "group_payment"."id" = "old_paychecks"."generated_from_group_payment_id" GROUP BY "group_payment"."group_id"; END IF; IF TG_OP IN ('INSERT', 'UPDATE') THEN PERFORM "add_to_group_stats"("group_payment"."group_id", 0, (count(*) FILTER (WHERE "new_paychecks"."is_paid"))::INT, (count(*) FILTER (WHERE NOT "new_paychecks"."is_paid"))::INT, coalesce(sum("new_paychecks"."amount") FILTER (WHERE "new_paychecks"."is_paid"), 0), coalesce(sum("new_paychecks"."amount") FILTER (WHERE NOT "new_paychecks"."is_paid"), 0)) FROM "new_paychecks" JOIN "group_payment" ON "group_payment"."id" = "new_paychecks"."generated_from_group_payment_id" GROUP BY "group_payment"."group_id"; END IF; RETURN NULL; END $$ LANGUAGE plpgsql;
+CREATE TRIGGER "group_stats_paychecks_created"
+    AFTER INSERT
+    ON "paycheck"
+    REFERENCING NEW TABLE AS "new_paychecks"
+    FOR EACH STATEMENT
+EXECUTE FUNCTION "update_group_stats_paychecks"();
+CREATE TRIGGER "group_stats_paychecks_updated"
+    AFTER UPDATE
+    ON "paycheck"
+    REFERENCING OLD TABLE AS "old_paychecks" NEW TABLE AS "new_paychecks"
+    FOR EACH STATEMENT
+EXECUTE FUNCTION "update_group_stats_paychecks"();
+CREATE TRIGGER "group_stats_paychecks_deleted"
+    AFTER DELETE
+    ON "paycheck"
+    REFERENCING OLD TABLE AS "old_paychecks"
+    FOR EACH STATEMENT
+EXECUTE FUNCTION "update_group_stats_paychecks"();
+-- The paychecks of a deleted group payment are deleted after it, when it cannot be joined anymore
+CREATE OR REPLACE FUNCTION "update_group_stats_group_payment_deleted"() RETURNS TRIGGER AS $$ BEGIN PERFORM "add_to_group_stats"(OLD."group_id", 0, -(count(*) FILTER (WHERE "is_paid"))::INT, -(count(*) FILTER (WHERE NOT "is_paid"))::INT, -coalesce(sum("amount") FILTER (WHERE "is_paid"), 0), -coalesce(sum("amount") FILTER (WHERE NOT "is_paid"), 0)) FROM "paycheck" WHERE "generated_from_group_payment_id" = OLD."id"; RETURN OLD; END $$ LANGUAGE plpgsql;
+CREATE TRIGGER "group_stats_group_payment_deleted"
+    BEFORE DELETE
+    ON "group_payment"
+    FOR EACH ROW
+EXECUTE FUNCTION "update_group_stats_group_payment_deleted"();
+INSERT INTO "group_stats" ("group_id", "users_count", "paid_paychecks_count", "unpaid_paychecks_count",
+                           "paid_paychecks_amount", "unpaid_paychecks_amount")
+SELECT "group"."id",
+       (SELECT count(*) FROM "group__user" WHERE "group__user"."group_id" = "group"."id"),
+       count("paycheck"."id") FILTER (WHERE "paycheck"."is_paid"),
+       count("paycheck"."id") FILTER (WHERE NOT "paycheck"."is_paid"),
+       coalesce(sum("paycheck"."amount") FILTER (WHERE "paycheck"."is_paid"), 0),
+       coalesce(sum("paycheck"."amount") FILTER (WHERE NOT "paycheck"."is_paid"), 0)
+FROM "group"
+         LEFT JOIN "group_payment" ON "group_payment"."group_id" = "group"."id"
+         LEFT JOIN "paycheck" ON "paycheck"."generated_from_group_payment_id" = "group_payment"."id"
+GROUP BY "group"."id";
+-- downgrade --
+DROP TRIGGER IF EXISTS "group_stats_group_payment_deleted" ON "group_payment";
+DROP TRIGGER IF EXISTS "group_stats_paychecks_deleted" ON "paycheck";
+DROP TRIGGER IF EXISTS "group_stats_paychecks_updated" ON "paycheck";
+DROP TRIGGER IF EXISTS "group_stats_paychecks_created" ON "paycheck";
+DROP TRIGGER IF EXISTS "group_stats_users_removed" ON "group__user";
+DROP TRIGGER IF EXISTS "group_stats_users_added" ON "group__user";
+DROP FUNCTION IF EXISTS "update_group_stats_group_payment_deleted"();
+DROP FUNCTION IF EXISTS "update_group_stats_paychecks"();
+DROP FUNCTION IF EXISTS "update_group_stats_users"();
+DROP FUNCTION IF EXISTS "add_to_group_stats"(INT, INT, INT, INT, BIGINT, BIGINT);
+DROP TABLE IF EXISTS "group_stats";
@@ -0,0 +1,51 @@
+-- upgrade --
+-- NB: Run in a transaction by aerich, so the indexes cannot be created `CONCURRENTLY`
+-- Keep a single paycheck per user per group payment: the paid one, or else the earliest one.
+--  The duplicates already paid to are kept, so that the unique index fails instead of losing them
+DELETE
+FROM "paycheck"
+WHERE "id" IN (SELECT "ranked_paycheck"."id"
+               FROM (SELECT "id",
+                            row_number() OVER (
+                                PARTITION BY "generated_from_group_payment_id", "for_user_id"
+                                ORDER BY "is_paid" DESC, "date_added", "id"
+                                ) AS "rank"
+                     FROM "paycheck"
+                     WHERE "generated_from_group_payment_id" IS NOT NULL) AS "ranked_paycheck"
+               WHERE "ranked_paycheck"."rank" > 1
+                 AND NOT EXISTS(SELECT 1
+                                FROM "monobank_account_statement"
+                                WHERE "monobank_account_statement"."paycheck_id" = "ranked_paycheck"."id"));
+CREATE UNIQUE INDEX "uid_paycheck_group_payment_user" ON "paycheck" ("generated_from_group_payment_id", "for_user_id");
+CREATE INDEX "idx_paycheck_for_user_id" ON "paycheck" ("for_user_id");
+-- For the polling scheduler, looking for the unpaid paychecks of the accounts
+CREATE INDEX "idx_paycheck_unpaid_to_account_id" ON "paycheck" ("to_account_id") WHERE NOT "is_paid";
+CREATE INDEX "idx_monobank_account_statement_account_time" ON "monobank_account_statement" ("monobank_account_id", "time");
+CREATE INDEX "idx_monobank_account_statement_paycheck_id" ON "monobank_account_statement" ("paycheck_id") WHERE "paycheck_id" IS NOT NULL;
+CREATE INDEX "idx_group_payment_group_id" ON "group_payment" ("group_id");
+CREATE INDEX "idx_group_name" ON "group" ("name");
+-- The memberships are added once only, so the duplicates (if any) are dropped
+DELETE
+FROM "group__user" "duplicate" USING "group__user" "original"
+WHERE "duplicate"."group_id" = "original"."group_id"
+  AND "duplicate"."user_id" = "original"."user_id"
+  AND "duplicate"."ctid" > "original"."ctid";
+CREATE UNIQUE INDEX "uid_group__user_group_id_user_id" ON "group__user" ("group_id", "user_id");
+CREATE INDEX "idx_group__user_user_id" ON "group__user" ("user_id");
+DELETE
+FROM "group__admin" "duplicate" USING "group__admin" "original"
+WHERE "duplicate"."group_id" = "original"."group_id"
+  AND "duplicate"."user_id" = "original"."user_id"
+  AND "duplicate"."ctid" > "original"."ctid";
+CREATE UNIQUE INDEX "uid_group__admin_user_id_group_id" ON "group__admin" ("user_id", "group_id");
+-- downgrade --
+DROP INDEX IF EXISTS "uid_group__admin_user_id_group_id";
+DROP INDEX IF EXISTS "idx_group__user_user_id";
+DROP INDEX IF EXISTS "uid_group__user_group_id_user_id";
+DROP INDEX IF EXISTS "idx_group_name";
+DROP INDEX IF EXISTS "idx_group_payment_group_id";
+DROP INDEX IF EXISTS "idx_monobank_account_statement_paycheck_id";
+DROP INDEX IF EXISTS "idx_monobank_account_statement_account_time";
+DROP INDEX IF EXISTS "idx_paycheck_unpaid_to_account_id";
+DROP INDEX IF EXISTS "idx_paycheck_for_user_id";
+DROP INDEX IF EXISTS "uid_paycheck_group_payment_user";
@@ -0,0 +1,9 @@
+-- upgrade --
+ALTER TABLE "paycheck"
+    ADD "is_sent" BOOL NOT NULL DEFAULT False;
+-- The paychecks created so far have been sent already
+UPDATE "paycheck"
+SET "is_sent" = TRUE;
+-- downgrade --
+ALTER TABLE "paycheck"
+    DROP COLUMN "is_sent";
@@ -0,0 +1,5 @@
+-- upgrade --
+-- For `tasks.rematch_account_statements`, looking for the recent statements left unmatched
+CREATE INDEX "idx_monobank_account_statement_unmatched_date_added" ON "monobank_account_statement" ("date_added") WHERE "paycheck_id" IS NULL AND "amount" > 0;
+-- downgrade --
+DROP INDEX IF EXISTS "idx_monobank_account_statement_unmatched_date_added";
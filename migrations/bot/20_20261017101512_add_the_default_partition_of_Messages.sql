@@ -0,0 +1,6 @@
+-- upgrade --
+-- The messages with no partition for their date (e.g. not created by the worker in time) are kept
+--  here instead of failing to be saved, and moved out by `create_message_partition`
+CREATE TABLE "message_default" PARTITION OF "message" DEFAULT;
+-- downgrade --
+DROP TABLE "message_default";
@@ -5,7 +5,6 @@ from __future__ import annotations
 import typing
 import uuid
 
-import tortoise.signals
 from tortoise import fields
 
 from utils.tortoise_orm import Model
@@ -76,19 +75,6 @@ class User(BaseModel):
         return f"{self.first_name} {self.last_name}"
 
 
-@tortoise.signals.post_save(User)
-async def create_profile_and_settings(
-    sender: typing.Type[User], instance: User, created: bool, *_, **__
-):
-    """Create a profile and settings for the user."""
-    if created:
-        await Profile.create(user=instance)
-        await Settings.create(
-            user=instance,
-            monobank_account_to_pay_to=await MonobankAccount.all().order_by("date_added").first(),
-        )
-
-
 class Message(BaseModel):
     """The model for the Telegram message."""
 
@@ -96,6 +82,11 @@ class Message(BaseModel):
         "bot.User", related_name="messages"
     )
 
+    # NB: The table is partitioned by the `date`, so its primary key is (`id`, `date`), which
+    #  Tortoise cannot declare. The `id` alone is still unique (it's taken from a sequence), but
+    #  the lookups by it go through all the partitions, so filter by the `date` too where possible
+    id = fields.IntField(pk=True)
+
     message_id = fields.IntField()
     chat_id = fields.BigIntField(null=True)
 
@@ -149,6 +140,27 @@ class Group(BaseModel):
         "bot.User", related_name="created_groups"
     )
     payments: fields.ReverseRelation[GroupPayment]
+    stats: fields.BackwardOneToOneRelation[GroupStats]
+
+
+class GroupStats(BaseModel):
+    """
+    The model for the statistics of the group.
+
+    The counters are kept up to date by the database triggers on the `group__user`, `paycheck` and
+    `group_payment` tables (see the `16_20261017061512_add_GroupStats.sql` migration), so they must
+    never be saved from here.
+    """
+
+    group: fields.OneToOneRelation[Group] = fields.OneToOneField("bot.Group", related_name="stats")
+
+    users_count = fields.IntField(default=0)
+
+    # Of the paychecks generated from the group's payments
+    paid_paychecks_count = fields.IntField(default=0)
+    unpaid_paychecks_count = fields.IntField(default=0)
+    paid_paychecks_amount = fields.BigIntField(default=0)
+    unpaid_paychecks_amount = fields.BigIntField(default=0)
 
 
 # region Monobank models
@@ -193,6 +205,10 @@ class MonobankAccount(BaseModel):
     name = fields.TextField(null=True)
     edrpou = fields.CharField(max_length=10, null=True)
 
+    # The newest statement pulled by the poller, so that the next poll only pulls the newer ones
+    last_statement_time = fields.DatetimeField(null=True)
+    last_statement_id = fields.CharField(max_length=16, null=True)
+
     account_statements: fields.ReverseRelation[MonobankAccountStatement]
 
     paying_users_settings: fields.ReverseRelation[Settings]
@@ -275,7 +291,12 @@ class Paycheck(BaseModel):
     currency_symbol = fields.CharField(max_length=3)
     currency_code = fields.SmallIntField()
 
+    # The bank.gov.ua link to pay the paycheck, generated once the paycheck is created
+    payment_link = fields.TextField(null=True)
+
     is_paid = fields.BooleanField(default=False)
+    # Whether the paycheck has been delivered, so that a failed fan-out resends the undelivered ones
+    is_sent = fields.BooleanField(default=False)
     generated_from_group_payment: fields.ForeignKeyNullableRelation[
         GroupPayment
     ] = fields.ForeignKeyField(
@@ -284,6 +305,12 @@ class Paycheck(BaseModel):
 
     paid_account_statements: fields.ReverseRelation[MonobankAccountStatement]
 
+    class Meta:
+        """The metaclass for the paycheck."""
+
+        # A group payment is paid by each of the group's users only once
+        unique_together = (("generated_from_group_payment", "for_user"),)
+
 
 class GroupPayment(BaseModel):
     """
@@ -1,4 +1,7 @@
 """The module for the settings of the application."""
+import pathlib
+import typing
+
 import pydantic
 
 
@@ -14,6 +17,148 @@ class Settings(pydantic.BaseSettings):
 
     TIMEZONE: str = "Europe/Kiev"
 
+    # How the bot receives the updates: by long polling in a single process, or with a webhook
+    #  served by `BOT_WEBHOOK_PROCESSES` processes sharing the `BOT_WEBHOOK_PORT`
+    BOT_MODE: typing.Literal["polling", "webhook"] = "polling"
+    # How many updates of a single user can wait to be processed, before the new ones are dropped
+    MAX_USER_UPDATE_QUEUE_SIZE: int = 10
+    # How long a user's updates are kept locked by a dead webhook process, in the other processes
+    #  (see `CachingRedisStorage.locking_user`)
+    USER_UPDATE_LOCK_TIMEOUT: int = 60  # seconds
+    # How long the FSM states and data of the abandoned conversations are kept in Redis, since
+    #  they were last changed (see `utils/redis_storage.py`)
+    FSM_STATE_TTL: int | None = 60 * 60 * 24 * 7  # seconds
+    FSM_DATA_TTL: int | None = 60 * 60 * 24 * 7  # seconds
+    # The Telegram Bot API server to use instead of the official one, e.g. the fake one for testing
+    TELEGRAM_API_URL: pydantic.AnyHttpUrl | None = None
+    # The public URL of the bot's web server, required in the webhook mode
+    TELEGRAM_WEBHOOK_BASE_URL: pydantic.AnyHttpUrl | None = None
+    TELEGRAM_WEBHOOK_PATH: str = "/telegram/webhook"
+    # Sent by Telegram with every update, so that no one else can push the updates. Required in the
+    #  webhook mode, 1-256 characters of `A-Z`, `a-z`, `0-9`, `_` and `-` (as Telegram allows)
+    TELEGRAM_WEBHOOK_SECRET_TOKEN: pydantic.constr(regex=r"^[\w-]{1,256}$") | None = None
+    BOT_WEBHOOK_PORT: int = 8081
+    BOT_WEBHOOK_PROCESSES: int = 1
+
+    # The database connection pools (see `utils/tortoise_orm.py`), sized per process role.
+    #  The connections of the bot are split evenly between its webhook processes
+    BOT_DATABASE_MAX_CONNECTIONS: int = 10
+    WORKER_DATABASE_MAX_CONNECTIONS: int = 10
+    WEBHOOKS_DATABASE_MAX_CONNECTIONS: int = 5
+    DATABASE_MIN_CONNECTIONS: int = 1
+    # How many prepared statements each connection keeps, `0` behind PgBouncer in transaction mode
+    DATABASE_STATEMENT_CACHE_SIZE: int = 1024
+    DATABASE_COMMAND_TIMEOUT: float | None = 30  # seconds
+    DATABASE_MAX_INACTIVE_CONNECTION_LIFETIME: float = 60 * 5  # seconds
+    # The read replica for the reporting queries (see `utils/read_replica.py`), if any
+    DATABASE_REPLICA_URL: pydantic.PostgresDsn | None = None
+    DATABASE_REPLICA_MAX_CONNECTIONS: int = 2
+    # How far behind the primary the replica can be, before the reports are read from the primary
+    DATABASE_REPLICA_MAX_LAG: float = 30  # seconds
+    DATABASE_REPLICA_LAG_CHECK_INTERVAL: float = 5  # seconds
+
+    # How many paycheck messages can be sent concurrently during a group payment fan-out
+    GROUP_PAYMENT_SENDER_CONCURRENCY: int = 10
+
+    # The QR codes of the payment links sent along with the paychecks (see `utils/payment_qr.py`)
+    PAYMENT_QR_CODES: bool = True
+    PAYMENT_QR_CACHE_DIR: pathlib.Path = pathlib.Path("cache/payment_qr")
+    PAYMENT_QR_RENDER_PROCESSES: int = 2
+    # How long to reuse the QR code uploaded to Telegram, instead of uploading it again
+    PAYMENT_QR_FILE_ID_TTL: int = 60 * 60 * 24 * 90  # seconds
+
+    # Telegram Bot API sending limits (messages per second). The global one is shared by all the
+    #  processes (see `utils/telegram_rate_limiter.py`)
+    TELEGRAM_GLOBAL_RATE_LIMIT: float = 30
+    TELEGRAM_PER_CHAT_RATE_LIMIT: float = 1
+    TELEGRAM_RETRY_AFTER_MAX_RETRIES: int = 3
+
+    # The in-process cache of the users seen recently (see `utils/user_cache.py`)
+    USER_CACHE_MAX_SIZE: int = 10_000
+    USER_CACHE_TTL: float = 60 * 5  # seconds
+
+    # How long to reuse the default account the new users pay to (see `utils/onboarding.py`)
+    ONBOARDING_DEFAULT_ACCOUNT_TTL: float = 60 * 10  # seconds
+
+    # The in-process directory of the groups (see `utils/group_directory.py`)
+    GROUP_DIRECTORY_TTL: float = 60 * 10  # seconds
+    # How many groups to show on a single page of the inline keyboard to select a group
+    GROUP_SELECTION_PAGE_SIZE: int = 8
+
+    # The incoming messages logged into the database (see `utils/message_log_buffer.py`)
+    MESSAGE_LOG_BATCH_SIZE: int = 100
+    MESSAGE_LOG_FLUSH_INTERVAL: float = 5  # seconds
+    MESSAGE_LOG_MAX_BUFFERED: int = 10_000
+    # The share of the messages to log by their content type, e.g. `{"sticker": 0.1, "photo": 0}`
+    MESSAGE_LOG_SAMPLE_RATES: dict[str, float] = {}
+    MESSAGE_LOG_DEFAULT_SAMPLE_RATE: float = 1
+    # The logged messages are kept in the database for `MESSAGE_RETENTION_DAYS` days, then moved to
+    #  the archives in `MESSAGE_ARCHIVE_DIR` (see `utils/message_archive.py`). It must be a durable
+    #  volume mounted to the worker, not its ephemeral disk. Until it is set, nothing is archived
+    MESSAGE_RETENTION_DAYS: int = 180
+    MESSAGE_ARCHIVE_DIR: pathlib.Path | None = None
+    MESSAGE_PARTITIONS_AHEAD: int = 2  # months
+    MESSAGE_RETENTION_INTERVAL: int = 60 * 60 * 24  # seconds
+
+    # The Redis-backed job queue consumed by the worker
+    JOB_QUEUE_CONSUMERS: int = 4
+    JOB_QUEUE_MAX_ATTEMPTS: int = 3
+    JOB_QUEUE_RETRY_DELAY: float = 30  # seconds, doubled after every failed attempt
+    JOB_QUEUE_VISIBILITY_TIMEOUT: float = 60 * 10  # seconds before a dead consumer's job is rerun
+
+    # The Monobank API client
+    MONOBANK_API_MAX_RETRIES: int = 3
+    MONOBANK_API_TIMEOUT: float = 30  # seconds
+    MONOBANK_API_CONNECT_TIMEOUT: float = 10  # seconds
+
+    # The web server receiving the webhooks (see `webhooks.py`)
+    WEB_SERVER_HOST: str = "0.0.0.0"
+    PORT: int = 8080
+
+    # The public URL of the web server. If set, Monobank pushes the new statements there, and the
+    # statements are polled only to fill in the gaps, every `MONOBANK_GAP_FILLING_INTERVAL` seconds.
+    MONOBANK_WEBHOOK_BASE_URL: pydantic.AnyHttpUrl | None = None
+    MONOBANK_WEBHOOK_PATH: str = "/monobank/webhook"
+    # Appended to the path, so that no one else can push the statements. Required along with the
+    #  `MONOBANK_WEBHOOK_BASE_URL`, e.g. generated with `secrets.token_urlsafe()`
+    MONOBANK_WEBHOOK_SECRET: pydantic.constr(regex=r"^[\w-]+$", min_length=32) | None = None
+    MONOBANK_GAP_FILLING_INTERVAL: int = 60 * 30
+
+    # How often to poll the statements of the accounts (in seconds), depending on whether they have
+    # unpaid paychecks due within `MONOBANK_DUE_SOON_DAYS` days or overdue by at most
+    # `MONOBANK_OVERDUE_DAYS` days (the older ones are likely abandoned), other unpaid ones, or none
+    MONOBANK_DUE_SOON_DAYS: int = 3
+    MONOBANK_OVERDUE_DAYS: int = 7
+    MONOBANK_DUE_SOON_ACCOUNT_POLLING_INTERVAL: int = 60 * 2
+    MONOBANK_PENDING_ACCOUNT_POLLING_INTERVAL: int = 60 * 10
+    MONOBANK_IDLE_ACCOUNT_POLLING_INTERVAL: int = 60 * 60
+    # How often to match the recent statements left unmatched again (e.g. after a failure), and how
+    #  far back to look for them (see `tasks.rematch_account_statements`)
+    MONOBANK_STATEMENTS_REMATCH_INTERVAL: int = 60 * 10
+    MONOBANK_STATEMENTS_REMATCH_WINDOW: int = 60 * 60 * 24
+    # How often to look for the new accounts to poll
+    MONOBANK_ACCOUNTS_REFRESH_INTERVAL: int = 60 * 5
+
+    @pydantic.root_validator(skip_on_failure=True)
+    def require_telegram_webhook_secret_token(
+        cls, values: dict[str, typing.Any]
+    ) -> dict[str, typing.Any]:
+        """Refuse to make Telegram push the updates to the webhook anyone can push to."""
+        if values["BOT_MODE"] == "webhook" and not values["TELEGRAM_WEBHOOK_SECRET_TOKEN"]:
+            raise ValueError("`TELEGRAM_WEBHOOK_SECRET_TOKEN` is required in the webhook mode")
+
+        return values
+
+    @pydantic.root_validator(skip_on_failure=True)
+    def require_monobank_webhook_secret(
+        cls, values: dict[str, typing.Any]
+    ) -> dict[str, typing.Any]:
+        """Refuse to make Monobank push the statements to the webhook anyone can push to."""
+        if values["MONOBANK_WEBHOOK_BASE_URL"] and not values["MONOBANK_WEBHOOK_SECRET"]:
+            raise ValueError("`MONOBANK_WEBHOOK_SECRET` is required by `MONOBANK_WEBHOOK_BASE_URL`")
+
+        return values
+
     class Config:
         """Configuration for the settings."""
 
@@ -1,24 +1,43 @@
 """All the asynchronous tasks are defined here."""
 import asyncio
 import base64
+import dataclasses
 import datetime
-import random
+import functools
 import re
+import time
 import typing
 from uuid import UUID
 
 import aiogram
 import aiogram.utils.exceptions
 import arrow
-import babel
-import emoji
+from tortoise.exceptions import DoesNotExist
+from tortoise.functions import Sum
+from tortoise.transactions import in_transaction
 
-from models import GroupPayment, MonobankAccount, MonobankAccountStatement, Paycheck, User
+from models import GroupPayment, MonobankAccountStatement, Paycheck, Settings, User
 from settings import settings
-from utils.i18n import custom_gettext as _
+from utils import fast_queries
+from utils.i18n import get_language, get_template_keys
+from utils.i18n import gettext as _
+from utils.job_queue import job_queue
 from utils.loguru_logging import logger
-from utils.monobank import pull_all_account_statements
-from utils.tortoise_orm import flatten_tortoise_model
+from utils.message_archive import archive_old_message_partitions, create_message_partitions
+from utils.monobank_scheduler import MonobankPollingScheduler
+from utils.payment_qr import payment_qr_codes
+from utils.read_replica import read_replica
+from utils.telegram_bot import bot
+from utils.tortoise_orm import bulk_insert_ignore_conflicts, compile_tortoise_model_flattener
+
+# The relations of a `Paycheck` its messages are rendered with, loaded with a single query (joined)
+PAYCHECK_RENDERING_RELATIONS: tuple[str, ...] = (
+    "for_user__settings__monobank_account_to_pay_to",
+    "generated_from_group_payment__group",
+)
+
+# The most characters a caption of a photo can have
+PHOTO_CAPTION_MAX_LENGTH: int = 1024
 
 # noinspection StrFormat
 PAYMENT_FORMATTERS: dict[str, typing.Callable[[int | datetime.datetime], str | int]] = {
@@ -58,88 +77,148 @@ def _generate_payment_link(receiver: str, iban: str, amount: int, edrpou: str, c
     return f"https://bank.gov.ua/qr/{qr_data}"
 
 
-async def generate_link_from_paycheck(paycheck: Paycheck) -> str:
-    """Generate a payment link from the paycheck."""
-    # Create the payment's comment message
-    # TODO: [11/6/2022 by Mykola] DRY when it comes to the comment message in the payment message
-    #  and the payment link
-    _comment = paycheck.comment
-
-    # TODO: [11/6/2022 by Mykola] Remove the need to do multiple fetches
-    await paycheck.fetch_related("generated_from_group_payment__group", "to_account")
-    if paycheck.generated_from_group_payment:
-        _comment += f" [{paycheck.generated_from_group_payment.group.name}]"
-
-    _comment += f" [{paycheck.id}]"
+def _generate_link_from_loaded_paycheck(paycheck: Paycheck) -> str:
+    """
+    Generate a payment link from the paycheck with its relations already loaded.
 
-    # Generate a payment link
+    The `generated_from_group_payment__group` and `to_account` relations must be fetched.
+    """
     return _generate_payment_link(
         receiver=paycheck.to_account.name,
         iban=paycheck.to_account.iban,
         amount=paycheck.amount,
         edrpou=paycheck.to_account.edrpou,
-        comment=f"{paycheck.comment} [{paycheck.generated_from_group_payment.group.name}] [{paycheck.id}]",
+        comment=(
+            f"{paycheck.comment} "
+            f"[{paycheck.generated_from_group_payment.group.name}] [{paycheck.id}]"
+        ),
     )
 
 
-async def _generate_paycheck_for_user(group_payment: GroupPayment, user: User) -> Paycheck:
-    """Generate a paycheck for the user."""
-    return await Paycheck.create(
+def _build_paycheck_for_user(group_payment: GroupPayment, user: User) -> Paycheck:
+    """
+    Build (but do not save) a paycheck for the user, with its payment link.
+
+    The `settings__monobank_account_to_pay_to` relation of the `user`, and the `group` relation of
+    the `group_payment` must be fetched.
+    """
+    user_settings: Settings | None = user.settings
+
+    paycheck = Paycheck(
         for_user=user,
-        to_account=await (await user.settings).monobank_account_to_pay_to,
+        to_account=user_settings.monobank_account_to_pay_to if user_settings else None,
         amount=group_payment.amount,
         currency_symbol="UAH",
         currency_code=980,
         comment=group_payment.comment,
         generated_from_group_payment=group_payment,
     )
+    if paycheck.to_account:
+        paycheck.payment_link = _generate_link_from_loaded_paycheck(paycheck)
+
+    return paycheck
+
+
+@functools.cache
+def _compile_payment_template_data_builder(
+    template: str,
+) -> typing.Callable[[Paycheck], dict[str, typing.Any]]:
+    """Compile the builder of the data for the payment template, once per template."""
+    return compile_tortoise_model_flattener(
+        get_template_keys(template),
+        separator="__",
+        prefix="paycheck__",
+        formatters=PAYMENT_FORMATTERS,
+    )
 
 
-async def _get_payment_template_data(paycheck: Paycheck) -> dict[str, typing.Any]:
-    """Get the data for the payment template."""
-    await paycheck.fetch_related(
-        "for_user__settings__monobank_account_to_pay_to", "generated_from_group_payment__group"
-    )
+def _build_payment_template_data(paycheck: Paycheck, template: str) -> dict[str, typing.Any]:
+    """
+    Build the data for the payment template from the paycheck with its relations already loaded.
 
-    payment_template_data = {
-        key: formatter(value) if (formatter := PAYMENT_FORMATTERS.get(key)) else value
-        for key, value in flatten_tortoise_model(
-            paycheck, separator="__", prefix="paycheck__"
-        ).items()
-    }
+    Only the keys the template is formatted with are built. The relations they go through must be
+    fetched, e.g. `for_user__settings__monobank_account_to_pay_to` and
+    `generated_from_group_payment__group`.
+    """
+    return _compile_payment_template_data_builder(template)(paycheck)
 
-    return payment_template_data
 
+async def _send_payment_qr_code(
+    chat_id: int,
+    payment_link: str,
+    caption: str,
+    reply_markup: aiogram.types.InlineKeyboardMarkup,
+) -> aiogram.types.Message:
+    """
+    Send the QR code of the payment link, for paying from another device, with the caption.
 
-async def _send_paycheck_to_user(paycheck: Paycheck) -> None:
-    """Send a paycheck to the user."""
-    from main import bot
+    The QR code is uploaded only the first time it is sent, and sent by its `file_id` afterwards.
+    """
+    photo: str | aiogram.types.InputFile = await payment_qr_codes.get_photo(payment_link)
+
+    async def send(photo_to_send: str | aiogram.types.InputFile) -> aiogram.types.Message:
+        return await bot.send_photo(
+            chat_id,
+            photo_to_send,
+            caption=caption,
+            reply_markup=reply_markup,
+            parse_mode=aiogram.types.ParseMode.HTML,
+        )
+
+    try:
+        message: aiogram.types.Message = await send(photo)
+    except aiogram.utils.exceptions.WrongFileIdentifier:
+        if isinstance(photo, aiogram.types.InputFile):
+            raise
+
+        # The file itself is uploaded this time, so it is retried only once
+        logger.warning(f"The QR code's file ID is rejected, uploading it again: {photo=}")
+        await payment_qr_codes.forget_file_id(payment_link)
+        photo = aiogram.types.InputFile(await payment_qr_codes.render(payment_link))
+        message = await send(photo)
+
+    if isinstance(photo, aiogram.types.InputFile) and message.photo:
+        # The largest size is the original one
+        await payment_qr_codes.set_file_id(payment_link, message.photo[-1].file_id)
+
+    return message
 
-    payment_template_data = await _get_payment_template_data(paycheck)
 
+async def _send_paycheck_to_user(paycheck: Paycheck) -> bool:
+    """
+    Send a paycheck to the user.
+
+    The paycheck must have been built by `_build_paycheck_for_user` (or have the same relations
+    loaded), so no queries are made here apart from deactivating the users who blocked the bot.
+
+    Return whether the message has been sent.
+    """
     user: User = paycheck.for_user
-    _user_locale = babel.core.Locale.parse(user.language_code, sep="-")
+    if not (payment_link := paycheck.payment_link):
+        logger.error(f"Paycheck {paycheck.id=} has no account to pay to: {user.id=}")
+        return False
 
-    try:
-        # noinspection StrFormat
-        await bot.send_message(
-            user.id,
-            emoji.emojize(
-                # FIXME: [11/6/2022 by Mykola] This might not work with `pybabel extract`
-                _("tasks.notifications.payment_created.message", _user_locale).format(
-                    **payment_template_data
-                )
-            ),
-            reply_markup=aiogram.types.InlineKeyboardMarkup().add(
-                aiogram.types.InlineKeyboardButton(
-                    text=emoji.emojize(
-                        _("tasks.notifications.payment_created.pay_button", _user_locale)
-                    ),
-                    url=await generate_link_from_paycheck(paycheck),
-                )
-            ),
-            parse_mode=aiogram.types.ParseMode.HTML,
+    _user_language = get_language(user.language_code)
+
+    # FIXME: [11/6/2022 by Mykola] This might not work with `pybabel extract`
+    template: str = _("tasks.notifications.payment_created.message", _user_language)
+
+    # noinspection StrFormat
+    text: str = template.format(**_build_payment_template_data(paycheck, template))
+    reply_markup = aiogram.types.InlineKeyboardMarkup().add(
+        aiogram.types.InlineKeyboardButton(
+            text=_("tasks.notifications.payment_created.pay_button", _user_language),
+            url=payment_link,
         )
+    )
+
+    try:
+        if settings.PAYMENT_QR_CODES and len(text) <= PHOTO_CAPTION_MAX_LENGTH:
+            await _send_payment_qr_code(user.id, payment_link, text, reply_markup)
+        else:
+            await bot.send_message(
+                user.id, text, reply_markup=reply_markup, parse_mode=aiogram.types.ParseMode.HTML
+            )
     except aiogram.utils.exceptions.BotBlocked:
         logger.info(f"Bot blocked by the {user.id=} ({user.username=})")
 
@@ -147,106 +226,453 @@ async def _send_paycheck_to_user(paycheck: Paycheck) -> None:
         user.is_active = False
         await user.save(update_fields=["is_active"])
 
+        return False
 
-async def send_group_payment(group_payment_id: int) -> None:
-    """Send a group payment to the group users."""
-    group_payment = await GroupPayment.get(id=group_payment_id)
+    return True
 
-    # Send the group payment to the group users
-    for user in await (await group_payment.group).users.all():
-        if await Paycheck.exists(generated_from_group_payment=group_payment, for_user=user):
-            continue
 
-        paycheck: Paycheck = await _generate_paycheck_for_user(group_payment, user)
-        await _send_paycheck_to_user(paycheck)
+@dataclasses.dataclass
+class GroupPaymentFanOutStats:
+    """The statistics of a single `send_group_payment` run."""
 
+    group_payment_id: int
 
-async def send_payment_received_message(paycheck_id: UUID) -> aiogram.types.Message:
-    """Send a message to the user that the payment has been received."""
-    from main import bot
+    members_count: int = 0
+    paychecks_created: int = 0
+    # The undelivered paychecks of a previous fan-out
+    paychecks_resent: int = 0
+    messages_sent: int = 0
+    messages_failed: int = 0
+
+    paychecks_seconds: float = 0.0
+    qr_codes_seconds: float = 0.0
+    messages_seconds: float = 0.0
+
+    @property
+    def paychecks_per_second(self) -> float:
+        """Get the paychecks' creation throughput."""
+        return self.paychecks_created / self.paychecks_seconds if self.paychecks_seconds else 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        """Get the messages' sending throughput."""
+        return self.messages_sent / self.messages_seconds if self.messages_seconds else 0.0
+
+    def __str__(self):
+        """Get the human-readable representation of the statistics."""
+        return (
+            f"group payment [ID:{self.group_payment_id}]: {self.members_count} members, "
+            f"{self.paychecks_created} paychecks in {self.paychecks_seconds:.2f}s "
+            f"({self.paychecks_per_second:.1f} paychecks/s), {self.paychecks_resent} resent, "
+            f"QR codes rendered in {self.qr_codes_seconds:.2f}s, "
+            f"{self.messages_sent} messages sent ({self.messages_failed} failed) "
+            f"in {self.messages_seconds:.2f}s ({self.messages_per_second:.1f} messages/s)"
+        )
+
+
+async def _send_paychecks_concurrently(
+    paychecks: list[Paycheck], concurrency: int
+) -> tuple[int, int]:
+    """
+    Send the paychecks to their users, with at most `concurrency` messages in flight at once.
+
+    The paychecks are marked as sent one by one, as soon as they are delivered. Return the number
+    of sent and failed messages.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _send(paycheck: Paycheck) -> bool:
+        async with semaphore:
+            try:
+                if not await _send_paycheck_to_user(paycheck):
+                    return False
+
+                # Right away, so that a retry of the fan-out does not send it again
+                await Paycheck.filter(id=paycheck.id).update(is_sent=True)
+                return True
+            except Exception as e:
+                # Do not let a single failed message abort the whole fan-out
+                logger.error(f"Failed to send the paycheck {paycheck.id=}: {e} ({e.__class__})")
+                return False
+
+    results: list[bool] = await asyncio.gather(*(_send(paycheck) for paycheck in paychecks))
 
-    paycheck = await Paycheck.get(id=paycheck_id)
+    return results.count(True), results.count(False)
 
-    payment_template_data = await _get_payment_template_data(paycheck)
+
+async def send_group_payment(group_payment_id: int) -> GroupPaymentFanOutStats:
+    """
+    Send a group payment to the group users.
+
+    The fan-out is done in a fixed number of queries regardless of the group's size (apart from
+    marking the paychecks as sent): the existing paychecks are loaded at once, the missing ones are
+    created with a single bulk insert, and all the data needed to render the messages is prefetched
+    before sending them concurrently. The paychecks that a previous, failed, fan-out has created
+    but not delivered are sent along with the new ones.
+    """
+    stats = GroupPaymentFanOutStats(group_payment_id=group_payment_id)
+    _started_at: float = time.perf_counter()
+
+    group_payment = await GroupPayment.get(id=group_payment_id).select_related("group")
+
+    users: list[User] = await group_payment.group.users.all().select_related(
+        "settings__monobank_account_to_pay_to"
+    )
+    stats.members_count = len(users)
+
+    # The paychecks of a failed fan-out that have not been delivered are sent again
+    existing_paychecks: list[Paycheck] = await Paycheck.filter(
+        generated_from_group_payment=group_payment
+    )
+    users_with_paychecks: set[int] = {paycheck.for_user_id for paycheck in existing_paychecks}
+    users_by_id: dict[int, User] = {user.id: user for user in users}
+    unsent_paychecks: list[Paycheck] = [
+        paycheck
+        for paycheck in existing_paychecks
+        if not paycheck.is_sent and paycheck.for_user_id in users_by_id
+    ]
+    for paycheck in unsent_paychecks:
+        paycheck.for_user = users_by_id[paycheck.for_user_id]
+        paycheck.generated_from_group_payment = group_payment
+
+    # The paychecks are built in memory, so they already have all the relations the message
+    # templates need: the users with their settings, and the group payment with its group.
+    paychecks: list[Paycheck] = [
+        _build_paycheck_for_user(group_payment, user)
+        for user in users
+        if user.id not in users_with_paychecks
+    ]
+    if paychecks:
+        # The paychecks created by a concurrent fan-out in the meantime are sent by that fan-out
+        async with in_transaction("default") as connection:
+            paychecks = await bulk_insert_ignore_conflicts(Paycheck, paychecks, using_db=connection)
+        # NB: Once committed, so that the replica having replayed everything up to now has them
+        await read_replica.mark_paychecks_written()
+
+    stats.paychecks_created = len(paychecks)
+    stats.paychecks_resent = len(unsent_paychecks)
+    paychecks += unsent_paychecks
+    stats.paychecks_seconds = (_paychecks_created_at := time.perf_counter()) - _started_at
+
+    if settings.PAYMENT_QR_CODES:
+        # Render the QR codes in parallel beforehand, instead of one by one while sending
+        await payment_qr_codes.render_many(
+            paycheck.payment_link for paycheck in paychecks if paycheck.payment_link
+        )
+    stats.qr_codes_seconds = (_qr_codes_rendered_at := time.perf_counter()) - _paychecks_created_at
+
+    stats.messages_sent, stats.messages_failed = await _send_paychecks_concurrently(
+        paychecks, concurrency=settings.GROUP_PAYMENT_SENDER_CONCURRENCY
+    )
+    stats.messages_seconds = time.perf_counter() - _qr_codes_rendered_at
+
+    logger.info(f"Sent {stats}")
+
+    return stats
+
+
+@job_queue.register("send_group_payment")
+async def send_group_payment_job(group_payment_id: int, notify_user_id: int | None = None) -> None:
+    """
+    Send a group payment to the group users in the worker.
+
+    Once done, let the user who has created the group payment know how it went.
+    """
+    stats = await send_group_payment(group_payment_id)
+
+    if notify_user_id is None or not (user := await User.get_or_none(id=notify_user_id)):
+        return
+
+    _user_language = get_language(user.language_code)
+
+    # noinspection StrFormat
+    await bot.send_message(
+        user.id,
+        _("tasks.notifications.group_payment_sent.message", _user_language).format(
+            **dataclasses.asdict(stats)
+        ),
+    )
+
+
+@job_queue.register("send_payment_received_message")
+async def send_payment_received_message(paycheck_id: UUID | str) -> aiogram.types.Message:
+    """Send a message to the user that the payment has been received."""
+    # NB: On the fast path, since it's run for every paid paycheck
+    if (paycheck := await fast_queries.get_rendered_paycheck(paycheck_id)) is None:
+        raise DoesNotExist(f"Paycheck {paycheck_id=} does not exist")
 
     user: User = paycheck.for_user
-    _user_locale = babel.core.Locale.parse(user.language_code, sep="-")
+    _user_language = get_language(user.language_code)
+
+    template: str = _("tasks.notifications.payment_received.message", _user_language)
 
     # noinspection StrFormat
     return await bot.send_message(
         user.id,
-        emoji.emojize(
-            _("tasks.notifications.payment_received.message", _user_locale).format(
-                **payment_template_data
-            )
-        ),
+        template.format(**_build_payment_template_data(paycheck, template)),
         parse_mode=aiogram.types.ParseMode.HTML,
     )
 
 
-async def process_new_account_statement(account_statement: MonobankAccountStatement) -> None:
+# The `Paycheck.id` is put in the payment's comment in square brackets, e.g. "Rent [<UUID>]"
+PAYCHECK_ID_IN_COMMENT_PATTERN: re.Pattern = re.compile(
+    r"\[(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\]"
+)
+
+
+@dataclasses.dataclass
+class PaycheckMatchingStats:
+    """The stats of matching a batch of account statements with the `Paycheck`s."""
+
+    statements_count: int = 0
+    statements_matched: int = 0
+    # Matched by a previous (or a concurrent) run, e.g. when the statements are matched again
+    statements_already_matched: int = 0
+    # The outgoing statements, and the ones without a known `Paycheck.id` in the comment
+    statements_missed: int = 0
+
+    paychecks_paid: int = 0
+    paychecks_partially_paid: int = 0
+    paychecks_already_paid: int = 0
+
+    def __str__(self) -> str:
+        """Format the stats for the logs."""
+        return (
+            f"{self.statements_matched}/{self.statements_count} statements matched "
+            f"({self.statements_already_matched} matched already, "
+            f"{self.statements_missed} missed): {self.paychecks_paid} paychecks paid, "
+            f"{self.paychecks_partially_paid} partially paid, "
+            f"{self.paychecks_already_paid} already paid"
+        )
+
+
+def _group_statements_by_paycheck_id(
+    account_statements: list[MonobankAccountStatement], stats: PaycheckMatchingStats
+) -> dict[UUID, list[MonobankAccountStatement]]:
+    """Group the payments to us by the `Paycheck` IDs in their comments, the rest are missed."""
+    statements_by_paycheck_id: dict[UUID, list[MonobankAccountStatement]] = {}
+    for account_statement in account_statements:
+        if account_statement.amount <= 0:
+            stats.statements_missed += 1  # Not a payment to us
+            continue
+
+        match: re.Match | None = PAYCHECK_ID_IN_COMMENT_PATTERN.search(
+            account_statement.comment or ""
+        )
+        if not match:
+            stats.statements_missed += 1
+            logger.warning(
+                f"Received a statement without a UUID in the comment: {account_statement.comment=}"
+            )
+            # TODO: [2/6/2023 by Mykola] Notify admins about this
+            continue
+
+        statements_by_paycheck_id.setdefault(UUID(match.group("uuid")), []).append(
+            account_statement
+        )
+
+    return statements_by_paycheck_id
+
+
+async def _match_statements_with_locked_paychecks(
+    statements_by_paycheck_id: dict[UUID, list[MonobankAccountStatement]],
+    stats: PaycheckMatchingStats,
+) -> tuple[list[MonobankAccountStatement], list[UUID]]:
     """
-    Process new account statement.
+    Lock the `Paycheck`s of the statements, and match the statements not linked yet with them.
 
-    Also, make the `Paycheck.is_paid` field `True` if the statement meets the requirements.
+    Must be called within a transaction. The `Paycheck`s found are popped from
+    `statements_by_paycheck_id`, so the UUIDs left there do not belong to any `Paycheck`.
+    Return the statements to link to their `Paycheck`s, and the IDs of the `Paycheck`s paid by now.
     """
-    # Check if there is a UUID in the `account_statement.description`
-    uuid_in_square_brackets_pattern: re.Pattern = re.compile(
-        r"\[(?P<uuid>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\]"
+    # Lock the `Paycheck`s, so that their parts paid at the same time are all counted
+    paychecks: list[Paycheck] = (
+        await Paycheck.filter(id__in=list(statements_by_paycheck_id)).select_for_update().all()
+    )
+    # NB: Once the `Paycheck`s are locked, their statements are not linked by anyone else
+    linked_account_statement_ids: set[str] = set(
+        await MonobankAccountStatement.filter(
+            id__in=[
+                account_statement.id
+                for paycheck_statements in statements_by_paycheck_id.values()
+                for account_statement in paycheck_statements
+            ],
+            paycheck_id__isnull=False,
+        ).values_list("id", flat=True)
     )
-    match: re.Match | None = uuid_in_square_brackets_pattern.search(account_statement.comment)
-    if not match:
-        logger.error(
-            f"Received a statement without a UUID in the comment: {account_statement.comment=}"
+    previously_paid_amounts: dict[UUID, int] = {
+        row["paycheck_id"]: row["paid_amount"]
+        for row in await MonobankAccountStatement.filter(
+            paycheck_id__in=[paycheck.id for paycheck in paychecks]
         )
-        # TODO: [2/6/2023 by Mykola] Notify admins about this
-        return
+        .annotate(paid_amount=Sum("amount"))
+        .group_by("paycheck_id")
+        .values("paycheck_id", "paid_amount")
+    }
 
-    # Get the `Paycheck` by the UUID
-    paycheck: Paycheck = await Paycheck.get(id=UUID(match.group("uuid")))
+    linked_account_statements: list[MonobankAccountStatement] = []
+    paid_paycheck_ids: list[UUID] = []
+    for paycheck in paychecks:
+        paycheck_statements: list[MonobankAccountStatement] = []
+        for account_statement in statements_by_paycheck_id.pop(paycheck.id):
+            if account_statement.id in linked_account_statement_ids:
+                stats.statements_already_matched += 1
+            else:
+                paycheck_statements.append(account_statement)
+        if not paycheck_statements:
+            continue
 
-    # Check if the `Paycheck` is already paid
-    if paycheck.is_paid:
-        logger.error(f"Paycheck {paycheck.id=} is already paid")
-        return
+        for account_statement in paycheck_statements:
+            account_statement.paycheck_id = paycheck.id
+        linked_account_statements.extend(paycheck_statements)
+        stats.statements_matched += len(paycheck_statements)
 
-    # Check that the `account_statement.amount` is equal to the `paycheck.amount`
-    if account_statement.amount != paycheck.amount:
-        logger.error(
-            f"Received a statement with an incorrect amount: {account_statement.amount=}, "
-            f"expected: {paycheck.amount=}"
+        if paycheck.is_paid:
+            stats.paychecks_already_paid += 1
+            logger.warning(f"Paycheck {paycheck.id=} is already paid")
+            continue
+
+        paid_amount: int = previously_paid_amounts.get(paycheck.id, 0) + sum(
+            account_statement.amount for account_statement in paycheck_statements
         )
+        if paid_amount < paycheck.amount:
+            stats.paychecks_partially_paid += 1
+            logger.info(f"Paycheck {paycheck.id=} is paid partially: {paid_amount=}")
+            continue
+
+        if paid_amount > paycheck.amount:
+            logger.warning(f"Paycheck {paycheck.id=} is overpaid: {paid_amount=}")
+        paid_paycheck_ids.append(paycheck.id)
+
+    return linked_account_statements, paid_paycheck_ids
+
+
+async def _notify_about_paid_paychecks(paid_paycheck_ids: list[UUID]) -> None:
+    """Let the reports read the paid `Paycheck`s, and the users know their payments are received."""
+    if not paid_paycheck_ids:
         return
 
-    # Set the `Paycheck.is_paid` field to `True`
-    paycheck.is_paid = True
-    await paycheck.save()
+    await read_replica.mark_paychecks_written()
+
+    for paycheck_id in paid_paycheck_ids:
+        try:
+            await job_queue.enqueue("send_payment_received_message", paycheck_id=str(paycheck_id))
+        except Exception as e:
+            logger.error(
+                f"Failed to enqueue the payment received message for {paycheck_id=}: "
+                f"{e} ({e.__class__})"
+            )
+
+
+async def process_new_account_statements(
+    account_statements: list[MonobankAccountStatement],
+) -> PaycheckMatchingStats:
+    """
+    Match the new account statements with the `Paycheck`s they pay.
+
+    The statements are linked to their `Paycheck`s, and a `Paycheck` is marked as paid once its
+    statements add up to its amount, so it can be paid in several parts. The users are notified
+    about their paid `Paycheck`s by the worker.
 
-    # Send a message to the user that the payment has been received
-    await send_payment_received_message(paycheck.id)
+    The statements linked already are skipped, so the same statements can be matched again, e.g. by
+    `rematch_account_statements` after this has failed for them.
+    """
+    stats = PaycheckMatchingStats(statements_count=len(account_statements))
+
+    statements_by_paycheck_id = _group_statements_by_paycheck_id(account_statements, stats)
+    if not statements_by_paycheck_id:
+        logger.info(f"Processed new account statements: {stats}")
+        return stats
+
+    async with in_transaction("default"):
+        linked_statements, paid_paycheck_ids = await _match_statements_with_locked_paychecks(
+            statements_by_paycheck_id, stats
+        )
+
+        if linked_statements:
+            await MonobankAccountStatement.bulk_update(linked_statements, fields=["paycheck_id"])
+        if paid_paycheck_ids:
+            await Paycheck.filter(id__in=paid_paycheck_ids).update(is_paid=True)
+        stats.paychecks_paid = len(paid_paycheck_ids)
+
+    # The rest of the UUIDs do not belong to any `Paycheck`
+    for paycheck_id, paycheck_statements in statements_by_paycheck_id.items():
+        stats.statements_missed += len(paycheck_statements)
+        logger.error(f"Received a statement for an unknown paycheck: {paycheck_id=}")
+
+    # Send messages to the users that their payments have been received
+    await _notify_about_paid_paychecks(paid_paycheck_ids)
+
+    logger.info(f"Processed new account statements: {stats}")
+    return stats
 
 
 async def monitor_paychecks() -> None:
     """Monitor the paychecks."""
-    # NB: This _might not_ work when there are multiple `MonobankAccount`s and/or multiple
-    #  `MonobankClient`s processing at once, for multiple reasons:
-    #  1. The "429 Too Many Requests" error might be raised by Monobank API
-    #  2. Monobank might consider this a non-private usage of their API
-    #   (one must apply for a commercial access).
+    # NB: Monobank might consider this a non-private usage of their API (one must apply for
+    #  a commercial access).
+    await MonobankPollingScheduler(
+        new_account_statements_callback=process_new_account_statements
+    ).run()
+
 
+async def rematch_account_statements() -> None:
+    """
+    Keep matching the recent statements left unmatched with the `Paycheck`s they pay.
+
+    The new statements are matched right after they are saved. Should that fail, the next poll
+    finds them saved already, so they are not matched again by it. The ones of the last
+    `MONOBANK_STATEMENTS_REMATCH_WINDOW` seconds paying the existing `Paycheck`s are matched here.
+    """
     while True:
-        # Pull all account statements from Monobank for all the `MonobankAccount`s
-        await asyncio.gather(
-            *(
-                pull_all_account_statements(
-                    monobank_account.id,
-                    new_account_statement_callback=process_new_account_statement,
+        await asyncio.sleep(settings.MONOBANK_STATEMENTS_REMATCH_INTERVAL)
+
+        try:
+            now = arrow.utcnow()
+            account_statements: list[
+                MonobankAccountStatement
+            ] = await MonobankAccountStatement.filter(
+                paycheck_id=None,
+                amount__gt=0,
+                date_added__gte=now.shift(
+                    seconds=-settings.MONOBANK_STATEMENTS_REMATCH_WINDOW
+                ).datetime,
+                # The ones saved since the previous run are likely being matched right now
+                date_added__lt=now.shift(
+                    seconds=-settings.MONOBANK_STATEMENTS_REMATCH_INTERVAL
+                ).datetime,
+            )
+
+            paycheck_ids: dict[str, UUID] = {
+                account_statement.id: UUID(match.group("uuid"))
+                for account_statement in account_statements
+                if (match := PAYCHECK_ID_IN_COMMENT_PATTERN.search(account_statement.comment or ""))
+            }
+            existing_paycheck_ids: set[UUID] = set(
+                await Paycheck.filter(id__in=set(paycheck_ids.values())).values_list(
+                    "id", flat=True
                 )
-                # for monobank_account in await MonobankAccount.all()
-                # TODO: [2/3/2023 by Mykola] Make it work for multiple `MonobankAccount`s
-                for monobank_account in [await MonobankAccount.all().order_by("date_added").first()]
             )
-        )
+            if account_statements := [
+                account_statement
+                for account_statement in account_statements
+                if paycheck_ids.get(account_statement.id) in existing_paycheck_ids
+            ]:
+                logger.warning(f"Matching {len(account_statements)} unmatched statements again")
+                await process_new_account_statements(account_statements)
+        except Exception as e:
+            logger.error(f"Failed to match the unmatched statements: {e} ({e.__class__})")
+
+
+async def retain_messages() -> None:
+    """Keep the logged messages' partitions created ahead, and archive the old ones."""
+    while True:
+        try:
+            await create_message_partitions(months_ahead=settings.MESSAGE_PARTITIONS_AHEAD)
+            await archive_old_message_partitions(
+                settings.MESSAGE_ARCHIVE_DIR, retention_days=settings.MESSAGE_RETENTION_DAYS
+            )
+        except Exception as e:
+            logger.error(f"Failed to retain the logged messages: {e} ({e.__class__})")
 
-        # Sleep for a random time between 1 and 2 minutes
-        await asyncio.sleep(random.randint(60, 60 * 2))
+        await asyncio.sleep(settings.MESSAGE_RETENTION_INTERVAL)
@@ -0,0 +1,52 @@
+"""
+The startup and the shutdown of the processes other than the bot, e.g. the worker.
+
+Unlike `main.on_startup`, it neither imports the bot's dispatcher nor talks to Telegram: only the
+database connections are set up, so the processes restart fast. The database schema is not created
+here either, the migrations are applied by `aerich upgrade` before the processes are started.
+
+The caches of the bot are not used here, but their signals are registered all the same, so that
+the users and the groups saved by these processes are dropped from the caches of the bot.
+"""
+from utils import tortoise_orm
+from utils.group_directory import register_group_directory_signals
+from utils.loguru_logging import logger
+from utils.monobank import monobank_api
+from utils.payment_qr import payment_qr_codes
+from utils.telegram_bot import bot
+from utils.user_cache import register_user_cache_signals
+
+
+async def on_startup(
+    role: tortoise_orm.ProcessRole = "worker", database_pool_max_size: int | None = None
+) -> None:
+    """Start up the process of the role."""
+    logger.info("Starting up...")
+
+    logger.debug("Initializing the database connection...")
+    await tortoise_orm.init(role=role, pool_max_size=database_pool_max_size)
+
+    logger.debug("Registering the signals of the bot's caches...")
+    register_user_cache_signals()
+    register_group_directory_signals()
+
+    logger.info("Startup complete.")
+
+
+async def on_shutdown() -> None:
+    """Shut down the process, closing the connections opened since the startup."""
+    logger.info("Shutting down...")
+
+    logger.debug("Closing the Monobank API connections...")
+    await monobank_api.close()
+
+    logger.debug("Stopping the QR codes rendering processes...")
+    payment_qr_codes.close()
+
+    logger.debug("Closing the Telegram Bot API session...")
+    await bot.close()
+
+    logger.debug("Closing the database connection...")
+    await tortoise_orm.shutdown()
+
+    logger.info("Shutdown complete.")
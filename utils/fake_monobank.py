@@ -0,0 +1,83 @@
+"""
+The fake Monobank, pushing statement items to the local webhook. Used for testing.
+
+Usage:
+    python -m utils.fake_monobank --account <MonobankAccount.id> --amount 380000 \
+        --comment "Rent [<Paycheck.id>]"
+"""
+import argparse
+import asyncio
+import random
+import time
+import typing
+
+import aiohttp
+
+from settings import settings
+
+
+def make_statement_item(amount: int, comment: str | None) -> dict[str, typing.Any]:
+    """Make a statement item the way Monobank API returns it."""
+    return {
+        "id": "".join(random.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz", k=16)),
+        "time": int(time.time()),
+        "description": "Fake Monobank",
+        "comment": comment,
+        "mcc": 4829,
+        "originalMcc": 4829,
+        "amount": amount,
+        "operationAmount": amount,
+        "currencyCode": 980,
+        "commissionRate": 0,
+        "cashbackAmount": 0,
+        "balance": amount,
+        "hold": False,
+    }
+
+
+async def push_statement_item(
+    web_hook_url: str, account_id: str, statement_item: dict[str, typing.Any]
+) -> int:
+    """Push the statement item to the webhook and return the response's status."""
+    async with aiohttp.ClientSession() as session:
+        # Monobank checks the webhook with a GET request first
+        async with session.get(web_hook_url) as response:
+            response.raise_for_status()
+
+        async with session.post(
+            web_hook_url,
+            json={
+                "type": "StatementItem",
+                "data": {"account": account_id, "statementItem": statement_item},
+            },
+        ) as response:
+            return response.status
+
+
+async def main():
+    """Push a statement item to the local webhook."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--account", required=True, help="The `MonobankAccount.id`")
+    parser.add_argument("--amount", type=int, required=True, help="In the smallest currency unit")
+    parser.add_argument("--comment", default=None)
+    parser.add_argument(
+        "--url",
+        default=(
+            f"http://localhost:{settings.PORT}{settings.MONOBANK_WEBHOOK_PATH}/"
+            f"{settings.MONOBANK_WEBHOOK_SECRET}"
+        ),
+    )
+    args = parser.parse_args()
+
+    statement_item = make_statement_item(args.amount, args.comment)
+
+    _started_at = time.perf_counter()
+    status = await push_statement_item(args.url, args.account, statement_item)
+    print(
+        f"Pushed statement `{statement_item['id']}`: HTTP {status} "
+        f"in {(time.perf_counter() - _started_at) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
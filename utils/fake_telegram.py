@@ -0,0 +1,151 @@
+"""
+The fake Telegram, pushing updates to the bot's webhook and answering its Bot API requests.
+
+Used for testing the bot's webhook mode locally. The updates are pushed once the bot sets its
+webhook, e.g.:
+    python -m utils.fake_telegram --updates 1000 --concurrency 50 &
+    BOT_MODE=webhook TELEGRAM_API_URL=http://localhost:8090 \
+        TELEGRAM_WEBHOOK_BASE_URL=http://localhost:8081 BOT_WEBHOOK_PROCESSES=4 python main.py
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import statistics
+import time
+import typing
+
+import aiohttp
+from aiohttp import web
+
+from settings import settings
+
+FAKE_BOT_USER: dict[str, typing.Any] = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Fake",
+    "username": "fake_bot",
+}
+
+# How many Bot API requests of each method the bot has made
+api_calls: collections.Counter[str] = collections.Counter()
+_message_ids = itertools.count(1)
+
+
+async def bot_api_method(request: web.Request) -> web.Response:
+    """Answer a Bot API request the way Telegram would, as far as the bot can tell."""
+    method: str = request.match_info["method"]
+    data = await request.post()
+    api_calls[method] += 1
+
+    result: typing.Any = True
+    if method == "setWebhook" and not (web_hook_url := request.app["web_hook_url"]).done():
+        web_hook_url.set_result(data["url"])
+    elif method == "getMe":
+        result = FAKE_BOT_USER
+    elif method.startswith(("send", "edit", "forward", "copy")) and "chat_id" in data:
+        result = {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(data["chat_id"]), "type": "private"},
+            "from": FAKE_BOT_USER,
+            "text": data.get("text", ""),
+        }
+        if method == "sendPhoto":
+            # The photo sent by its `file_id` keeps it, the uploaded one gets a new one
+            if not isinstance(photo_id := data.get("photo"), str):
+                photo_id = f"fake-photo-{result['message_id']}"
+            result["photo"] = [
+                {"file_id": photo_id, "file_unique_id": photo_id, "width": 1, "height": 1}
+            ]
+            result["caption"] = data.get("caption", "")
+
+    return web.json_response({"ok": True, "result": result})
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict[str, typing.Any]:
+    """Make an update with a private text message from the user."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User {user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "text": text,
+        },
+    }
+
+
+async def push_updates(
+    url: str, updates: int, users: int, concurrency: int, text: str
+) -> list[float]:
+    """Push the updates to the webhook, and return the times it took to accept each of them."""
+    headers: dict[str, str] = {}
+    if settings.TELEGRAM_WEBHOOK_SECRET_TOKEN:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = settings.TELEGRAM_WEBHOOK_SECRET_TOKEN
+
+    update_ids = iter(range(1, updates + 1))
+    latencies: list[float] = []
+
+    async def push(session: aiohttp.ClientSession) -> None:
+        for update_id in update_ids:
+            _started_at = time.perf_counter()
+            async with session.post(
+                url,
+                json=make_update(update_id, 10_000 + update_id % users, text),
+                headers=headers,
+            ) as response:
+                response.raise_for_status()
+            latencies.append(time.perf_counter() - _started_at)
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(push(session) for _ in range(concurrency)))
+
+    return latencies
+
+
+async def main():
+    """Serve the fake Bot API, and push the updates to the bot's webhook."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8090, help="To serve the fake Bot API on")
+    parser.add_argument("--url", help="To push the updates to, instead of the bot's webhook")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--text", default="/start")
+    args = parser.parse_args()
+
+    app = web.Application()
+    # The URL the bot asks to push the updates to
+    app["web_hook_url"] = asyncio.get_running_loop().create_future()
+    app.router.add_post("/bot{token}/{method}", bot_api_method)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", args.port).start()
+    print(f"Serving the fake Bot API on http://localhost:{args.port}")
+
+    try:
+        if not (url := args.url):
+            print("Waiting for the bot to set its webhook...")
+            url = await app["web_hook_url"]
+
+        # Let the rest of the bot's processes start up
+        await asyncio.sleep(1)
+
+        _started_at = time.perf_counter()
+        latencies = await push_updates(url, args.updates, args.users, args.concurrency, args.text)
+        _took = time.perf_counter() - _started_at
+
+        print(
+            f"Pushed {len(latencies)} updates in {_took:.2f}s ({len(latencies) / _took:.1f}/s), "
+            f"latency p50 {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p95 {statistics.quantiles(latencies, n=20)[-1] * 1000:.1f}ms"
+        )
+        print(f"Bot API calls: {dict(api_calls)}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,183 @@
+"""
+The fast path for the few queries run on every update or every poll.
+
+The ORM builds the SQL of a query anew on every call, and an `__in` filter makes a different SQL for
+every count of the values. Here each query is written once, with `$n` parameters only, so its text
+never changes: asyncpg prepares it once per connection and then reuses the prepared statement from
+the connection's cache (see `DATABASE_STATEMENT_CACHE_SIZE`). The rows are turned into the models
+the same way the ORM does it, so the models are interchangeable with the ones the ORM returns.
+
+The queries are run on the current connection of the models, so they are a part of the current
+transaction, if any. Their SQL is public, so that their plans can be checked as they are made (see
+`benchmarks/query_plans.py`). The SQL selecting the columns of the models is built on the first
+call, since the ORM only knows all the columns (e.g. `for_user_id`) once `Tortoise.init` is done.
+
+NB: The models are made and related the way the ORM's internals do it, as of `tortoise-orm` 0.19.3
+(pinned in `poetry.lock`): with `Model._init_from_db`, the columns of `Model._meta`, and the
+`_<relation>` attributes `select_related` sets. Once it's upgraded, check that the fast path still
+returns the same as the ORM (`python -m benchmarks.hot_queries` does).
+"""
+import datetime
+import functools
+import typing
+from uuid import UUID
+
+import tortoise
+
+from models import Group, GroupPayment, MonobankAccount, Paycheck, Settings, User
+
+MODEL = typing.TypeVar("MODEL", bound=tortoise.Model)
+
+
+class ModelColumns(typing.Generic[MODEL]):
+    """The columns of a model selected under an alias, e.g. `"user"."id" AS "user.id"`."""
+
+    def __init__(self, model_class: typing.Type[MODEL], alias: str):
+        """Initialize the columns of the model under the alias."""
+        self.model_class = model_class
+        self.alias = alias
+        self._pk_key: str = f"{alias}.{model_class._meta.db_pk_column}"
+
+    @functools.cached_property
+    def _columns(self) -> list[str]:
+        """Get the columns of the model."""
+        # NB: `Tortoise.init` adds the columns of the foreign keys, so they are only got after it
+        return list(self.model_class._meta.fields_db_projection.values())
+
+    @property
+    def sql(self) -> str:
+        """Get the columns to put into the `SELECT` clause."""
+        return ", ".join(
+            f'"{self.alias}"."{column}" AS "{self.alias}.{column}"' for column in self._columns
+        )
+
+    def to_model(self, row: typing.Mapping[str, typing.Any]) -> MODEL | None:
+        """Make the model of the row, or get `None` if the model is missing (e.g. LEFT JOINed)."""
+        if row[self._pk_key] is None:
+            return None
+
+        return self.model_class._init_from_db(
+            **{column: row[f"{self.alias}.{column}"] for column in self._columns}
+        )
+
+
+async def _fetch(
+    model_class: typing.Type[tortoise.Model], sql: str, *args: typing.Any
+) -> list[typing.Mapping[str, typing.Any]]:
+    """Run the query on the current connection of the model, and get the rows."""
+    # NB: The connection of the transaction, if the query is run within one
+    async with model_class._meta.db.acquire_connection() as connection:
+        return await connection.fetch(sql, *args)
+
+
+# region Users
+_USER_COLUMNS: ModelColumns[User] = ModelColumns(User, "user")
+
+
+@functools.cache
+def get_user_sql() -> str:
+    """Get the SQL of `get_user`."""
+    return f'SELECT {_USER_COLUMNS.sql} FROM "user" "user" WHERE "user"."id" = $1'
+
+
+async def get_user(user_id: int) -> User | None:
+    """Get the user by the ID, like `User.get_or_none(id=user_id)`."""
+    rows = await _fetch(User, get_user_sql(), user_id)
+    return _USER_COLUMNS.to_model(rows[0]) if rows else None
+
+
+# endregion
+
+# region Paychecks
+_PAYCHECK_COLUMNS: ModelColumns[Paycheck] = ModelColumns(Paycheck, "paycheck")
+_FOR_USER_COLUMNS: ModelColumns[User] = ModelColumns(User, "for_user")
+_SETTINGS_COLUMNS: ModelColumns[Settings] = ModelColumns(Settings, "settings")
+_ACCOUNT_COLUMNS: ModelColumns[MonobankAccount] = ModelColumns(MonobankAccount, "account")
+_GROUP_PAYMENT_COLUMNS: ModelColumns[GroupPayment] = ModelColumns(GroupPayment, "group_payment")
+_GROUP_COLUMNS: ModelColumns[Group] = ModelColumns(Group, "group")
+
+
+@functools.cache
+def get_rendered_paycheck_sql() -> str:
+    """Get the SQL of `get_rendered_paycheck`."""
+    return (
+        f"SELECT {_PAYCHECK_COLUMNS.sql}, {_FOR_USER_COLUMNS.sql}, {_SETTINGS_COLUMNS.sql}, "
+        f"{_ACCOUNT_COLUMNS.sql}, {_GROUP_PAYMENT_COLUMNS.sql}, {_GROUP_COLUMNS.sql} "
+        'FROM "paycheck" "paycheck" '
+        'JOIN "user" "for_user" ON "for_user"."id" = "paycheck"."for_user_id" '
+        'LEFT JOIN "settings" "settings" ON "settings"."user_id" = "for_user"."id" '
+        'LEFT JOIN "monobank_account" "account" '
+        'ON "account"."id" = "settings"."monobank_account_to_pay_to_id" '
+        'LEFT JOIN "group_payment" "group_payment" '
+        'ON "group_payment"."id" = "paycheck"."generated_from_group_payment_id" '
+        'LEFT JOIN "group" "group" ON "group"."id" = "group_payment"."group_id" '
+        'WHERE "paycheck"."id" = $1'
+    )
+
+
+async def get_rendered_paycheck(paycheck_id: UUID | str) -> Paycheck | None:
+    """
+    Get the paycheck by the ID, with the relations its messages are rendered with.
+
+    The same as `Paycheck.get_or_none(id=paycheck_id).select_related(
+    *tasks.PAYCHECK_RENDERING_RELATIONS)`, in a single prepared statement.
+    """
+    rows = await _fetch(Paycheck, get_rendered_paycheck_sql(), UUID(str(paycheck_id)))
+    if not rows:
+        return None
+
+    row = rows[0]
+    paycheck: Paycheck = _PAYCHECK_COLUMNS.to_model(row)
+
+    # The way `select_related` sets the fetched relations
+    paycheck._for_user = user = _FOR_USER_COLUMNS.to_model(row)
+    user._settings = user_settings = _SETTINGS_COLUMNS.to_model(row)
+    if user_settings is not None:
+        user_settings._monobank_account_to_pay_to = _ACCOUNT_COLUMNS.to_model(row)
+    paycheck._generated_from_group_payment = group_payment = _GROUP_PAYMENT_COLUMNS.to_model(row)
+    if group_payment is not None:
+        group_payment._group = _GROUP_COLUMNS.to_model(row)
+
+    return paycheck
+
+
+# NB: The paychecks due before `$2` are likely abandoned, so they only count if there are no others,
+#  not to hide the ones due soon
+GET_NEAREST_DUE_DATES_SQL: str = (
+    'SELECT "paycheck"."to_account_id", coalesce('
+    'min("group_payment"."due_date") FILTER (WHERE "group_payment"."due_date" >= $2::TIMESTAMPTZ), '
+    'max("group_payment"."due_date")) AS "nearest_due_date" '
+    'FROM "paycheck" "paycheck" '
+    'JOIN "group_payment" "group_payment" '
+    'ON "group_payment"."id" = "paycheck"."generated_from_group_payment_id" '
+    'WHERE NOT "paycheck"."is_paid" AND "paycheck"."to_account_id" = ANY($1::VARCHAR[]) '
+    'GROUP BY "paycheck"."to_account_id"'
+)
+
+
+async def get_nearest_due_dates(
+    account_ids: list[str], not_before: datetime.datetime
+) -> dict[str, datetime.datetime]:
+    """
+    Get the nearest due date of the unpaid paychecks of each account, in one query.
+
+    Only the due dates `not_before` or later are considered, unless an account has no others: then
+    its latest due date is returned, still before `not_before`.
+    """
+    return {
+        row["to_account_id"]: row["nearest_due_date"]
+        for row in await _fetch(Paycheck, GET_NEAREST_DUE_DATES_SQL, account_ids, not_before)
+    }
+
+
+# endregion
+
+
+__all__ = [
+    "GET_NEAREST_DUE_DATES_SQL",
+    "get_nearest_due_dates",
+    "get_rendered_paycheck",
+    "get_rendered_paycheck_sql",
+    "get_user",
+    "get_user_sql",
+]
@@ -0,0 +1,148 @@
+"""
+The in-process directory of the `Group`s, to look them up by the ID, the UID or the name.
+
+There are only so many colivings, and they change rarely, while the users pick them all the time,
+so all the groups are loaded at once and kept in memory for `GROUP_DIRECTORY_TTL` seconds. A `Group`
+saved or deleted by any process is published to the Redis channel, so every process reloads the
+groups on the next lookup instead of waiting for the TTL to expire. Each process registers the
+signals doing that on startup (see `register_group_directory_signals`).
+"""
+import asyncio
+import math
+import time
+import typing
+
+import redis.asyncio
+import tortoise.signals
+
+from models import Group
+from settings import settings
+from utils.loguru_logging import logger
+from utils.redis_invalidation import RedisInvalidatedCache
+
+
+class GroupDirectory(RedisInvalidatedCache):
+    """All the `Group`s by their IDs, UIDs and names, reloaded once changed by any process."""
+
+    def __init__(
+        self,
+        redis_client: redis.asyncio.Redis,
+        ttl: float = 60 * 10,
+        channel: str = "group_directory:invalidate",
+    ):
+        """Initialize the directory. The groups are loaded on the first lookup."""
+        super().__init__(redis_client, channel)
+        self.ttl = ttl
+
+        # All the groups ordered by their names, and the same groups by their IDs, UIDs and names
+        self._groups: list[Group] = []
+        self._groups_by_id: dict[int, Group] = {}
+        self._groups_by_uid: dict[str, Group] = {}
+        self._groups_by_name: dict[str, Group] = {}
+        # The time the groups expire at, `0` if they are to be reloaded on the next lookup
+        self._expires_at: float = 0
+        self._invalidations: int = 0
+        self._loading_lock = asyncio.Lock()
+
+        self.loads: int = 0
+
+    async def _load(self) -> None:
+        """Load all the groups, unless they have been loaded by a concurrent lookup already."""
+        async with self._loading_lock:
+            if self._expires_at >= time.monotonic():
+                return
+
+            invalidations: int = self._invalidations
+            expires_at: float = time.monotonic() + self.ttl
+            groups: list[Group] = await Group.all().order_by("name", "id")
+
+            self._groups = groups
+            self._groups_by_id = {group.id: group for group in groups}
+            self._groups_by_uid = {group.uid: group for group in groups}
+            # NB: The names are not unique, so the first group with the name is looked up by it
+            self._groups_by_name = {}
+            for group in groups:
+                self._groups_by_name.setdefault(group.name, group)
+
+            # The groups changed while being loaded are loaded again on the next lookup
+            self._expires_at = expires_at if self._invalidations == invalidations else 0
+            self.loads += 1
+
+    async def _get_groups(self) -> list[Group]:
+        """Get all the groups, loading them if they have expired."""
+        if self._expires_at < time.monotonic():
+            await self._load()
+
+        return self._groups
+
+    async def get_by_id(self, group_id: int) -> Group | None:
+        """Get the group by its ID."""
+        await self._get_groups()
+        return self._groups_by_id.get(group_id)
+
+    async def get_by_uid(self, group_uid: str | int) -> Group | None:
+        """Get the group by its UID, e.g. the one saved as an `int` by the previous versions."""
+        await self._get_groups()
+        return self._groups_by_uid.get(str(group_uid))
+
+    async def get_by_name(self, group_name: str) -> Group | None:
+        """Get the group by its name."""
+        await self._get_groups()
+        return self._groups_by_name.get(group_name)
+
+    async def get_page(self, page: int, page_size: int) -> tuple[list[Group], int]:
+        """Get the page (starting with `0`) of the groups ordered by name, and the pages count."""
+        groups: list[Group] = await self._get_groups()
+        return groups[page * page_size : (page + 1) * page_size], math.ceil(len(groups) / page_size)
+
+    def invalidate(self) -> None:
+        """Reload the groups on the next lookup in this process."""
+        self._expires_at = 0
+        self._invalidations += 1
+
+    def _invalidate_key(self, key: str) -> None:
+        """Reload the groups, changed by another process, on the next lookup."""
+        self.invalidate()
+
+    def _invalidate_all(self) -> None:
+        """Reload the groups on the next lookup."""
+        self.invalidate()
+
+    async def publish_invalidation(self) -> None:
+        """Make the other processes reload the groups on their next lookups."""
+        # NB: All the groups are reloaded at once, so there is no key
+        await self._publish_invalidation("", "the groups")
+
+    async def stop(self) -> None:
+        """Stop listening for the invalidations."""
+        await super().stop()
+        logger.debug(f"Group directory: loaded {self.loads} times")
+
+
+group_directory = GroupDirectory(
+    redis.asyncio.Redis.from_url(settings.REDIS_URL, decode_responses=True),
+    ttl=settings.GROUP_DIRECTORY_TTL,
+)
+
+
+async def invalidate_group_directory_on_save(sender: typing.Type[Group], *_, **__):
+    """Reload the groups in all the processes once a group is saved."""
+    group_directory.invalidate()
+    await group_directory.publish_invalidation()
+
+
+async def invalidate_group_directory_on_delete(sender: typing.Type[Group], *_, **__):
+    """Reload the groups in all the processes once a group is deleted."""
+    group_directory.invalidate()
+    await group_directory.publish_invalidation()
+
+
+def register_group_directory_signals() -> None:
+    """Keep the directories in sync with the groups saved and deleted by this process."""
+    Group.register_listener(tortoise.signals.Signals.post_save, invalidate_group_directory_on_save)
+    Group.register_listener(
+        tortoise.signals.Signals.post_delete, invalidate_group_directory_on_delete
+    )
+
+
+__all__ = ["GroupDirectory", "group_directory", "register_group_directory_signals"]
@@ -1,26 +1,85 @@
-"""All the utilities around localizations."""
+"""
+All the utilities around localizations.
+
+The translations are loaded from `locales/*/LC_MESSAGES/messages.po` once, when the module is
+imported, and emojized right away, so getting a translation is just a dictionary lookup. It does not
+depend on the bot, so the worker uses the very same catalog without importing `main`.
+"""
+import functools
+import pathlib
+import string
 
 import babel
+import emoji
+from babel.messages.pofile import read_po
+
+LOCALES_DIR: pathlib.Path = pathlib.Path(__file__).parent.parent / "locales"
+
+
+class Catalog:
+    """The translations of all the languages, emojized in advance."""
+
+    def __init__(self, locales_dir: pathlib.Path, domain: str = "messages", default: str = "uk"):
+        """Load the translations of the `domain` for all the languages in the `locales_dir`."""
+        self.default = default
+
+        # The language -> the message key -> the emojized translation
+        self.translations: dict[str, dict[str, str]] = {}
+        for po_file_path in sorted(locales_dir.glob(f"*/LC_MESSAGES/{domain}.po")):
+            with po_file_path.open("rb") as po_file:
+                po_catalog = read_po(po_file)
+
+            self.translations[po_file_path.parent.parent.name] = {
+                message.id: emoji.emojize(message.string)
+                for message in po_catalog
+                # Skip the header, the plural forms and the translations to review, like `msgfmt`
+                if isinstance(message.id, str)
+                and message.id
+                and message.string
+                and not message.fuzzy
+            }
+
+        self._default_translations: dict[str, str] = self.translations.get(default, {})
+
+    @functools.lru_cache(maxsize=1024)
+    def get_language(self, language_code: str | None) -> str:
+        """Get the language to talk in to a user with the Telegram's `language_code`, e.g. `uk`."""
+        try:
+            language: str = babel.Locale.parse(language_code, sep="-").language
+        except (TypeError, ValueError):  # Including `babel.UnknownLocaleError`
+            return self.default
+
+        return language if language in self.translations else self.default
+
+    def gettext(self, key: str, language: str | None = None) -> str:
+        """Get the translation for the key, falling back to the default language and the key."""
+        if (translation := self.translations.get(language or self.default, {}).get(key)) is None:
+            translation = self._default_translations.get(key, key)
+
+        return translation
+
+
+catalog = Catalog(LOCALES_DIR)
+
+
+def gettext(key: str, language: str | None = None) -> str:
+    """Get the translation for the key in the language (see `get_language`)."""
+    return catalog.gettext(key, language)
 
 
-def custom_gettext(key: str, user_locale: babel.core.Locale) -> str:
-    """
-    Get the translation for the key in the user's locale.
+def get_language(language_code: str | None) -> str:
+    """Get the language to talk in to a user with the Telegram's `language_code`."""
+    return catalog.get_language(language_code)
 
-    This is basically a workaround for the fact that `i18n.gettext` doesn't support passing a
-    `babel.core.Locale` instance as the `locale` argument, and defaulting to the `i18n.default`
-    locale if the user's locale is not supported.
-    """
-    from main import i18n
 
-    return i18n.gettext(
-        key,
-        locale=(
-            _locale_language
-            if (_locale_language := user_locale.language) in i18n.locales
-            else i18n.default
-        ),
-    )
+def get_template_keys(template: str) -> set[str]:
+    """Get the keys the template is formatted with, e.g. `{"amount"}` for `"{amount:.2f} UAH"`."""
+    return {
+        # Only the key itself, without the attributes or the items accessed, e.g. `{key.attr}`
+        field_name.split(".", 1)[0].split("[", 1)[0]
+        for _, field_name, _, _ in string.Formatter().parse(template)
+        if field_name
+    }
 
 
-__all__ = ["custom_gettext"]
+__all__ = ["Catalog", "catalog", "get_language", "get_template_keys", "gettext"]
@@ -0,0 +1,249 @@
+"""
+The durable job queue on top of the Redis server used by the bot.
+
+The bot process enqueues the jobs, and the worker process consumes them with a pool of concurrent
+consumers. A job is removed from the queue only after it has been acknowledged, i.e. its handler
+has finished successfully. Otherwise, it is retried with an exponential backoff and moved to the
+dead-letter list once it runs out of attempts.
+
+A job is leased to its consumer for `visibility_timeout` seconds, and the lease is extended while
+the job is running, so only the jobs of the consumers that have died are run again by others.
+
+The data structures (all the keys are prefixed with the queue's name):
+    - `:jobs` HASH, the job's ID -> the job's JSON;
+    - `:pending` LIST of the IDs of the jobs ready to be run;
+    - `:processing` ZSET of the IDs of the jobs being run, scored by their lease's expiration time;
+    - `:delayed` ZSET of the IDs of the jobs to retry, scored by the time to retry them at;
+    - `:dead` LIST of the IDs of the jobs that ran out of attempts.
+"""
+import asyncio
+import json
+import random
+import time
+import traceback
+import typing
+import uuid
+
+import redis.asyncio
+
+from settings import settings
+from utils.loguru_logging import logger
+
+JobHandler = typing.Callable[..., typing.Awaitable[typing.Any]]
+
+# Atomically take the next pending job and lease it to the consumer.
+# KEYS: pending, processing; ARGV: lease expiration time
+_CLAIM_SCRIPT = """
+local job_id = redis.call("RPOP", KEYS[1])
+if job_id then
+    redis.call("ZADD", KEYS[2], ARGV[1], job_id)
+end
+return job_id
+"""
+
+# Atomically move the jobs due at `ARGV[1]` from a ZSET back to the pending list.
+# KEYS: source ZSET (processing or delayed), pending; ARGV: current time
+_REQUEUE_DUE_SCRIPT = """
+local job_ids = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, 100)
+for _, job_id in ipairs(job_ids) do
+    redis.call("ZREM", KEYS[1], job_id)
+    redis.call("LPUSH", KEYS[2], job_id)
+end
+return #job_ids
+"""
+
+
+# Extend the lease of the job, unless it has expired and the job has been requeued already.
+# KEYS: processing; ARGV: the job's ID, lease expiration time
+_EXTEND_LEASE_SCRIPT = """
+if redis.call("ZSCORE", KEYS[1], ARGV[1]) then
+    redis.call("ZADD", KEYS[1], ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+class JobQueue:
+    """The Redis-backed job queue with acknowledgements, retries and dead-lettering."""
+
+    def __init__(
+        self,
+        redis_client: redis.asyncio.Redis,
+        name: str = "job_queue",
+        max_attempts: int = 3,
+        retry_delay: float = 30,
+        visibility_timeout: float = 600,
+        poll_interval: float = 1,
+    ):
+        """Initialize the job queue."""
+        self.redis = redis_client
+        self.name = name
+
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+
+        self.handlers: dict[str, JobHandler] = {}
+
+        self._claim = self.redis.register_script(_CLAIM_SCRIPT)
+        self._requeue_due = self.redis.register_script(_REQUEUE_DUE_SCRIPT)
+        self._extend_lease = self.redis.register_script(_EXTEND_LEASE_SCRIPT)
+
+    def _key(self, suffix: str) -> str:
+        """Get the Redis key of the queue's data structure."""
+        return f"{self.name}:{suffix}"
+
+    def register(self, job_name: str) -> typing.Callable[[JobHandler], JobHandler]:
+        """Register the decorated coroutine function as the handler of the `job_name` jobs."""
+
+        def decorator(handler: JobHandler) -> JobHandler:
+            self.handlers[job_name] = handler
+            return handler
+
+        return decorator
+
+    async def enqueue(self, job_name: str, **kwargs) -> str:
+        """Enqueue a job to be run by a worker. The `kwargs` must be JSON-serializable."""
+        job_id: str = uuid.uuid4().hex
+        job: dict[str, typing.Any] = {
+            "id": job_id,
+            "name": job_name,
+            "kwargs": kwargs,
+            "attempts": 0,
+            "enqueued_at": time.time(),
+        }
+
+        async with self.redis.pipeline(transaction=True) as pipeline:
+            pipeline.hset(self._key("jobs"), job_id, json.dumps(job))
+            pipeline.lpush(self._key("pending"), job_id)
+            await pipeline.execute()
+
+        logger.info(f"Enqueued job `{job_name}` [ID:{job_id}] with {kwargs=}")
+        return job_id
+
+    async def _ack(self, job: dict) -> None:
+        """Acknowledge the successfully run job, removing it from the queue."""
+        async with self.redis.pipeline(transaction=True) as pipeline:
+            pipeline.zrem(self._key("processing"), job["id"])
+            pipeline.hdel(self._key("jobs"), job["id"])
+            await pipeline.execute()
+
+    async def _nack(self, job: dict, error: Exception) -> None:
+        """Schedule the failed job for a retry, or move it to the dead-letter list."""
+        job["attempts"] += 1
+        job["last_error"] = "".join(traceback.format_exception(error))
+
+        async with self.redis.pipeline(transaction=True) as pipeline:
+            pipeline.zrem(self._key("processing"), job["id"])
+            pipeline.hset(self._key("jobs"), job["id"], json.dumps(job))
+
+            if job["attempts"] >= self.max_attempts:
+                logger.error(f"Job `{job['name']}` [ID:{job['id']}] is dead: {error!r}")
+                pipeline.lpush(self._key("dead"), job["id"])
+            else:
+                # Exponential backoff with jitter, so that the retries do not come in waves
+                retry_in: float = self.retry_delay * 2 ** (job["attempts"] - 1)
+                retry_in *= random.uniform(0.75, 1.25)
+
+                logger.warning(
+                    f"Job `{job['name']}` [ID:{job['id']}] failed "
+                    f"(attempt {job['attempts']}/{self.max_attempts}), "
+                    f"retrying in {retry_in:.0f}s: {error!r}"
+                )
+                pipeline.zadd(self._key("delayed"), {job["id"]: time.time() + retry_in})
+
+            await pipeline.execute()
+
+    async def _keep_leased(self, job: dict) -> None:
+        """Keep extending the lease of the running job, until cancelled."""
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+
+            try:
+                if not await self._extend_lease(
+                    keys=[self._key("processing")],
+                    args=[job["id"], time.time() + self.visibility_timeout],
+                ):
+                    logger.error(f"Job `{job['name']}` [ID:{job['id']}] has lost its lease")
+                    return
+            except redis.RedisError as e:
+                logger.error(f"Failed to extend the lease of job [ID:{job['id']}]: {e!r}")
+
+    async def _run_one(self) -> bool:
+        """Claim and run the next pending job. Return whether there was a job to run."""
+        job_id: str | None = await self._claim(
+            keys=[self._key("pending"), self._key("processing")],
+            args=[time.time() + self.visibility_timeout],
+        )
+        if job_id is None:
+            return False
+
+        if (job_json := await self.redis.hget(self._key("jobs"), job_id)) is None:
+            logger.error(f"Job [ID:{job_id}] has no data, dropping it")
+            await self.redis.zrem(self._key("processing"), job_id)
+            return True
+
+        job: dict = json.loads(job_json)
+
+        if (handler := self.handlers.get(job["name"])) is None:
+            await self._nack(job, LookupError(f"No handler for the `{job['name']}` jobs"))
+            return True
+
+        logger.debug(f"Running job `{job['name']}` [ID:{job_id}]")
+        lease_keeper: asyncio.Task = asyncio.create_task(self._keep_leased(job))
+        try:
+            await handler(**job["kwargs"])
+        except Exception as e:
+            await self._nack(job, e)
+        else:
+            await self._ack(job)
+            logger.info(f"Job `{job['name']}` [ID:{job_id}] is done")
+        finally:
+            lease_keeper.cancel()
+
+        return True
+
+    async def _consumer(self, consumer_number: int) -> None:
+        """Keep running the jobs, one at a time."""
+        logger.debug(f"Job consumer #{consumer_number} of `{self.name}` started")
+
+        while True:
+            try:
+                if not await self._run_one():
+                    await asyncio.sleep(self.poll_interval)
+            except redis.RedisError as e:
+                logger.error(f"Job consumer #{consumer_number} of `{self.name}` failed: {e!r}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _requeue_due_jobs(self) -> None:
+        """Move the due retries and the jobs with expired leases back to the pending list."""
+        while True:
+            try:
+                for source in ("delayed", "processing"):
+                    if requeued := await self._requeue_due(
+                        keys=[self._key(source), self._key("pending")], args=[time.time()]
+                    ):
+                        logger.info(f"Requeued {requeued} `{source}` jobs of `{self.name}`")
+            except redis.RedisError as e:
+                logger.error(f"Failed to requeue the due jobs of `{self.name}`: {e!r}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def consume(self, consumers: int) -> None:
+        """Run the jobs with `consumers` concurrent consumers. Never returns."""
+        logger.info(f"Consuming `{self.name}` with {consumers} consumers")
+
+        await asyncio.gather(
+            self._requeue_due_jobs(),
+            *(self._consumer(consumer_number) for consumer_number in range(consumers)),
+        )
+
+
+job_queue = JobQueue(
+    redis.asyncio.Redis.from_url(settings.REDIS_URL, decode_responses=True),
+    max_attempts=settings.JOB_QUEUE_MAX_ATTEMPTS,
+    retry_delay=settings.JOB_QUEUE_RETRY_DELAY,
+    visibility_timeout=settings.JOB_QUEUE_VISIBILITY_TIMEOUT,
+)
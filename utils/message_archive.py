@@ -0,0 +1,226 @@
+"""
+The retention of the logged `Message`s.
+
+The `message` table is partitioned by the month of the `Message.date`, one `message_YYYY_MM` table
+per month. The worker keeps the partitions created `MESSAGE_PARTITIONS_AHEAD` months ahead, and
+once a month is older than `MESSAGE_RETENTION_DAYS`, exports its partition into a gzipped CSV file
+in `MESSAGE_ARCHIVE_DIR` and drops it, so the table never grows past the retention period and
+there is nothing left to vacuum after the old messages.
+
+Should the worker fail to create a partition in time, the messages are saved into the default
+partition, `message_default`, and moved out once the month's partition is created. The partitions
+are only dropped once their archives are on a durable disk, so nothing is archived (or dropped)
+until `MESSAGE_ARCHIVE_DIR` is set.
+
+Usage (to read the archived messages):
+    python -m utils.message_archive --from 2023-01-01 --to 2023-02-01 > messages.csv
+"""
+import argparse
+import csv
+import gzip
+import os
+import pathlib
+import re
+import sys
+import typing
+
+import arrow
+import tortoise
+from tortoise.transactions import in_transaction
+
+from settings import settings
+from utils.loguru_logging import logger
+
+MESSAGE_PARTITION_NAME_PATTERN: re.Pattern = re.compile(r"^message_(?P<month>\d{4}_\d{2})$")
+
+
+def _get_partition_name(month_start: arrow.Arrow) -> str:
+    """Get the name of the partition of the month's messages."""
+    return f"message_{month_start.format('YYYY_MM')}"
+
+
+def _get_archive_path(archive_dir: pathlib.Path, partition_name: str) -> pathlib.Path:
+    """Get the path of the archive of the partition."""
+    return archive_dir / f"{partition_name}.csv.gz"
+
+
+async def create_message_partition(month_start: arrow.Arrow) -> None:
+    """
+    Create the partition for the messages of the month.
+
+    The month's messages saved into the default partition meanwhile (if any) are moved into it.
+    """
+    partition_name: str = _get_partition_name(month_start)
+    month_range_sql: str = (
+        f"'{month_start.isoformat()}' AND \"date\" < '{month_start.shift(months=1).isoformat()}'"
+    )
+
+    # NB: The default partition must have none of the rows of a new partition, so they are put
+    #  aside while it's created, within the same transaction
+    async with in_transaction("default") as connection:
+        await connection.execute_script(
+            'CREATE TEMPORARY TABLE "message_moved" (LIKE "message") ON COMMIT DROP'
+        )
+        moved_messages: list[dict] = await connection.execute_query_dict(
+            'WITH "moved" AS (DELETE FROM "message_default" '
+            f'WHERE "date" >= {month_range_sql} RETURNING *), '
+            '"inserted" AS (INSERT INTO "message_moved" SELECT * FROM "moved" RETURNING 1) '
+            'SELECT count(*) AS "count" FROM "inserted"'
+        )
+        await connection.execute_script(
+            f'CREATE TABLE "{partition_name}" PARTITION OF "message" '
+            f"FOR VALUES FROM ('{month_start.isoformat()}') "
+            f"TO ('{month_start.shift(months=1).isoformat()}'); "
+            'INSERT INTO "message" SELECT * FROM "message_moved"'
+        )
+
+    if moved_count := moved_messages[0]["count"]:
+        logger.warning(
+            f"Moved {moved_count} messages from the default partition into `{partition_name}`"
+        )
+    logger.info(f"Created the `{partition_name}` partition of the messages")
+
+
+async def create_message_partitions(months_ahead: int) -> None:
+    """Create the partitions for the messages of this month and `months_ahead` next ones."""
+    partitions: dict[str, arrow.Arrow] = await get_message_partitions()
+
+    this_month_start: arrow.Arrow = arrow.utcnow().floor("month")
+    for month in range(months_ahead + 1):
+        month_start: arrow.Arrow = this_month_start.shift(months=month)
+        if _get_partition_name(month_start) not in partitions:
+            await create_message_partition(month_start)
+
+
+async def get_message_partitions() -> dict[str, arrow.Arrow]:
+    """Get the partitions of the `message` table, with the months they are for."""
+    connection = tortoise.connections.get("default")
+
+    rows: list[dict] = await connection.execute_query_dict(
+        "SELECT child.relname AS partition_name "
+        "FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = 'message'"
+    )
+
+    return {
+        row["partition_name"]: arrow.get(match.group("month"), "YYYY_MM")
+        for row in rows
+        if (match := MESSAGE_PARTITION_NAME_PATTERN.match(row["partition_name"]))
+    }
+
+
+def _fsync_directory(directory: pathlib.Path) -> None:
+    """Make sure the files renamed within the directory stay renamed after a crash."""
+    directory_fd: int = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+async def archive_message_partition(archive_dir: pathlib.Path, partition_name: str) -> pathlib.Path:
+    """Export the partition into a gzipped CSV file and drop it. Return the file's path."""
+    archive_path: pathlib.Path = _get_archive_path(archive_dir, partition_name)
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file first, so that a half-written archive never looks complete
+    temporary_archive_path: pathlib.Path = archive_path.with_suffix(".tmp")
+
+    async with tortoise.connections.get("default").acquire_connection() as connection:
+        with temporary_archive_path.open("wb") as raw_archive_file:
+            with gzip.GzipFile(fileobj=raw_archive_file, mode="wb") as archive_file:
+
+                async def write(data: bytes) -> None:
+                    archive_file.write(data)
+
+                await connection.copy_from_table(
+                    partition_name, output=write, format="csv", header=True
+                )
+
+            # The partition is dropped right after, so the archive must be on the disk by then
+            raw_archive_file.flush()
+            os.fsync(raw_archive_file.fileno())
+
+    temporary_archive_path.replace(archive_path)
+    _fsync_directory(archive_path.parent)
+
+    async with in_transaction("default") as connection:
+        await connection.execute_script(
+            f'ALTER TABLE "message" DETACH PARTITION "{partition_name}"; '
+            f'DROP TABLE "{partition_name}"'
+        )
+
+    logger.info(f"Archived the `{partition_name}` messages into `{archive_path}`")
+    return archive_path
+
+
+async def archive_old_message_partitions(
+    archive_dir: pathlib.Path | None, retention_days: int
+) -> list[pathlib.Path]:
+    """
+    Archive the partitions of the months that ended over `retention_days` days ago.
+
+    Nothing is archived without the `archive_dir`, the old messages are kept in the database.
+    """
+    if archive_dir is None:
+        logger.warning("Not archiving the old messages, since `MESSAGE_ARCHIVE_DIR` is not set")
+        return []
+
+    retain_since: arrow.Arrow = arrow.utcnow().shift(days=-retention_days)
+
+    return [
+        await archive_message_partition(archive_dir, partition_name)
+        for partition_name, month_start in sorted(
+            (await get_message_partitions()).items(), key=lambda item: item[1]
+        )
+        if month_start.shift(months=1) <= retain_since
+    ]
+
+
+def read_archived_messages(
+    archive_dir: pathlib.Path, from_time: arrow.Arrow, to_time: arrow.Arrow
+) -> typing.Iterator[dict[str, str]]:
+    """Read the archived messages sent within the time range, the archives' rows as they are."""
+    for archive_path in sorted(archive_dir.glob("message_*.csv.gz")):
+        if not (
+            match := MESSAGE_PARTITION_NAME_PATTERN.match(archive_path.name.removesuffix(".csv.gz"))
+        ):
+            continue
+
+        # Skip the months outside the time range without unpacking them
+        month_start: arrow.Arrow = arrow.get(match.group("month"), "YYYY_MM")
+        if month_start >= to_time or month_start.shift(months=1) <= from_time:
+            continue
+
+        with gzip.open(archive_path, "rt", newline="") as archive_file:
+            for row in csv.DictReader(archive_file):
+                if from_time <= arrow.get(row["date"]) < to_time:
+                    yield row
+
+
+def main():
+    """Print the archived messages sent within the time range as CSV."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--from", dest="from_time", type=arrow.get, required=True)
+    parser.add_argument("--to", dest="to_time", type=arrow.get, default=arrow.utcnow())
+    parser.add_argument(
+        "--archive-dir",
+        type=pathlib.Path,
+        default=settings.MESSAGE_ARCHIVE_DIR,
+        required=settings.MESSAGE_ARCHIVE_DIR is None,
+        help="`MESSAGE_ARCHIVE_DIR` by default",
+    )
+    args = parser.parse_args()
+
+    writer: csv.DictWriter | None = None
+    for row in read_archived_messages(args.archive_dir, args.from_time, args.to_time):
+        if writer is None:
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+
+
+if __name__ == "__main__":
+    main()
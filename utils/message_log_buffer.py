@@ -0,0 +1,165 @@
+"""
+The write-behind buffer of the incoming messages logged into the database.
+
+The messages are not saved while their updates are being processed: they are collected in memory
+and saved with a single bulk insert once `MESSAGE_LOG_BATCH_SIZE` of them are collected, or every
+`MESSAGE_LOG_FLUSH_INTERVAL` seconds. At most `MESSAGE_LOG_MAX_BUFFERED` messages are kept, so if
+the database is down for a while, the oldest messages are dropped instead of eating up the memory.
+
+Only the batches failing for a transient reason (e.g. the database being down) are retried. If the
+database rejects a batch, it is split in halves, until the rejected messages are found and dropped,
+so that a single bad message (e.g. dated with no partition for it) does not block all the others.
+"""
+import asyncio
+import collections
+import random
+
+import tortoise.exceptions
+
+from models import Message
+from settings import settings
+from utils.loguru_logging import logger
+
+# The errors caused by the messages themselves, so saving them again fails the same way
+_REJECTED_MESSAGES_ERRORS: tuple[type[Exception], ...] = (
+    tortoise.exceptions.OperationalError,
+    tortoise.exceptions.ValidationError,
+    TypeError,
+    ValueError,
+)
+
+
+class MessageLogBuffer:
+    """The buffer of the `Message`s, saved in batches by a background task."""
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        flush_interval: float = 5,
+        max_buffered: int = 10_000,
+        sample_rates: dict[str, float] | None = None,
+        default_sample_rate: float = 1,
+    ):
+        """Initialize the buffer."""
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # The share of the messages of each content type to log, e.g. `{"sticker": 0.1}`
+        self.sample_rates = sample_rates or {}
+        self.default_sample_rate = default_sample_rate
+
+        self._messages: collections.deque[Message] = collections.deque(maxlen=max_buffered)
+        self._flush_lock = asyncio.Lock()
+        self._flush_needed = asyncio.Event()
+        self._flusher_task: asyncio.Task | None = None
+
+        self.messages_logged: int = 0
+        self.messages_dropped: int = 0
+
+    def should_log(self, content_type: str) -> bool:
+        """Decide whether to log a message with the content type, according to the sampling."""
+        sample_rate: float = self.sample_rates.get(content_type, self.default_sample_rate)
+        return sample_rate >= 1 or random.random() < sample_rate
+
+    def add(self, message: Message) -> None:
+        """Buffer the (unsaved) message to be saved with the next batch."""
+        if len(self._messages) == self._messages.maxlen:
+            self.messages_dropped += 1  # The oldest one is pushed out
+
+        self._messages.append(message)
+
+        if len(self._messages) >= self.batch_size:
+            self._flush_needed.set()
+
+    async def flush(self) -> int:
+        """Save all the buffered messages with a bulk insert. Return how many were saved."""
+        async with self._flush_lock:
+            if not self._messages:
+                return 0
+
+            messages: list[Message] = list(self._messages)
+            self._messages.clear()
+
+            saved, failed = await self._save(messages)
+            self.messages_logged += saved
+            if failed:
+                # Put them back to retry with the next batch, as many as still fit
+                fits: int = self._messages.maxlen - len(self._messages)
+                self.messages_dropped += max(len(failed) - fits, 0)
+                self._messages.extendleft(reversed(failed[-fits:] if fits else []))
+
+            logger.debug(f"Saved {saved} logged messages")
+            return saved
+
+    async def _save(self, messages: list[Message]) -> tuple[int, list[Message]]:
+        """
+        Save the messages, dropping the ones the database rejects.
+
+        Return how many were saved, and the ones failed for a transient reason, to retry later.
+        """
+        try:
+            await Message.bulk_create(messages)
+        except _REJECTED_MESSAGES_ERRORS as e:
+            if len(messages) == 1:
+                message: Message = messages[0]
+                self.messages_dropped += 1
+                logger.error(
+                    f"Dropped the logged message {message.message_id=} of {message.user_id=} "
+                    f"({message.date=}): {e} ({e.__class__})"
+                )
+                return 0, []
+
+            # Find the rejected ones, saving the rest
+            middle: int = len(messages) // 2
+            saved, failed = await self._save(messages[:middle])
+            if failed:
+                return saved, failed + messages[middle:]
+
+            saved_later, failed = await self._save(messages[middle:])
+            return saved + saved_later, failed
+        except Exception as e:
+            logger.error(f"Failed to save {len(messages)} logged messages: {e} ({e.__class__})")
+            return 0, messages
+
+        return len(messages), []
+
+    async def _flush_periodically(self) -> None:
+        """Keep saving the messages every `flush_interval` seconds, or once a batch is full."""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+
+            # Let the batch being saved finish, even if the task is being stopped
+            await asyncio.shield(self.flush())
+
+    def start(self) -> None:
+        """Start saving the buffered messages in the background."""
+        if self._flusher_task is None or self._flusher_task.done():
+            self._flusher_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        """Stop the background task and save the messages left in the buffer."""
+        if self._flusher_task is not None:
+            self._flusher_task.cancel()
+            await asyncio.gather(self._flusher_task, return_exceptions=True)
+            self._flusher_task = None
+
+        await self.flush()
+
+        logger.debug(
+            f"Message log: {self.messages_logged} messages saved, {self.messages_dropped} dropped"
+        )
+
+
+message_log_buffer = MessageLogBuffer(
+    batch_size=settings.MESSAGE_LOG_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_LOG_FLUSH_INTERVAL,
+    max_buffered=settings.MESSAGE_LOG_MAX_BUFFERED,
+    sample_rates=settings.MESSAGE_LOG_SAMPLE_RATES,
+    default_sample_rate=settings.MESSAGE_LOG_DEFAULT_SAMPLE_RATE,
+)
+
+
+__all__ = ["MessageLogBuffer", "message_log_buffer"]
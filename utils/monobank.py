@@ -1,23 +1,358 @@
 """A module with all the Monobank integration logic."""
 import asyncio
+import dataclasses
+import datetime
+import random
+import time
 import typing
 
 import aiohttp
 import arrow
+import pydantic
 import stringcase
-import tortoise
 
 from models import MonobankAccount, MonobankAccountStatement, MonobankClient
+from settings import settings
 from utils.loguru_logging import logger
+from utils.tortoise_orm import bulk_insert_ignore_conflicts
+
+# Monobank API allows one request per 60 seconds per token
+MONOBANK_API_REQUEST_INTERVAL: int = 60
+# Monobank API returns the statements for at most 31 days (+1 hour), at most 500 at once
+MONOBANK_STATEMENTS_MAX_TIME_RANGE = datetime.timedelta(days=31)
+MONOBANK_STATEMENTS_PAGE_SIZE: int = 500
+# The statements might show up in the API a bit after their time, so the polls overlap
+MONOBANK_STATEMENTS_CURSOR_OVERLAP = datetime.timedelta(minutes=10)
+
+# Called with each batch of the newly saved statements
+NewAccountStatementsCallback = typing.Callable[
+    [list[MonobankAccountStatement]], typing.Awaitable[typing.Any]
+]
+
+
+class TokenRateLimiter:
+    """Keep the Monobank API requests made with a single token within the allowed budget."""
+
+    def __init__(self, interval: float = MONOBANK_API_REQUEST_INTERVAL):
+        """Initialize the rate limiter."""
+        self.interval = interval
+
+        self._next_request_at: float = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        """Wait until a request can be made with the token, and book the time for it."""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+
+            if (_time_to_sleep := self._next_request_at - loop.time()) > 0:
+                logger.debug(f"Sleeping for {_time_to_sleep} seconds")
+                await asyncio.sleep(_time_to_sleep)
+
+            self._next_request_at = loop.time() + self.interval
+
+
+_token_rate_limiters: dict[str, TokenRateLimiter] = {}
+
+
+def get_token_rate_limiter(token: str) -> TokenRateLimiter:
+    """Get the rate limiter shared by all the requests made with the token."""
+    if (rate_limiter := _token_rate_limiters.get(token)) is None:
+        rate_limiter = _token_rate_limiters[token] = TokenRateLimiter()
+
+    return rate_limiter
+
+
+# region Monobank API
+class MonobankAPIModel(pydantic.BaseModel):
+    """The base model for the Monobank API responses, which use the `camelCase` keys."""
+
+    class Config:
+        """The configuration for the model."""
+
+        alias_generator = stringcase.camelcase
+        allow_population_by_field_name = True
+
+
+class StatementItem(MonobankAPIModel):
+    """The statement item, as returned by the Monobank API (and pushed to the webhook)."""
+
+    id: str
+    time: datetime.datetime
+
+    description: str
+    comment: str | None = None
+
+    mcc: int
+    original_mcc: int
+
+    amount: int
+    operation_amount: int
+    currency_code: int
+    commission_rate: int
+    cashback_amount: int
+
+    balance: int
+
+    hold: bool
+
+    receipt_id: str | None = None
+    invoice_id: str | None = None
+
+    # NB: These are named the same way as the `MonobankAccountStatement` fields
+    counterEdrpou: str | None = None
+    counterIban: str | None = None
+
+
+class Account(MonobankAPIModel):
+    """The account, as returned by the Monobank API."""
+
+    id: str
+    send_id: str | None = None
+    currency_code: int
+    cashback_type: str | None = None
+    balance: int
+    credit_limit: int
+    masked_pan: list[str] = []
+    type: str
+    iban: str
+
+
+class ClientInfo(MonobankAPIModel):
+    """The client info, as returned by the Monobank API."""
+
+    client_id: str
+    name: str
+    web_hook_url: str | None = None
+    permissions: str
+    accounts: list[Account] = []
+
+
+class MonobankAPIError(Exception):
+    """The error returned by the Monobank API."""
+
+    def __init__(self, status: int, message: str):
+        """Initialize the error."""
+        super().__init__(f"Monobank API error {status}: {message}")
+        self.status = status
+
+
+@dataclasses.dataclass
+class MonobankAPIStats:
+    """The statistics of the requests made by the `MonobankAPIClient`."""
+
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+    responses_by_status: dict[int, int] = dataclasses.field(default_factory=dict)
+
+    total_latency_seconds: float = 0.0
+    max_latency_seconds: float = 0.0
+
+    @property
+    def average_latency_seconds(self) -> float:
+        """Get the average latency of the requests."""
+        return self.total_latency_seconds / self.requests if self.requests else 0.0
+
+
+class MonobankAPIClient:
+    """
+    The Monobank API client.
+
+    It keeps a single connection pool for all the requests, and makes sure the requests made with
+    a token stay within its rate limit. The rate limiting errors (429), the server errors (5xx)
+    and the network errors are retried a bounded number of times, with an exponential backoff
+    and jitter.
+    """
+
+    BASE_URL: str = "https://api.monobank.ua"
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        retry_delay: float = 1,
+        timeout: aiohttp.ClientTimeout = aiohttp.ClientTimeout(total=30, connect=10),
+    ):
+        """Initialize the client. The connection pool is created on the first request."""
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+        self.stats = MonobankAPIStats()
+
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Get the session, (re)creating it if necessary."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                base_url=self.BASE_URL,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60 * 2),
+            )
+
+        return self._session
+
+    async def close(self) -> None:
+        """Close the connection pool."""
+        if self._session is not None:
+            await self._session.close()
+
+    def _get_retry_delay(self, attempt: int) -> float:
+        """Get the delay before the retry, with an exponential backoff and jitter."""
+        return self.retry_delay * 2**attempt * random.uniform(0.5, 1.5)
+
+    async def _request(
+        self, method: str, path: str, token: str, json: dict | None = None
+    ) -> typing.Any:
+        """Make a request to the Monobank API and return the decoded JSON response."""
+        status: int = 0
+        error_message: str = ""
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats.retries += 1
+                await asyncio.sleep(self._get_retry_delay(attempt - 1))
+
+            # Wait for the token's budget to avoid hitting the "429 Too Many Requests" error
+            await get_token_rate_limiter(token).wait()
+
+            _started_at: float = time.perf_counter()
+            try:
+                async with self._get_session().request(
+                    method, path, json=json, headers={"X-Token": token}
+                ) as response:
+                    status = response.status
+                    response_json: typing.Any = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # The network errors, the timeouts and the non-JSON responses are retried
+                logger.warning(f"Monobank API request `{method} {path}` failed: {e!r}")
+                status, error_message = 0, repr(e)
+                continue
+            finally:
+                _latency: float = time.perf_counter() - _started_at
+                self.stats.requests += 1
+                self.stats.total_latency_seconds += _latency
+                self.stats.max_latency_seconds = max(self.stats.max_latency_seconds, _latency)
+                self.stats.responses_by_status[status] = (
+                    self.stats.responses_by_status.get(status, 0) + 1
+                )
+
+            if 200 <= status < 300:
+                return response_json
+
+            error_message = (
+                response_json.get("errorDescription", str(response_json))
+                if isinstance(response_json, dict)
+                else str(response_json)
+            )
+            logger.warning(f"Monobank API request `{method} {path}` failed: {status=}")
+
+            # Only the rate limiting and the server errors are worth retrying
+            if status != 429 and status < 500:
+                break
+
+        self.stats.failures += 1
+        raise MonobankAPIError(status, error_message)
+
+    async def get_client_info(self, token: str) -> ClientInfo:
+        """Get the info about the client and their accounts."""
+        return ClientInfo.parse_obj(await self._request("GET", "/personal/client-info", token))
+
+    async def get_statements(
+        self, token: str, account_id: str, from_time: arrow.Arrow, to_time: arrow.Arrow
+    ) -> list[StatementItem]:
+        """Get the account's statements in the time range, from the newest to the oldest."""
+        statements: typing.Any = await self._request(
+            "GET",
+            f"/personal/statement/{account_id}/{from_time.int_timestamp}/{to_time.int_timestamp}",
+            token,
+        )
+        if not isinstance(statements, list):
+            raise MonobankAPIError(200, f"Unexpected statements response: {statements!r}")
+
+        return [StatementItem.parse_obj(statement) for statement in statements]
+
+    async def set_web_hook(self, token: str, web_hook_url: str) -> None:
+        """Make Monobank send the new statements of the client's accounts to the `web_hook_url`."""
+        await self._request("POST", "/personal/webhook", token, json={"webHookUrl": web_hook_url})
+
+
+monobank_api = MonobankAPIClient(
+    max_retries=settings.MONOBANK_API_MAX_RETRIES,
+    timeout=aiohttp.ClientTimeout(
+        total=settings.MONOBANK_API_TIMEOUT, connect=settings.MONOBANK_API_CONNECT_TIMEOUT
+    ),
+)
+
+
+# endregion
+
+
+async def save_account_statements(
+    monobank_account: MonobankAccount, statement_items: typing.Sequence[StatementItem]
+) -> list[MonobankAccountStatement]:
+    """
+    Save the statement items for the account, in a single query.
+
+    Return only the newly created statements: the ones already saved (e.g. by the webhook or the
+    previous poll) are skipped by the database.
+    """
+    account_statements: list[MonobankAccountStatement] = await bulk_insert_ignore_conflicts(
+        MonobankAccountStatement,
+        [
+            MonobankAccountStatement(monobank_account=monobank_account, **statement_item.dict())
+            for statement_item in statement_items
+        ],
+    )
+
+    for account_statement in account_statements:
+        logger.info(
+            f"Created account statement with ID `{account_statement.id}` "
+            f"for account `{monobank_account.id}`"
+        )
+    return account_statements
+
+
+async def save_account_statement(
+    monobank_account: MonobankAccount, statement_item: StatementItem
+) -> MonobankAccountStatement | None:
+    """
+    Save the statement item for the account.
+
+    Return `None` if the statement has already been saved, e.g. by the webhook or the poller.
+    """
+    if account_statements := await save_account_statements(monobank_account, [statement_item]):
+        return account_statements[0]
+
+    return None
+
+
+def get_web_hook_url() -> str | None:
+    """Get the URL Monobank pushes the new statements to, `None` if the webhook is disabled."""
+    if not settings.MONOBANK_WEBHOOK_BASE_URL:
+        return None
+
+    return (
+        f"{settings.MONOBANK_WEBHOOK_BASE_URL}{settings.MONOBANK_WEBHOOK_PATH}/"
+        f"{settings.MONOBANK_WEBHOOK_SECRET}"
+    )
+
+
+async def set_web_hook(monobank_client: MonobankClient, web_hook_url: str) -> None:
+    """Make Monobank send the new statements of the client's accounts to the `web_hook_url`."""
+    await monobank_api.set_web_hook(monobank_client.token, web_hook_url)
+
+    monobank_client.web_hook_url = web_hook_url
+    await monobank_client.save(update_fields=["web_hook_url"])
+
+    logger.info(f"Set the web hook for the Monobank client [ID:{monobank_client.pk}]")
 
 
 async def pull_all_account_statements(
     monobank_account_id: str,
     continue_terminated: bool = False,
-    new_account_statement_callback: typing.Callable[
-        [MonobankAccountStatement], typing.Awaitable[typing.Any]
-    ]
-    | None = None,
+    new_account_statements_callback: NewAccountStatementsCallback | None = None,
 ) -> None:
     """Pull all account statements for the account with the given ID."""
     logger.info(f"Pulling all account statements for account `{monobank_account_id}`")
@@ -44,69 +379,134 @@ async def pull_all_account_statements(
             f"Pulling statements from {_pull_statements_from_time} to {_pull_statements_up_to_time}"
         )
 
-        # Save the time of the API call to avoid hitting the "429 Too Many Requests" error
-        _api_call_time: arrow.Arrow = arrow.utcnow()
-        logger.debug(f"API call time: {_api_call_time}")
-
         # Pull statements
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://api.monobank.ua/personal/statement/{monobank_account.id}/"
-                f"{_pull_statements_from_time.int_timestamp}/"
-                # -1 second to avoid pulling the same statement twice
-                f"{_pull_statements_up_to_time.int_timestamp - 1}",
-                headers={"X-Token": monobank_client.token},
-            ) as response:
-                pulled_account_statements: list[dict] = await response.json()
-
-                # If there are no statements and the last statement creates a balance
-                #  equal to its amount, then we've pulled all the statements
-                # NB: This has not been tested yet
-                if not pulled_account_statements:
-                    _last_statement = (
-                        await MonobankAccountStatement.filter(monobank_account=monobank_account)
-                        .order_by("-time")
-                        .first()
-                    )
-                    if _last_statement and _last_statement.balance == _last_statement.amount:
-                        logger.info("All done!")
-                        return
-                    logger.warning("No statements were pulled, but we're not done yet.")
-
-                for pulled_account_statement in pulled_account_statements:
-                    try:
-                        account_statement = await MonobankAccountStatement.create(
-                            monobank_account=monobank_account,
-                            **{
-                                stringcase.snakecase(key): value
-                                for key, value in pulled_account_statement.items()
-                            },
-                        )
-                        logger.info(
-                            f"Created account statement with ID `{account_statement.id}` "
-                            f"for account `{monobank_account.id}`"
-                        )
-                        if new_account_statement_callback:
-                            await new_account_statement_callback(account_statement)
-                    except tortoise.exceptions.IntegrityError:  # Statement already exists
-                        # pass
-                        logger.info("All done!")
-                        return  # We've pulled all the new statements
+        pulled_account_statements: list[StatementItem] = await monobank_api.get_statements(
+            monobank_client.token,
+            monobank_account.id,
+            from_time=_pull_statements_from_time,
+            # -1 second to avoid pulling the same statement twice
+            to_time=_pull_statements_up_to_time.shift(seconds=-1),
+        )
+
+        # If there are no statements and the last statement creates a balance
+        #  equal to its amount, then we've pulled all the statements
+        # NB: This has not been tested yet
+        if not pulled_account_statements:
+            _last_statement = (
+                await MonobankAccountStatement.filter(monobank_account=monobank_account)
+                .order_by("-time")
+                .first()
+            )
+            if _last_statement and _last_statement.balance == _last_statement.amount:
+                logger.info("All done!")
+                return
+            logger.warning("No statements were pulled, but we're not done yet.")
+
+        # Statements come from the newest to the oldest, so once an existing statement
+        #  is met, the rest of the history has been pulled already (e.g. by the webhook)
+        account_statements = await save_account_statements(
+            monobank_account, pulled_account_statements
+        )
+        if new_account_statements_callback and account_statements:
+            await new_account_statements_callback(account_statements)
+
+        if len(account_statements) < len(pulled_account_statements):
+            logger.info("All done!")
+            return  # We've pulled all the new statements
 
         _pull_statements_up_to_time = min(
-            _pull_statements_from_time, arrow.Arrow.fromdatetime(account_statement.time)
+            _pull_statements_from_time,
+            arrow.get(pulled_account_statements[-1].time)
+            if pulled_account_statements
+            else _pull_statements_from_time,
         )
 
-        # Sleep to make sure we don't send more than 1 request per 60 seconds
-        _time_to_sleep: float = (_api_call_time.shift(seconds=60) - arrow.utcnow()).total_seconds()
-        logger.debug(f"Sleeping for {_time_to_sleep} seconds")
-        await asyncio.sleep(_time_to_sleep if _time_to_sleep > 0 else 0)
+
+async def pull_new_account_statements(
+    monobank_account_id: str,
+    new_account_statements_callback: NewAccountStatementsCallback | None = None,
+) -> list[MonobankAccountStatement]:
+    """
+    Pull the account statements made since the previous poll, and return the new ones.
+
+    The polls resume from the account's cursor (`MonobankAccount.last_statement_time`), which is
+    only moved once all the statements up to it have been saved, so a restarted poll picks up
+    exactly where the previous one stopped. If the account has never been polled, only the last
+    `MONOBANK_STATEMENTS_MAX_TIME_RANGE` is pulled (see `pull_all_account_statements` to pull
+    the whole history).
+    """
+    monobank_account = await MonobankAccount.get(id=monobank_account_id).select_related(
+        "monobank_client"
+    )
+
+    _now: arrow.Arrow = arrow.utcnow()
+    _pull_statements_from_time: arrow.Arrow = (
+        arrow.get(monobank_account.last_statement_time).shift(
+            seconds=-MONOBANK_STATEMENTS_CURSOR_OVERLAP.total_seconds()
+        )
+        if monobank_account.last_statement_time
+        else _now.shift(seconds=-MONOBANK_STATEMENTS_MAX_TIME_RANGE.total_seconds())
+    )
+    logger.info(
+        f"Pulling new account statements for account `{monobank_account_id}` "
+        f"since {_pull_statements_from_time}"
+    )
+
+    new_account_statements: list[MonobankAccountStatement] = []
+    while _pull_statements_from_time < _now:
+        _pull_statements_up_to_time: arrow.Arrow = min(
+            _pull_statements_from_time.shift(
+                seconds=MONOBANK_STATEMENTS_MAX_TIME_RANGE.total_seconds()
+            ),
+            _now,
+        )
+
+        # A full page means there might be more (older) statements in the time range
+        pulled_account_statements: list[StatementItem] = []
+        _page_up_to_time: arrow.Arrow = _pull_statements_up_to_time
+        while True:
+            page: list[StatementItem] = await monobank_api.get_statements(
+                monobank_account.monobank_client.token,
+                monobank_account.id,
+                from_time=_pull_statements_from_time,
+                to_time=_page_up_to_time,
+            )
+            pulled_account_statements.extend(page)
+
+            if len(page) < MONOBANK_STATEMENTS_PAGE_SIZE:
+                break
+            _page_up_to_time = min(arrow.get(page[-1].time), _page_up_to_time.shift(seconds=-1))
+
+        account_statements = await save_account_statements(
+            monobank_account, pulled_account_statements
+        )
+        new_account_statements.extend(account_statements)
+
+        if new_account_statements_callback and account_statements:
+            await new_account_statements_callback(account_statements)
+
+        # Move the cursor to the newest statement of the time range. An empty time range is
+        #  skipped altogether, unless it's the last one: newer statements might still show up there.
+        if pulled_account_statements:
+            newest_statement: StatementItem = max(
+                pulled_account_statements, key=lambda statement_item: statement_item.time
+            )
+            monobank_account.last_statement_time = newest_statement.time
+            monobank_account.last_statement_id = newest_statement.id
+        elif _pull_statements_up_to_time < _now:
+            monobank_account.last_statement_time = _pull_statements_up_to_time.datetime
+            monobank_account.last_statement_id = None
+        await monobank_account.save(update_fields=["last_statement_time", "last_statement_id"])
+
+        _pull_statements_from_time = _pull_statements_up_to_time
+
+    return new_account_statements
 
 
 async def main():
     """Pull all account statements. Used for testing."""
     # Initial setup
-    from main import on_startup
+    from utils.bootstrap import on_startup
 
     await on_startup()
 
@@ -114,6 +514,8 @@ async def main():
     monobank_account = await MonobankAccount.all().order_by("date_added").first()
     await pull_all_account_statements(monobank_account.id, continue_terminated=False)
 
+    await monobank_api.close()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
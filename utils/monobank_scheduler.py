@@ -0,0 +1,148 @@
+"""
+The scheduler polling the statements of all the `MonobankAccount`s.
+
+Monobank API allows one request per 60 seconds per token, so the accounts are grouped by their
+`MonobankClient.token`, and each token is polled by its own loop, one account at a time. Within a
+token, the accounts having unpaid `Paycheck`s close to their `GroupPayment.due_date` are polled
+first and most often, while the idle accounts are polled rarely. The paychecks overdue for longer
+than `MONOBANK_OVERDUE_DAYS` days are likely abandoned, so they do not make an account poll often.
+"""
+import asyncio
+import datetime
+
+import arrow
+
+from models import MonobankAccount
+from settings import settings
+from utils import fast_queries
+from utils.loguru_logging import logger
+from utils.monobank import (
+    get_web_hook_url,
+    MONOBANK_API_REQUEST_INTERVAL,
+    NewAccountStatementsCallback,
+    pull_new_account_statements,
+)
+
+
+class MonobankPollingScheduler:
+    """The scheduler polling the statements of all the `MonobankAccount`s."""
+
+    def __init__(self, new_account_statements_callback: NewAccountStatementsCallback):
+        """Initialize the scheduler."""
+        self.new_account_statements_callback = new_account_statements_callback
+
+        self.account_ids_by_token: dict[str, list[str]] = {}
+        # The accounts whose statements are pushed to the webhook, once it has been set for them
+        self.pushed_account_ids: set[str] = set()
+        # When each account was polled last (as `loop.time()`)
+        self.last_polled_at: dict[str, float] = {}
+
+        self._token_tasks: dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    async def _get_nearest_due_dates(account_ids: list[str]) -> dict[str, datetime.datetime]:
+        """Get the nearest due date of the unpaid paychecks of each account, in one query."""
+        # NB: On the fast path, since it's run before polling every account
+        return await fast_queries.get_nearest_due_dates(
+            account_ids,
+            not_before=arrow.utcnow().shift(days=-settings.MONOBANK_OVERDUE_DAYS).datetime,
+        )
+
+    @staticmethod
+    def _get_polling_interval(nearest_due_date: datetime.datetime | None, is_pushed: bool) -> float:
+        """
+        Get how often to poll an account.
+
+        It depends on the nearest due date of its unpaid paychecks, and on whether its statements
+        are pushed to the webhook.
+        """
+        now = arrow.utcnow()
+        if nearest_due_date is None:
+            polling_interval = settings.MONOBANK_IDLE_ACCOUNT_POLLING_INTERVAL
+        elif (
+            now.shift(days=-settings.MONOBANK_OVERDUE_DAYS)
+            <= arrow.get(nearest_due_date)
+            <= now.shift(days=settings.MONOBANK_DUE_SOON_DAYS)
+        ):
+            polling_interval = settings.MONOBANK_DUE_SOON_ACCOUNT_POLLING_INTERVAL
+        else:
+            polling_interval = settings.MONOBANK_PENDING_ACCOUNT_POLLING_INTERVAL
+
+        if is_pushed:
+            # The new statements are pushed by Monobank, so only fill in the gaps
+            polling_interval = max(polling_interval, settings.MONOBANK_GAP_FILLING_INTERVAL)
+
+        return polling_interval
+
+    async def _poll_token(self, token: str) -> None:
+        """Keep polling the accounts of the token, the most urgent due one first."""
+        loop = asyncio.get_running_loop()
+
+        while account_ids := self.account_ids_by_token.get(token):
+            nearest_due_dates = await self._get_nearest_due_dates(account_ids)
+
+            # The priorities are re-evaluated every time, so that an idle account becomes due
+            #  as soon as a group payment is created for it
+            due_account_ids: list[str] = [
+                account_id
+                for account_id in account_ids
+                if loop.time()
+                >= self.last_polled_at.get(account_id, float("-inf"))
+                + self._get_polling_interval(
+                    nearest_due_dates.get(account_id), account_id in self.pushed_account_ids
+                )
+            ]
+            if not due_account_ids:
+                await asyncio.sleep(MONOBANK_API_REQUEST_INTERVAL)
+                continue
+
+            # The accounts with the nearest due dates go first, the ones without unpaid paychecks
+            #  go last
+            account_id: str = min(
+                due_account_ids,
+                key=lambda _account_id: (
+                    (_due_date := nearest_due_dates.get(_account_id)) is None,
+                    _due_date.timestamp() if _due_date else 0.0,
+                ),
+            )
+
+            try:
+                # NB: The token's rate limit is respected by `pull_new_account_statements` itself
+                await pull_new_account_statements(
+                    account_id, new_account_statements_callback=self.new_account_statements_callback
+                )
+            except Exception as e:
+                logger.error(f"Failed to poll the account `{account_id}`: {e} ({e.__class__})")
+
+            self.last_polled_at[account_id] = loop.time()
+
+    async def _refresh_accounts(self) -> None:
+        """Load the accounts grouped by their token, and start polling the new tokens."""
+        web_hook_url: str | None = get_web_hook_url()
+
+        account_ids_by_token: dict[str, list[str]] = {}
+        pushed_account_ids: set[str] = set()
+        for monobank_account in await MonobankAccount.all().select_related("monobank_client"):
+            account_ids_by_token.setdefault(monobank_account.monobank_client.token, []).append(
+                monobank_account.id
+            )
+            # The web hook is saved once it has been set successfully (see `set_monobank_web_hooks`)
+            if web_hook_url and monobank_account.monobank_client.web_hook_url == web_hook_url:
+                pushed_account_ids.add(monobank_account.id)
+        self.account_ids_by_token = account_ids_by_token
+        self.pushed_account_ids = pushed_account_ids
+
+        for token in account_ids_by_token:
+            if (task := self._token_tasks.get(token)) is None or task.done():
+                self._token_tasks[token] = asyncio.create_task(self._poll_token(token))
+
+        logger.debug(
+            f"Polling {sum(map(len, account_ids_by_token.values()))} Monobank accounts "
+            f"with {len(account_ids_by_token)} tokens"
+        )
+
+    async def run(self) -> None:
+        """Run the scheduler. Never returns."""
+        while True:
+            await self._refresh_accounts()
+            await asyncio.sleep(settings.MONOBANK_ACCOUNTS_REFRESH_INTERVAL)
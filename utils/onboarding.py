@@ -0,0 +1,116 @@
+"""
+The onboarding of the new `User`s, along with their `Profile`s and `Settings`.
+
+A new user pays to the default account, i.e. the Monobank account added first, unless they pick
+another one. The user, its profile and its settings are created in a single transaction, so there
+is never a user without them, with a bulk insert per table. Onboarding a whole coliving at once
+takes the same three inserts as onboarding a single user.
+
+The default account is looked up once per `ONBOARDING_DEFAULT_ACCOUNT_TTL` seconds, rather than for
+every new user, and again right after an account is added or deleted by this process.
+"""
+import time
+import typing
+
+import tortoise.signals
+from tortoise.transactions import in_transaction
+
+from models import MonobankAccount, Profile, Settings, User
+from settings import settings
+from utils.tortoise_orm import bulk_insert_ignore_conflicts
+
+
+class DefaultAccount:
+    """The ID of the default Monobank account the new users pay to, cached with a TTL."""
+
+    def __init__(self, ttl: float = 60 * 10):
+        """Initialize the cache. The account is looked up on the first onboarding."""
+        self.ttl = ttl
+
+        self._account_id: str | None = None
+        # The time the account expires at, `0` if it's to be looked up again on the next onboarding
+        self._expires_at: float = 0
+
+        self.loads: int = 0
+
+    async def get_id(self) -> str | None:
+        """Get the ID of the default account, `None` if there are no accounts yet."""
+        if self._expires_at < time.monotonic():
+            expires_at: float = time.monotonic() + self.ttl
+            account_ids: list[str] = (
+                await MonobankAccount.all()
+                .order_by("date_added")
+                .limit(1)
+                .values_list("id", flat=True)
+            )
+
+            self._account_id = account_ids[0] if account_ids else None
+            self._expires_at = expires_at
+            self.loads += 1
+
+        return self._account_id
+
+    def invalidate(self) -> None:
+        """Look the default account up again on the next onboarding."""
+        self._expires_at = 0
+
+
+default_account = DefaultAccount(ttl=settings.ONBOARDING_DEFAULT_ACCOUNT_TTL)
+
+
+@tortoise.signals.post_save(MonobankAccount)
+async def invalidate_default_account_on_save(
+    sender: typing.Type[MonobankAccount], instance: MonobankAccount, created: bool, *_, **__
+):
+    """Look the default account up again once an account is added, e.g. the very first one."""
+    if created:
+        default_account.invalidate()
+
+
+@tortoise.signals.post_delete(MonobankAccount)
+async def invalidate_default_account_on_delete(
+    sender: typing.Type[MonobankAccount], instance: MonobankAccount, *_, **__
+):
+    """Look the default account up again once an account is deleted, e.g. the default one."""
+    default_account.invalidate()
+
+
+async def onboard_users(users: typing.Sequence[User]) -> list[User]:
+    """
+    Create the users along with their profiles and settings, in a single transaction.
+
+    The users existing already (e.g. created by a concurrent update) are skipped, and their profiles
+    and settings are left as they are. Return the users created.
+    """
+    if not users:
+        return []
+
+    account_id: str | None = await default_account.get_id()
+    async with in_transaction("default") as connection:
+        created_users: list[User] = await bulk_insert_ignore_conflicts(
+            User, users, using_db=connection
+        )
+        if created_users:
+            await Profile.bulk_create(
+                [Profile(user=user) for user in created_users], using_db=connection
+            )
+            await Settings.bulk_create(
+                [
+                    Settings(user=user, monobank_account_to_pay_to_id=account_id)
+                    for user in created_users
+                ],
+                using_db=connection,
+            )
+
+    return created_users
+
+
+async def onboard_user(user: User) -> tuple[User, bool]:
+    """Create the user along with its profile and settings, unless it exists already."""
+    if await onboard_users([user]):
+        return user, True
+
+    return await User.get(id=user.id), False
+
+
+__all__ = ["DefaultAccount", "default_account", "onboard_user", "onboard_users"]
@@ -0,0 +1,151 @@
+"""
+The dispatcher processing the updates of each user one at a time, in the order they came in.
+
+The FSM handlers read the user's state and data, await something, then write them back, so two
+updates of the same user processed at once (e.g. a double tap) would overwrite each other's data.
+Each user gets a queue of their own instead: the user's updates wait for the previous ones to be
+processed, while the updates of different users are still processed concurrently. A user with too
+many updates waiting already gets the new ones dropped.
+
+The queues are kept in the process's memory, so with several webhook processes, the user's updates
+are also locked in Redis while processed (see `CachingRedisStorage.locking_user`). They are never
+processed at once then, but only the ones pushed to the same process are kept in order: Telegram
+pushes the updates concurrently, and the processes are not queued for the lock.
+
+The FSM state and data of the update being processed are cached by the storage, if it can cache
+them (see `CachingRedisStorage`), and written back before the user's next update is processed.
+"""
+import asyncio
+import contextlib
+import dataclasses
+import typing
+
+import aiogram
+from aiogram import types
+
+from utils.loguru_logging import logger
+from utils.redis_storage import CachingRedisStorage
+
+
+@dataclasses.dataclass
+class UpdateQueuesStats:
+    """The statistics of the users' update queues of the `UserOrderedDispatcher`."""
+
+    # The number of the users having updates being processed or waiting right now
+    users: int = 0
+    # The number of the updates being processed or waiting right now
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    # The most updates of a single user being processed or waiting at once
+    max_user_queue_depth: int = 0
+
+    processed_updates: int = 0
+    dropped_updates: int = 0
+
+
+class UserOrderedDispatcher(aiogram.Dispatcher):
+    """The `Dispatcher` processing the updates of each user in order, one at a time."""
+
+    def __init__(
+        self,
+        *args,
+        max_user_queue_size: int = 10,
+        lock_users_across_processes: bool = False,
+        **kwargs,
+    ):
+        """Initialize the dispatcher."""
+        super().__init__(*args, **kwargs)
+
+        self.max_user_queue_size = max_user_queue_size
+        self.lock_users_across_processes = lock_users_across_processes
+
+        # The user's ID -> the lock held by the update being processed, queueing up the rest
+        self._user_locks: dict[int, asyncio.Lock] = {}
+        # The user's ID -> the number of the user's updates being processed or waiting
+        self._user_queue_depths: dict[int, int] = {}
+
+        self.queues_stats = UpdateQueuesStats()
+
+    def _caching_fsm_storage(self) -> typing.AsyncContextManager:
+        """Cache the FSM state and data while processing an update, if the storage can."""
+        if isinstance(self.storage, CachingRedisStorage):
+            return self.storage.caching_update()
+
+        return contextlib.nullcontext()
+
+    def _locking_user_across_processes(self, user_id: int) -> typing.AsyncContextManager:
+        """Keep the user's updates in the other processes waiting, if there are other processes."""
+        if self.lock_users_across_processes and isinstance(self.storage, CachingRedisStorage):
+            return self.storage.locking_user(user_id)
+
+        return contextlib.nullcontext()
+
+    @staticmethod
+    def _get_update_user_id(update: types.Update) -> int | None:
+        """Get the ID of the user the update comes from, if any."""
+        for event in (
+            update.message,
+            update.edited_message,
+            update.callback_query,
+            update.inline_query,
+            update.chosen_inline_result,
+            update.shipping_query,
+            update.pre_checkout_query,
+            update.my_chat_member,
+            update.chat_member,
+            update.chat_join_request,
+        ):
+            if event is not None and event.from_user is not None:
+                return event.from_user.id
+
+        if update.poll_answer is not None:
+            return update.poll_answer.user.id
+
+        return None
+
+    async def process_update(self, update: types.Update):
+        """Process the update after the previous updates of the same user."""
+        if (user_id := self._get_update_user_id(update)) is None:
+            return await super().process_update(update)
+
+        user_queue_depth: int = self._user_queue_depths.get(user_id, 0)
+        if user_queue_depth >= self.max_user_queue_size:
+            self.queues_stats.dropped_updates += 1
+            logger.warning(
+                f"Dropped update [ID:{update.update_id}] of user [ID:{user_id}]: "
+                f"{user_queue_depth} of their updates are queued already"
+            )
+            return None
+
+        self._user_queue_depths[user_id] = user_queue_depth + 1
+        # NB: `asyncio.Lock` is acquired in the FIFO order, which keeps the updates in order
+        user_lock: asyncio.Lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+
+        self.queues_stats.users = len(self._user_queue_depths)
+        self.queues_stats.queue_depth += 1
+        self.queues_stats.max_queue_depth = max(
+            self.queues_stats.max_queue_depth, self.queues_stats.queue_depth
+        )
+        self.queues_stats.max_user_queue_depth = max(
+            self.queues_stats.max_user_queue_depth, user_queue_depth + 1
+        )
+
+        try:
+            # NB: The cached FSM state and data are written back before the next update reads them
+            async with (
+                user_lock,
+                self._locking_user_across_processes(user_id),
+                self._caching_fsm_storage(),
+            ):
+                return await super().process_update(update)
+        finally:
+            self.queues_stats.queue_depth -= 1
+            self.queues_stats.processed_updates += 1
+
+            # Forget the users with no updates left, so that the locks do not pile up
+            if self._user_queue_depths[user_id] == 1:
+                del self._user_queue_depths[user_id]
+                del self._user_locks[user_id]
+            else:
+                self._user_queue_depths[user_id] -= 1
+            self.queues_stats.users = len(self._user_queue_depths)
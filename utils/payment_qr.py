@@ -0,0 +1,147 @@
+"""
+The QR codes of the payment links, for the users paying from another device.
+
+The QR code of a payment link is rendered into a PNG file only once: the file is named by the
+SHA-256 of the link, so the same link always maps to the same file in `PAYMENT_QR_CACHE_DIR`.
+Rendering is CPU-bound, so it is done in a pool of processes, not to block the event loop. Once a
+QR code has been uploaded to Telegram, its `file_id` is kept in Redis and sent instead of the file.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import multiprocessing
+import pathlib
+import typing
+
+import aiogram
+import redis.asyncio
+
+from settings import settings
+from utils.loguru_logging import logger
+
+
+def render_qr_code(data: str, path: pathlib.Path) -> None:
+    """Render the QR code of the data into a PNG file. Run in the rendering processes."""
+    # NB: Imported here, since only the rendering processes need it
+    import qrcode
+    import qrcode.constants
+
+    # The error correction level recommended by the NBU for the payment QR codes
+    qr_code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=8, border=4)
+    qr_code.add_data(data)
+    qr_code.make(fit=True)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file first, so that a half-written image is never sent
+    temporary_path: pathlib.Path = path.with_suffix(f".{multiprocessing.current_process().pid}.tmp")
+    with temporary_path.open("wb") as image_file:
+        qr_code.make_image().save(image_file)
+    temporary_path.replace(path)
+
+
+class PaymentQRCodes:
+    """The QR codes of the payment links, cached on the disk and in Telegram."""
+
+    def __init__(
+        self,
+        redis_client: redis.asyncio.Redis,
+        cache_dir: pathlib.Path,
+        render_processes: int = 2,
+        file_id_ttl: int = 60 * 60 * 24 * 90,
+        key_prefix: str = "payment_qr:file_id",
+    ):
+        """Initialize the QR codes. The rendering processes are started on the first render."""
+        self.redis = redis_client
+        self.cache_dir = cache_dir
+        self.render_processes = render_processes
+        self.file_id_ttl = file_id_ttl
+        self.key_prefix = key_prefix
+
+        self._executor: concurrent.futures.ProcessPoolExecutor | None = None
+        # The key -> the render in progress, so that the same QR code is not rendered twice at once
+        self._renders: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def get_key(data: str) -> str:
+        """Get the key the QR code of the data is cached by."""
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get_path(self, data: str) -> pathlib.Path:
+        """Get the path of the PNG file of the data's QR code, whether it is rendered or not."""
+        key: str = self.get_key(data)
+        # Spread the files over subdirectories, not to have too many files in a single one
+        return self.cache_dir / key[:2] / f"{key}.png"
+
+    def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        """Get the pool of the rendering processes, starting it if needed."""
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.render_processes,
+                # NB: Forking a process with a running event loop and open connections is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+        return self._executor
+
+    async def render(self, data: str) -> pathlib.Path:
+        """Render the QR code of the data, unless it is rendered already. Return the file's path."""
+        if (path := self.get_path(data)).exists():
+            return path
+
+        key: str = self.get_key(data)
+        if (render := self._renders.get(key)) is None:
+            render = self._renders[key] = asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), render_qr_code, data, path
+            )
+            render.add_done_callback(lambda _: self._renders.pop(key, None))
+
+        # Do not cancel the render the other callers might be waiting for
+        await asyncio.shield(render)
+        return path
+
+    async def render_many(self, data_items: typing.Iterable[str]) -> list[pathlib.Path]:
+        """Render the QR codes of all the data items concurrently, in the rendering processes."""
+        return await asyncio.gather(*(self.render(data) for data in data_items))
+
+    def _get_file_id_key(self, data: str) -> str:
+        """Get the Redis key of the Telegram `file_id` of the data's QR code."""
+        return f"{self.key_prefix}:{self.get_key(data)}"
+
+    async def get_photo(self, data: str) -> str | aiogram.types.InputFile:
+        """Get the QR code to send: its Telegram `file_id` if uploaded already, else the file."""
+        try:
+            if file_id := await self.redis.get(self._get_file_id_key(data)):
+                return file_id
+        except redis.RedisError as e:
+            logger.warning(f"Failed to get the QR code's file ID: {e} ({e.__class__})")
+
+        return aiogram.types.InputFile(await self.render(data))
+
+    async def set_file_id(self, data: str, file_id: str) -> None:
+        """Remember the Telegram `file_id` of the uploaded QR code of the data."""
+        try:
+            await self.redis.set(self._get_file_id_key(data), file_id, ex=self.file_id_ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to save the QR code's file ID: {e} ({e.__class__})")
+
+    async def forget_file_id(self, data: str) -> None:
+        """Forget the Telegram `file_id` of the data's QR code, e.g. once Telegram rejects it."""
+        try:
+            await self.redis.delete(self._get_file_id_key(data))
+        except redis.RedisError as e:
+            logger.warning(f"Failed to delete the QR code's file ID: {e} ({e.__class__})")
+
+    def close(self) -> None:
+        """Stop the rendering processes."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+payment_qr_codes = PaymentQRCodes(
+    redis.asyncio.Redis.from_url(settings.REDIS_URL, decode_responses=True),
+    cache_dir=settings.PAYMENT_QR_CACHE_DIR,
+    render_processes=settings.PAYMENT_QR_RENDER_PROCESSES,
+    file_id_ttl=settings.PAYMENT_QR_FILE_ID_TTL,
+)
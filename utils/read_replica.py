@@ -0,0 +1,131 @@
+"""
+The read replica for the read-heavy reporting queries, e.g. `/groups_stats`.
+
+The replica is the `replica` connection of `tortoise-orm`, configured with `DATABASE_REPLICA_URL`
+(in tests, any second database would do). Only the ORM reads made within `read_replica.reading()`
+go to it, while the writes, the reads after the writes and everything else stay on the primary.
+
+A replica lags behind the primary, so the paychecks created or paid a moment ago might be missing
+on it. The time the paychecks are written is published to Redis, and the reports are read from the
+replica only once it has replayed everything up to that time, and it's not lagging behind by more
+than `DATABASE_REPLICA_MAX_LAG` seconds. Otherwise, they are read from the primary.
+"""
+import contextlib
+import time
+import typing
+
+import redis.asyncio
+import tortoise
+
+from settings import settings
+from utils.loguru_logging import logger
+from utils.tortoise_orm import reading_from_replica, REPLICA_CONNECTION
+
+# How far behind the primary the replica is (in seconds). Not lagging at all on a primary, i.e. a
+#  database not replaying anything, or once it has replayed everything it has received. `NULL` if
+#  it's not receiving anything from the primary (e.g. disconnected), since having replayed all it
+#  has received tells nothing then
+_REPLICA_LAG_SQL: str = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN NOT EXISTS (SELECT FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    'ELSE extract(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END AS "lag"'
+)
+
+
+class ReadReplica:
+    """The read replica, used for the reports only while it has all the paychecks written."""
+
+    def __init__(
+        self,
+        redis_client: redis.asyncio.Redis,
+        enabled: bool,
+        max_lag: float = 30,
+        lag_check_interval: float = 5,
+        key: str = "read_replica:paychecks_written_at",
+    ):
+        """Initialize the replica. Its lag is checked on the first read."""
+        self.redis = redis_client
+        self.enabled = enabled
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.key = key
+
+        # The (wall clock) time the replica has replayed everything up to, `None` if unavailable
+        self._replayed_until: float | None = None
+        self._lag_checked_at: float = float("-inf")
+
+        self.replica_reads: int = 0
+        self.primary_reads: int = 0
+
+    async def mark_paychecks_written(self) -> None:
+        """Remember the paychecks have just been written, for the reports not to miss them."""
+        if not self.enabled:
+            return
+
+        try:
+            await self.redis.set(self.key, time.time())
+        except redis.RedisError as e:
+            logger.error(f"Failed to mark the paychecks written: {e!r}")
+
+    async def _get_replayed_until(self) -> float | None:
+        """Get the time the replica has replayed everything up to, checking it once in a while."""
+        if time.monotonic() - self._lag_checked_at < self.lag_check_interval:
+            return self._replayed_until
+
+        try:
+            rows: list[dict] = await tortoise.connections.get(
+                REPLICA_CONNECTION
+            ).execute_query_dict(_REPLICA_LAG_SQL)
+            lag: float | None = None if rows[0]["lag"] is None else float(rows[0]["lag"])
+
+            if lag is None:
+                logger.warning(
+                    "The read replica's lag is unknown, e.g. not streaming from the primary"
+                )
+                self._replayed_until = None
+            elif lag > self.max_lag:
+                logger.warning(f"The read replica is lagging behind by {lag:.1f}s")
+                self._replayed_until = None
+            else:
+                self._replayed_until = time.time() - lag
+        except Exception as e:
+            logger.warning(f"Failed to check the read replica's lag: {e!r}")
+            self._replayed_until = None
+
+        self._lag_checked_at = time.monotonic()
+        return self._replayed_until
+
+    async def is_fresh(self) -> bool:
+        """Check whether the replica has all the paychecks written, and is not lagging too much."""
+        if not self.enabled or (replayed_until := await self._get_replayed_until()) is None:
+            return False
+
+        try:
+            paychecks_written_at: str | None = await self.redis.get(self.key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to get the time the paychecks were written: {e!r}")
+            return False
+
+        return paychecks_written_at is None or float(paychecks_written_at) <= replayed_until
+
+    @contextlib.asynccontextmanager
+    async def reading(self) -> typing.AsyncIterator[bool]:
+        """Read from the replica within the context, if it's fresh. Yield whether it is."""
+        if is_fresh := await self.is_fresh():
+            self.replica_reads += 1
+        else:
+            self.primary_reads += 1
+
+        with reading_from_replica(enabled=is_fresh):
+            yield is_fresh
+
+
+read_replica = ReadReplica(
+    redis.asyncio.Redis.from_url(settings.REDIS_URL, decode_responses=True),
+    enabled=settings.DATABASE_REPLICA_URL is not None,
+    max_lag=settings.DATABASE_REPLICA_MAX_LAG,
+    lag_check_interval=settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL,
+)
+
+__all__ = ["ReadReplica", "read_replica"]
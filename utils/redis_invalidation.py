@@ -0,0 +1,75 @@
+"""
+The invalidation of the in-process caches across the processes (the bot and the worker) via Redis.
+
+A process changing the cached data publishes the invalidation to the Redis channel of the cache, and
+the other processes, listening to the channel, drop their stale copies. The messages are
+`<the process' ID>:<the key>`, so that a process skips its own invalidations.
+"""
+import abc
+import asyncio
+import uuid
+
+import redis.asyncio
+
+from utils.loguru_logging import logger
+
+
+class RedisInvalidatedCache(abc.ABC):
+    """The in-process cache invalidated by the other processes via the Redis channel."""
+
+    def __init__(self, redis_client: redis.asyncio.Redis, channel: str):
+        """Initialize the cache invalidated via the channel."""
+        self.redis = redis_client
+        self.channel = channel
+
+        # Tells the process' own invalidations apart from the ones of the other processes
+        self._process_id: str = uuid.uuid4().hex
+        self._listener_task: asyncio.Task | None = None
+
+    @abc.abstractmethod
+    def _invalidate_key(self, key: str) -> None:
+        """Drop the key, invalidated by another process, from the cache."""
+
+    @abc.abstractmethod
+    def _invalidate_all(self) -> None:
+        """Drop everything from the cache, once the invalidations may have been missed."""
+
+    async def _publish_invalidation(self, key: str, description: str) -> None:
+        """Make the other processes drop the key from their caches."""
+        try:
+            await self.redis.publish(self.channel, f"{self._process_id}:{key}")
+        except redis.RedisError as e:
+            logger.error(f"Failed to publish the invalidation of {description}: {e!r}")
+
+    async def _listen_for_invalidations(self) -> None:
+        """Keep dropping the keys invalidated by the other processes from the cache."""
+        while True:
+            try:
+                async with self.redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+
+                    # The invalidations published while not subscribed are lost
+                    self._invalidate_all()
+
+                    async for message in pubsub.listen():
+                        process_id, _, key = message["data"].partition(":")
+                        if process_id != self._process_id:
+                            self._invalidate_key(key)
+            except redis.RedisError as e:
+                logger.error(f"Lost the subscription to `{self.channel}`: {e!r}")
+                await asyncio.sleep(1)
+
+    def start(self) -> None:
+        """Start listening for the invalidations published by the other processes."""
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen_for_invalidations())
+
+    async def stop(self) -> None:
+        """Stop listening for the invalidations."""
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            await asyncio.gather(self._listener_task, return_exceptions=True)
+            self._listener_task = None
+
+
+__all__ = ["RedisInvalidatedCache"]
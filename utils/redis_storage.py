@@ -2,13 +2,34 @@
 The module that provides the `RedisStorage2` storage for the bot.
 
 It uses the `REDIS_URL` environment variable to connect to the Redis server.
+
+The handlers read and write the FSM state and data several times per update, each time a Redis
+round trip. While an update is processed (see `UserOrderedDispatcher`), the state and the data of
+a user are loaded at once on the first access instead, served from memory afterwards, and the
+changed ones are written back at once after the handlers, in a single pipeline. The updates of
+a user are processed one at a time, and the changes are written back before the next one, so
+none of them reads the stale state or overwrites the changes of another. With several bot
+processes, that takes a lock per user shared by all of them (see `locking_user`), since the locks
+of the dispatcher only keep apart the updates of the same process.
+
+The abandoned conversations expire `FSM_STATE_TTL` and `FSM_DATA_TTL` seconds after their last
+change, so that they do not pile up in Redis.
 """
+import asyncio
+import contextlib
+import contextvars
+import copy
+import dataclasses
+import json
 import typing
 
 import dj_redis_url
-from aiogram.contrib.fsm_storage.redis import RedisStorage2
+import redis.asyncio
+import redis.exceptions
+from aiogram.contrib.fsm_storage.redis import RedisStorage2, STATE_DATA_KEY, STATE_KEY
 
 from settings import settings
+from utils.loguru_logging import logger
 
 redis_config: dict = dj_redis_url.config(default=settings.REDIS_URL)
 
@@ -24,5 +45,217 @@ def parse_config(config_to_parse: dict[str, typing.Any]) -> dict[str, typing.Any
     return dict((k.lower(), v) for k, v in config_to_parse.items())
 
 
+@dataclasses.dataclass
+class _UpdateCache:
+    """The FSM states and data loaded and changed while processing an update."""
+
+    # The (chat, user) -> the state, and the data
+    states: dict[tuple[str, str], str | None] = dataclasses.field(default_factory=dict)
+    data: dict[tuple[str, str], dict] = dataclasses.field(default_factory=dict)
+    changed: set[tuple[str, str]] = dataclasses.field(default_factory=set)
+
+    round_trips: int = 0
+
+
+# The cache of the update being processed, `None` outside the updates
+_update_cache: contextvars.ContextVar[_UpdateCache | None] = contextvars.ContextVar(
+    "fsm_update_cache", default=None
+)
+
+
+class CachingRedisStorage(RedisStorage2):
+    """The `RedisStorage2` loading the FSM state and data once per update, and writing them once."""
+
+    def __init__(self, *args, user_lock_timeout: float = 60, **kwargs):
+        """Initialize the storage."""
+        super().__init__(*args, **kwargs)
+
+        self.user_lock_timeout = user_lock_timeout
+
+        self.updates: int = 0
+        self.update_round_trips: int = 0
+        self.max_update_round_trips: int = 0
+
+    @contextlib.asynccontextmanager
+    async def caching_update(self) -> typing.AsyncIterator[None]:
+        """
+        Cache the FSM states and data read and written while processing an update.
+
+        The changed ones are written back in a single round trip at the end, even if the handlers
+        have failed, so that the writes made before the failure are kept, as without the cache.
+        """
+        cache = _UpdateCache()
+        token: contextvars.Token = _update_cache.set(cache)
+        try:
+            yield
+        finally:
+            # The tasks started by the handlers (if any) read and write Redis directly from now on
+            _update_cache.reset(token)
+            try:
+                await self._write_back(cache)
+            finally:
+                self.updates += 1
+                self.update_round_trips += cache.round_trips
+                self.max_update_round_trips = max(self.max_update_round_trips, cache.round_trips)
+
+    async def _keep_user_locked(self, lock: redis.asyncio.lock.Lock) -> None:
+        """Keep extending the user's lock while the update is processed, until cancelled."""
+        while True:
+            await asyncio.sleep(self.user_lock_timeout / 3)
+
+            try:
+                await lock.reacquire()
+            except redis.exceptions.LockError:
+                logger.error(f"The lock `{lock.name}` has expired while the update was processed")
+                return
+            except redis.RedisError as e:
+                logger.error(f"Failed to extend the lock `{lock.name}`: {e!r}")
+
+    @contextlib.asynccontextmanager
+    async def locking_user(self, user_id: int) -> typing.AsyncIterator[None]:
+        """
+        Keep the user's updates processed by the other processes waiting, while processing one.
+
+        The lock expires `user_lock_timeout` seconds after its process dies, and is extended while
+        the update is processed. NB: The processes waiting for the lock are not queued, so only
+        the updates processed by the same process are kept in order.
+        """
+        lock = self._redis.lock(
+            self.generate_key("user_lock", user_id), timeout=self.user_lock_timeout, sleep=0.01
+        )
+        await lock.acquire()
+        lock_keeper: asyncio.Task = asyncio.create_task(self._keep_user_locked(lock))
+        try:
+            yield
+        finally:
+            lock_keeper.cancel()
+            try:
+                await lock.release()
+            except redis.exceptions.LockError:
+                # It has expired, and may be held by another process already
+                pass
+
+    async def _write_back(self, cache: _UpdateCache) -> None:
+        """Write the changed FSM states and data back in a single pipeline."""
+        if not cache.changed:
+            return
+
+        pipeline = self._redis.pipeline(transaction=False)
+        for chat, user in cache.changed:
+            # NB: Both are written, so that the state and the data expire together
+            state_key: str = self.generate_key(chat, user, STATE_KEY)
+            if (state := cache.states[chat, user]) is None:
+                pipeline.delete(state_key)
+            else:
+                pipeline.set(state_key, state, ex=self._state_ttl)
+
+            data_key: str = self.generate_key(chat, user, STATE_DATA_KEY)
+            if data := cache.data[chat, user]:
+                pipeline.set(data_key, json.dumps(data), ex=self._data_ttl)
+            else:
+                pipeline.delete(data_key)
+
+        await pipeline.execute()
+        cache.round_trips += 1
+
+    async def _load(self, cache: _UpdateCache, chat: str, user: str) -> None:
+        """Load the user's state and data into the cache at once, unless they are loaded already."""
+        if (chat, user) in cache.states:
+            return
+
+        state, data = await self._redis.mget(
+            self.generate_key(chat, user, STATE_KEY), self.generate_key(chat, user, STATE_DATA_KEY)
+        )
+        cache.round_trips += 1
+
+        cache.states[chat, user] = state
+        cache.data[chat, user] = json.loads(data) if data else {}
+
+    async def get_state(
+        self,
+        *,
+        chat: str | int | None = None,
+        user: str | int | None = None,
+        default: str | None = None,
+    ) -> str | None:
+        """Get the user's state, from the cache while processing an update."""
+        if (cache := _update_cache.get()) is None:
+            return await super().get_state(chat=chat, user=user, default=default)
+
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        await self._load(cache, chat, user)
+        return cache.states[chat, user] or self.resolve_state(default)
+
+    async def get_data(
+        self,
+        *,
+        chat: str | int | None = None,
+        user: str | int | None = None,
+        default: dict | None = None,
+    ) -> dict:
+        """Get the user's data, from the cache while processing an update."""
+        if (cache := _update_cache.get()) is None:
+            return await super().get_data(chat=chat, user=user, default=default)
+
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        await self._load(cache, chat, user)
+        # A copy, so that the handlers changing it do not change the cache, as with Redis
+        return copy.deepcopy(cache.data[chat, user]) or default or {}
+
+    async def set_state(
+        self,
+        *,
+        chat: str | int | None = None,
+        user: str | int | None = None,
+        state: typing.AnyStr | None = None,
+    ):
+        """Set the user's state, written back after the update while processing one."""
+        if (cache := _update_cache.get()) is None:
+            return await super().set_state(chat=chat, user=user, state=state)
+
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        await self._load(cache, chat, user)
+        cache.states[chat, user] = None if state is None else self.resolve_state(state)
+        cache.changed.add((chat, user))
+
+    async def set_data(
+        self,
+        *,
+        chat: str | int | None = None,
+        user: str | int | None = None,
+        data: dict | None = None,
+    ):
+        """Set the user's data, written back after the update while processing one."""
+        if (cache := _update_cache.get()) is None:
+            return await super().set_data(chat=chat, user=user, data=data)
+
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        await self._load(cache, chat, user)
+        cache.data[chat, user] = copy.deepcopy(data) or {}
+        cache.changed.add((chat, user))
+
+    async def update_data(
+        self,
+        *,
+        chat: str | int | None = None,
+        user: str | int | None = None,
+        data: dict | None = None,
+        **kwargs,
+    ):
+        """Update the user's data, written back after the update while processing one."""
+        if (cache := _update_cache.get()) is None:
+            return await super().update_data(chat=chat, user=user, data=data, **kwargs)
+
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        await self._load(cache, chat, user)
+        cache.data[chat, user].update(copy.deepcopy(data or {}), **copy.deepcopy(kwargs))
+        cache.changed.add((chat, user))
+
+
 # According to the structure above, it's better to write this expression
-redis_storage = RedisStorage2(**parse_config(redis_config))
+redis_storage = CachingRedisStorage(
+    **parse_config(redis_config),
+    state_ttl=settings.FSM_STATE_TTL,
+    data_ttl=settings.FSM_DATA_TTL,
+    user_lock_timeout=settings.USER_UPDATE_LOCK_TIMEOUT,
+)
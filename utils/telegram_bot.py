@@ -0,0 +1,20 @@
+"""
+The client of the Telegram Bot API, shared by the bot and the worker.
+
+It is kept apart from `main`, so that the worker sends the messages without importing the bot's
+dispatcher with all its handlers, filters and middlewares.
+"""
+import aiogram
+from aiogram.bot.api import TelegramAPIServer
+
+from settings import settings
+from utils.telegram_rate_limiter import RateLimitedBot
+
+bot = RateLimitedBot(
+    settings.TELEGRAM_BOT_TOKEN,
+    server=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL)
+    if settings.TELEGRAM_API_URL
+    else aiogram.bot.api.TELEGRAM_PRODUCTION,
+)
+
+__all__ = ["bot"]
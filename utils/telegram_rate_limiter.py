@@ -0,0 +1,323 @@
+"""
+The module that keeps the outbound Telegram traffic within the Bot API limits.
+
+Telegram allows about 30 messages per second in total and about 1 message per second per chat.
+Instead of failing with `RetryAfter` once these limits are exceeded, the requests are queued using
+token buckets: one shared by all the chats, and one for every chat.
+
+The global budget is shared by all the processes sending the messages (the worker and every webhook
+process of the bot), so its bucket is kept in Redis. A `RetryAfter` error pauses both the chat's
+bucket and the global one, since the flood control may well be applied to the whole bot.
+"""
+import asyncio
+import dataclasses
+import time
+import typing
+
+import aiogram
+import aiogram.utils.exceptions
+import redis.asyncio
+
+from settings import settings
+from utils.loguru_logging import logger
+
+
+class TokenBucket:
+    """
+    The token bucket that hands out reservations in the FIFO order.
+
+    A reservation always succeeds, but it returns the number of seconds one has to wait before the
+    reserved token becomes available, so the callers queue up instead of failing.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """Initialize the bucket, full of tokens."""
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens: float = capacity
+        self._updated_at: float = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        """Add the tokens accumulated since the last update."""
+        if now > self._updated_at:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+    def reserve(self) -> float:
+        """Reserve a token and return the number of seconds to wait until it is available."""
+        now = time.monotonic()
+        self._refill(now)
+
+        self._tokens -= 1
+
+        # The bucket might be paused, i.e. updated "in the future"
+        paused_for: float = max(self._updated_at - now, 0.0)
+        return paused_for + (-self._tokens / self.rate if self._tokens < 0 else 0.0)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds` seconds (e.g. after a `RetryAfter` error)."""
+        now = time.monotonic()
+        self._refill(now)
+
+        # Let exactly one request through once the pause is over
+        self._tokens = min(self._tokens, 1.0)
+        self._updated_at = max(self._updated_at, now + seconds)
+
+    def is_idle(self) -> bool:
+        """Check whether the bucket is full, i.e. it can be dropped without losing any state."""
+        now = time.monotonic()
+        self._refill(now)
+
+        return now >= self._updated_at and self._tokens >= self.capacity
+
+
+# Reserve a token (or pause the bucket), with the same logic as `TokenBucket`, and return the number
+# of seconds to wait (as a string, since Lua numbers are truncated to integers by Redis).
+# KEYS: the bucket's HASH; ARGV: rate, capacity, the seconds to pause for (`0` to reserve a token)
+_RESERVE_SCRIPT = """
+local rate, capacity, pause = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+if now > updated_at then
+    tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+    updated_at = now
+end
+
+local wait = 0
+if pause > 0 then
+    tokens = math.min(tokens, 1)
+    updated_at = math.max(updated_at, now + pause)
+else
+    tokens = tokens - 1
+    wait = math.max(updated_at - now, 0)
+    if tokens < 0 then
+        wait = wait + -tokens / rate
+    end
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(updated_at))
+-- The full bucket is the same as no bucket at all, so it expires once it has refilled
+redis.call("EXPIRE", KEYS[1], math.ceil(updated_at - now + (capacity - tokens) / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket:
+    """
+    The `TokenBucket` kept in Redis, shared by all the processes.
+
+    Should Redis fail, the tokens are reserved from the `fallback` bucket instead, so that the
+    messages are still sent, within the budget of the process alone.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.asyncio.Redis,
+        key: str,
+        rate: float,
+        capacity: float,
+        fallback: TokenBucket,
+    ):
+        """Initialize the bucket."""
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.fallback = fallback
+
+        self._reserve = redis_client.register_script(_RESERVE_SCRIPT)
+
+    async def _call(self, pause: float) -> float:
+        """Reserve a token, or pause the bucket if `pause` is positive."""
+        return float(await self._reserve(keys=[self.key], args=[self.rate, self.capacity, pause]))
+
+    async def reserve(self) -> float:
+        """Reserve a token and return the number of seconds to wait until it is available."""
+        try:
+            return await self._call(pause=0)
+        except redis.RedisError as e:
+            logger.error(f"Failed to reserve a token from the shared bucket: {e!r}")
+            return self.fallback.reserve()
+
+    async def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds` seconds, in all the processes."""
+        self.fallback.pause(seconds)
+        try:
+            await self._call(pause=seconds)
+        except redis.RedisError as e:
+            logger.error(f"Failed to pause the shared bucket: {e!r}")
+
+
+@dataclasses.dataclass
+class RateLimiterStats:
+    """The statistics of the `TelegramRateLimiter`."""
+
+    # The number of requests waiting for a token right now
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+
+    requests: int = 0
+    delayed_requests: int = 0
+    retry_after_errors: int = 0
+
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    @property
+    def average_wait_seconds(self) -> float:
+        """Get the average time a request has waited for a token."""
+        return self.total_wait_seconds / self.requests if self.requests else 0.0
+
+
+class TelegramRateLimiter:
+    """The limiter for the global and the per-chat Telegram sending budgets."""
+
+    # Drop the idle per-chat buckets once there are more of them than this
+    _MAX_IDLE_CHAT_BUCKETS: int = 10_000
+
+    def __init__(
+        self,
+        global_rate: float,
+        per_chat_rate: float,
+        redis_client: redis.asyncio.Redis | None = None,
+        redis_key: str = "telegram_rate_limiter:global",
+    ):
+        """Initialize the limiter. The global budget is shared through Redis, if it is given."""
+        self.global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self.shared_global_bucket: RedisTokenBucket | None = (
+            RedisTokenBucket(
+                redis_client,
+                redis_key,
+                rate=global_rate,
+                capacity=global_rate,
+                fallback=self.global_bucket,
+            )
+            if redis_client is not None
+            else None
+        )
+        self.per_chat_rate = per_chat_rate
+        self.chat_buckets: dict[int | str, TokenBucket] = {}
+
+        self.stats = RateLimiterStats()
+
+    def _get_chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        """Get the bucket for the chat, creating it if necessary."""
+        if (bucket := self.chat_buckets.get(chat_id)) is None:
+            if len(self.chat_buckets) >= self._MAX_IDLE_CHAT_BUCKETS:
+                self.chat_buckets = {
+                    _chat_id: _bucket
+                    for _chat_id, _bucket in self.chat_buckets.items()
+                    if not _bucket.is_idle()
+                }
+
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate=self.per_chat_rate, capacity=1)
+
+        return bucket
+
+    async def _wait(self, seconds: float) -> None:
+        """Wait for a token, keeping track of the queue depth."""
+        self.stats.queue_depth += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.stats.queue_depth)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.stats.queue_depth -= 1
+
+    async def acquire(self, chat_id: int | str | None) -> float:
+        """
+        Wait until a message can be sent to the chat.
+
+        The per-chat budget is waited for first, so that a busy chat does not hold the global
+        tokens while it waits for its own. Return the number of seconds waited.
+        """
+        started_at = time.monotonic()
+
+        if chat_id is not None and (delay := self._get_chat_bucket(chat_id).reserve()):
+            await self._wait(delay)
+
+        if self.shared_global_bucket is not None:
+            delay = await self.shared_global_bucket.reserve()
+        else:
+            delay = self.global_bucket.reserve()
+        if delay:
+            await self._wait(delay)
+
+        waited: float = time.monotonic() - started_at
+
+        self.stats.requests += 1
+        self.stats.total_wait_seconds += waited
+        self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, waited)
+        if waited > 0.001:
+            self.stats.delayed_requests += 1
+
+        return waited
+
+    async def retry_after(self, chat_id: int | str | None, seconds: float) -> None:
+        """Respect the `RetryAfter` error received for the chat, in the chat and globally."""
+        self.stats.retry_after_errors += 1
+
+        if chat_id is not None:
+            self._get_chat_bucket(chat_id).pause(seconds)
+
+        if self.shared_global_bucket is not None:
+            await self.shared_global_bucket.pause(seconds)
+        else:
+            self.global_bucket.pause(seconds)
+
+
+class RateLimitedBot(aiogram.Bot):
+    """
+    The `aiogram.Bot` with all the outbound messages going through the `TelegramRateLimiter`.
+
+    The `RetryAfter` errors are handled transparently: the request is repeated once the flood
+    control period is over, up to `TELEGRAM_RETRY_AFTER_MAX_RETRIES` times.
+    """
+
+    # Only these methods count towards the sending limits. `sendChatAction` is not included, since
+    # it is used to show the "typing..." status and should never be delayed.
+    _RATE_LIMITED_METHOD_PREFIXES: tuple[str, ...] = ("send", "forward", "copy", "edit")
+    _NOT_RATE_LIMITED_METHODS: frozenset[str] = frozenset({"sendChatAction"})
+
+    def __init__(self, *args, rate_limiter: TelegramRateLimiter | None = None, **kwargs):
+        """Initialize the bot with the rate limiter."""
+        super().__init__(*args, **kwargs)
+
+        self.rate_limiter: TelegramRateLimiter = rate_limiter or TelegramRateLimiter(
+            global_rate=settings.TELEGRAM_GLOBAL_RATE_LIMIT,
+            per_chat_rate=settings.TELEGRAM_PER_CHAT_RATE_LIMIT,
+            redis_client=redis.asyncio.Redis.from_url(settings.REDIS_URL, decode_responses=True),
+        )
+
+    def _is_rate_limited(self, method: str) -> bool:
+        """Check whether the API method counts towards the sending limits."""
+        return (
+            method.startswith(self._RATE_LIMITED_METHOD_PREFIXES)
+            and method not in self._NOT_RATE_LIMITED_METHODS
+        )
+
+    async def request(
+        self, method: str, data: dict | None = None, files: dict | None = None, **kwargs
+    ) -> typing.Any:
+        """Make a request to the Telegram Bot API, waiting for the rate limiter if necessary."""
+        if not self._is_rate_limited(method):
+            return await super().request(method, data, files, **kwargs)
+
+        chat_id: int | str | None = (data or {}).get("chat_id")
+
+        retries_left: int = settings.TELEGRAM_RETRY_AFTER_MAX_RETRIES
+        while True:
+            await self.rate_limiter.acquire(chat_id)
+
+            try:
+                return await super().request(method, data, files, **kwargs)
+            except aiogram.utils.exceptions.RetryAfter as e:
+                if retries_left <= 0:
+                    raise
+
+                logger.warning(f"Flood control exceeded for {chat_id=}, retrying in {e.timeout}s")
+                await self.rate_limiter.retry_after(chat_id, e.timeout)
+                retries_left -= 1
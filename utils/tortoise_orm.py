@@ -1,5 +1,8 @@
 """The `tortoise-orm` configuration module."""
 
+import contextlib
+import contextvars
+import operator
 import ssl
 import typing
 
@@ -37,17 +40,104 @@ class Model(tortoise.Model, metaclass=ModelMeta):
     pass
 
 
-def get_tortoise_config():
-    """Get the configuration for the `tortoise-orm`."""
+# The kinds of the processes, each with a database connection pool of its own
+ProcessRole = typing.Literal["bot", "worker", "webhooks"]
+
+
+def get_database_max_connections(role: ProcessRole) -> int:
+    """Get the size of the database connection pool of a process of the role."""
+    return {
+        "bot": settings.BOT_DATABASE_MAX_CONNECTIONS,
+        "worker": settings.WORKER_DATABASE_MAX_CONNECTIONS,
+        "webhooks": settings.WEBHOOKS_DATABASE_MAX_CONNECTIONS,
+    }[role]
+
+
+# The connection the reads made within `reading_from_replica()` go to, if configured
+REPLICA_CONNECTION: str = "replica"
+
+# Whether the reads made in the current context go to the replica
+_reading_from_replica: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "reading_from_replica", default=False
+)
+
+
+class ReplicaRouter:
+    """Route the reads within `reading_from_replica()` to the replica, the rest to the primary."""
+
+    def db_for_read(self, model: typing.Type[tortoise.Model]) -> str | None:
+        """Get the connection to read the model from, `None` for the primary."""
+        return REPLICA_CONNECTION if _reading_from_replica.get() else None
+
+
+@contextlib.contextmanager
+def reading_from_replica(enabled: bool = True) -> typing.Iterator[None]:
+    """
+    Make the ORM reads within the context go to the replica, unless disabled.
+
+    The writes, including `select_for_update`, always go to the primary. Must not be used within
+    a transaction, since the reads would not see its writes.
+    """
+    token: contextvars.Token = _reading_from_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _reading_from_replica.reset(token)
+
+
+def _get_connection_config(
+    url: str, role: ProcessRole | None = None, pool_max_size: int | None = None
+) -> dict:
+    """Get the configuration of a connection to the database of the URL."""
     ctx = ssl.create_default_context(cafile="")
     ctx.check_hostname = False
     ctx.verify_mode = ssl.CERT_NONE
 
-    db = tortoise.expand_db_url(settings.DATABASE_URL)
-    db["credentials"]["ssl"] = ctx
+    db = tortoise.expand_db_url(url)
+    credentials: dict = db["credentials"]
+    credentials["ssl"] = ctx
+
+    # Passed to `asyncpg.create_pool` as is
+    credentials.setdefault("statement_cache_size", settings.DATABASE_STATEMENT_CACHE_SIZE)
+    credentials.setdefault("command_timeout", settings.DATABASE_COMMAND_TIMEOUT)
+    credentials.setdefault(
+        "max_inactive_connection_lifetime", settings.DATABASE_MAX_INACTIVE_CONNECTION_LIFETIME
+    )
+
+    if role is not None:
+        # Tells the connections of the processes apart in `pg_stat_activity`
+        credentials.setdefault("application_name", role)
+
+    if pool_max_size is not None:
+        credentials["minsize"] = min(
+            credentials.get("minsize", settings.DATABASE_MIN_CONNECTIONS), pool_max_size
+        )
+        credentials["maxsize"] = pool_max_size
+
+    return db
+
+
+def get_tortoise_config(role: ProcessRole | None = None, pool_max_size: int | None = None):
+    """
+    Get the configuration for the `tortoise-orm` of a process of the role.
+
+    The connections are limited to `pool_max_size`, or to the role's `*_DATABASE_MAX_CONNECTIONS`.
+    The pool parameters set in the `DATABASE_URL` query (e.g. `?statement_cache_size=0`) take
+    precedence over the settings. The replica is connected to only once read from.
+    """
+    if role is not None:
+        pool_max_size = pool_max_size or get_database_max_connections(role)
+
+    connections: dict[str, dict] = {
+        "default": _get_connection_config(settings.DATABASE_URL, role, pool_max_size)
+    }
+    if settings.DATABASE_REPLICA_URL:
+        connections[REPLICA_CONNECTION] = _get_connection_config(
+            settings.DATABASE_REPLICA_URL, role, settings.DATABASE_REPLICA_MAX_CONNECTIONS
+        )
 
     tortoise_config = {
-        "connections": {"default": db},
+        "connections": connections,
         "apps": {
             "bot": {
                 "models": [
@@ -57,16 +147,19 @@ def get_tortoise_config():
                 "default_connection": "default",
             }
         },
+        "routers": ["utils.tortoise_orm.ReplicaRouter"] if settings.DATABASE_REPLICA_URL else [],
     }
     return tortoise_config
 
 
-async def init():
-    """Initialize the `tortoise-orm`."""
+async def init(role: ProcessRole | None = None, pool_max_size: int | None = None):
+    """
+    Initialize the `tortoise-orm` for a process of the role.
+
+    The database schema is not generated here: the migrations are applied by `aerich upgrade`.
+    """
     # Init database connection
-    await tortoise.Tortoise.init(config=get_tortoise_config())
-    # Generate the schema
-    await tortoise.Tortoise.generate_schemas()
+    await tortoise.Tortoise.init(config=get_tortoise_config(role=role, pool_max_size=pool_max_size))
 
 
 async def shutdown():
@@ -77,6 +170,70 @@ async def shutdown():
 # Used by aerich.ini
 TORTOISE_ORM_CONFIG = get_tortoise_config()
 
+MODEL = typing.TypeVar("MODEL", bound=tortoise.Model)
+
+
+async def bulk_insert_ignore_conflicts(
+    model_class: typing.Type[MODEL],
+    instances: typing.Sequence[MODEL],
+    using_db: tortoise.BaseDBAsyncClient | None = None,
+) -> list[MODEL]:
+    """
+    Insert the instances with `INSERT ... ON CONFLICT DO NOTHING RETURNING`, in a single query.
+
+    Unlike `Model.bulk_create`, this tells which instances have actually been inserted, so the
+    existing rows are detected by the database instead of one `IntegrityError` at a time.
+    The instances must have their primary keys set. Return the inserted instances.
+    """
+    if not instances:
+        return []
+
+    meta = model_class._meta
+    db: tortoise.BaseDBAsyncClient = using_db or meta.db
+    executor = db.executor_class(model=model_class, db=db)
+
+    columns: list[str] = executor.regular_columns_all
+    db_columns: str = ", ".join(f'"{meta.fields_db_projection[column]}"' for column in columns)
+
+    inserted_pks: set = set()
+    # Stay within the limit of 32767 parameters per query
+    batch_size: int = 32767 // len(columns)
+    for batch_start in range(0, len(instances), batch_size):
+        batch: typing.Sequence[MODEL] = instances[batch_start : batch_start + batch_size]
+
+        values: list[typing.Any] = [
+            executor.column_map[column](getattr(instance, column), instance)
+            for instance in batch
+            for column in columns
+        ]
+        rows_placeholders: str = ", ".join(
+            "("
+            + ", ".join(
+                executor.parameter(row_number * len(columns) + column_number).get_sql()
+                for column_number in range(len(columns))
+            )
+            + ")"
+            for row_number in range(len(batch))
+        )
+
+        _, rows = await db.execute_query(
+            f'INSERT INTO "{meta.db_table}" ({db_columns}) VALUES {rows_placeholders} '
+            f'ON CONFLICT DO NOTHING RETURNING "{meta.db_pk_column}"',
+            values,
+        )
+        inserted_pks.update(meta.pk.to_python_value(row[meta.db_pk_column]) for row in rows)
+
+    inserted_instances: list[MODEL] = []
+    for instance in instances:
+        # The same row might have been passed several times, but it's inserted only once
+        if instance.pk in inserted_pks:
+            inserted_pks.discard(instance.pk)
+
+            instance._saved_in_db = True
+            inserted_instances.append(instance)
+
+    return inserted_instances
+
 
 def flatten_tortoise_model(
     model: tortoise.Model, separator: str | None = ".", prefix: str | None = None
@@ -102,3 +259,50 @@ def flatten_tortoise_model(
         flattened_dict = {f"{prefix}{k}": v for k, v in flattened_dict.items()}
 
     return dict(sorted(flattened_dict.items(), key=lambda x: x[0]))  # always return the same result
+
+
+def compile_tortoise_model_flattener(
+    keys: typing.Iterable[str],
+    separator: str = ".",
+    prefix: str = "",
+    formatters: dict[str, typing.Callable[[typing.Any], typing.Any]] | None = None,
+) -> typing.Callable[[tortoise.Model], dict[str, typing.Any]]:
+    """
+    Compile a function getting only the given keys of `flatten_tortoise_model(model, ...)`.
+
+    Instead of walking the whole model on every call, the keys are turned into the attribute paths
+    once (e.g. `paycheck__for_user__id` -> `for_user.id` with `prefix="paycheck__"`), and all of
+    them are read with a single `operator.attrgetter`. The values of the keys having a formatter
+    are formatted. The keys without the `prefix` are ignored.
+
+    The relations the keys go through must be fetched, just like for `flatten_tortoise_model`.
+    """
+    formatters = formatters or {}
+    keys = sorted(key for key in set(keys) if key.startswith(prefix) and key != prefix)
+    if not keys:
+        return lambda model: {}
+
+    paths: list[str] = [key.removeprefix(prefix).replace(separator, ".") for key in keys]
+    if len(paths) == 1:
+        # `attrgetter` with a single path returns the value itself, not a tuple of the values
+        get_value = operator.attrgetter(paths[0])
+
+        def get_values(model: tortoise.Model) -> tuple[typing.Any]:
+            """Get the value of the only key, as the tuple of the values."""
+            return (get_value(model),)
+
+    else:
+        get_values = operator.attrgetter(*paths)
+
+    key_formatters: list[tuple[str, typing.Callable[[typing.Any], typing.Any] | None]] = [
+        (key, formatters.get(key)) for key in keys
+    ]
+
+    def flatten(model: tortoise.Model) -> dict[str, typing.Any]:
+        """Get the compiled keys of the model."""
+        return {
+            key: formatter(value) if formatter else value
+            for (key, formatter), value in zip(key_formatters, get_values(model))
+        }
+
+    return flatten
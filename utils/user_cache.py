@@ -0,0 +1,114 @@
+"""
+The in-process cache of the `User`s, shared by the `AuthFilter` and the `MessagesLoggingMiddleware`.
+
+Every update needs its sender's `User`, so the recently seen users are kept in memory for
+`USER_CACHE_TTL` seconds, and the least recently seen ones are evicted once there are more than
+`USER_CACHE_MAX_SIZE` of them. A `User` saved by any process (the bot or the worker) is published
+to the Redis channel, so the other processes drop their stale copies right away. Each process
+registers the signals doing that on startup (see `register_user_cache_signals`).
+"""
+import collections
+import time
+import typing
+
+import redis.asyncio
+import tortoise.signals
+
+from models import User
+from settings import settings
+from utils.loguru_logging import logger
+from utils.redis_invalidation import RedisInvalidatedCache
+
+
+class UserCache(RedisInvalidatedCache):
+    """The LRU cache of the `User`s with a TTL, invalidated across the processes via Redis."""
+
+    def __init__(
+        self,
+        redis_client: redis.asyncio.Redis,
+        max_size: int = 10_000,
+        ttl: float = 60 * 5,
+        channel: str = "user_cache:invalidate",
+    ):
+        """Initialize the cache."""
+        super().__init__(redis_client, channel)
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # The user's ID -> (the time the entry expires at, the user), the least recently used first
+        self._users: collections.OrderedDict[int, tuple[float, User]] = collections.OrderedDict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, user_id: int) -> User | None:
+        """Get the cached user, if it's still fresh."""
+        if (entry := self._users.get(user_id)) is None or entry[0] < time.monotonic():
+            self._users.pop(user_id, None)
+            self.misses += 1
+            return None
+
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, user: User) -> None:
+        """Cache the user, evicting the least recently used ones if the cache is full."""
+        self._users[user.id] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(user.id)
+
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def discard(self, user_id: int) -> None:
+        """Remove the user from the cache of this process."""
+        self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        """Remove all the users from the cache of this process."""
+        self._users.clear()
+
+    def _invalidate_key(self, key: str) -> None:
+        """Drop the user saved by another process from the cache."""
+        self.discard(int(key))
+
+    def _invalidate_all(self) -> None:
+        """Drop all the users from the cache."""
+        self.clear()
+
+    async def publish_invalidation(self, user_id: int) -> None:
+        """Make the other processes drop the user from their caches."""
+        await self._publish_invalidation(str(user_id), f"user [ID:{user_id}]")
+
+    async def stop(self) -> None:
+        """Stop listening for the invalidations."""
+        await super().stop()
+        logger.debug(f"User cache: {self.hits} hits, {self.misses} misses")
+
+
+user_cache = UserCache(
+    redis.asyncio.Redis.from_url(settings.REDIS_URL, decode_responses=True),
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    ttl=settings.USER_CACHE_TTL,
+)
+
+
+async def update_cached_user(sender: typing.Type[User], instance: User, *_, **__):
+    """Keep the saved user in the cache, and make the other processes drop their copies."""
+    user_cache.set(instance)
+    await user_cache.publish_invalidation(instance.id)
+
+
+async def discard_cached_user(sender: typing.Type[User], instance: User, *_, **__):
+    """Drop the deleted user from the caches of all the processes."""
+    user_cache.discard(instance.id)
+    await user_cache.publish_invalidation(instance.id)
+
+
+def register_user_cache_signals() -> None:
+    """Keep the caches in sync with the users saved and deleted by this process."""
+    User.register_listener(tortoise.signals.Signals.post_save, update_cached_user)
+    User.register_listener(tortoise.signals.Signals.post_delete, discard_cached_user)
+
+
+__all__ = ["register_user_cache_signals", "UserCache", "user_cache"]
@@ -0,0 +1,145 @@
+"""
+The web server receiving the webhooks.
+
+Monobank pushes every new statement item of the client's accounts here, so the payments are
+confirmed right away, instead of waiting for the next statements' poll in the worker. The webhook's
+path ends with the `MONOBANK_WEBHOOK_SECRET`, since anyone knowing it can push the statements.
+"""
+import asyncio
+import secrets
+import typing
+
+import pydantic
+from aiohttp import web
+
+from models import MonobankAccount, MonobankClient
+from settings import settings
+from tasks import process_new_account_statements
+from utils import tortoise_orm
+from utils.loguru_logging import logger
+from utils.monobank import (
+    get_web_hook_url,
+    monobank_api,
+    save_account_statement,
+    set_web_hook,
+    StatementItem,
+)
+
+routes = web.RouteTableDef()
+
+
+def _check_secret(request: web.Request) -> None:
+    """Pretend there is no webhook, unless the request's path has the secret."""
+    if not settings.MONOBANK_WEBHOOK_SECRET or not secrets.compare_digest(
+        request.match_info["secret"], settings.MONOBANK_WEBHOOK_SECRET
+    ):
+        raise web.HTTPNotFound()
+
+
+@routes.get(f"{settings.MONOBANK_WEBHOOK_PATH}/{{secret}}")
+async def monobank_webhook_check(request: web.Request) -> web.Response:
+    """Confirm the webhook to Monobank, which sends a GET request before enabling it."""
+    _check_secret(request)
+
+    return web.Response()
+
+
+@routes.post(f"{settings.MONOBANK_WEBHOOK_PATH}/{{secret}}")
+async def monobank_webhook(request: web.Request) -> web.Response:
+    """
+    Save the statement item pushed by Monobank and process it in the background.
+
+    Monobank expects a response within 5 seconds and disables the webhook after several failures,
+    so only the statement is saved before responding, and everything else is done afterwards.
+    """
+    _check_secret(request)
+
+    try:
+        payload: dict[str, typing.Any] = await request.json()
+    except ValueError as e:
+        logger.warning(f"Received an invalid Monobank webhook payload: {await request.text()=}")
+        raise web.HTTPBadRequest() from e
+
+    if payload.get("type") != "StatementItem":
+        logger.warning(f"Received an unknown Monobank webhook: {payload=}")
+        return web.Response()
+
+    try:
+        account_id: str = payload["data"]["account"]
+        statement_item = StatementItem.parse_obj(payload["data"]["statementItem"])
+    except (KeyError, TypeError, pydantic.ValidationError) as e:
+        logger.warning(f"Received an invalid Monobank statement: {payload=} ({e!r})")
+        raise web.HTTPBadRequest() from e
+
+    if not (monobank_account := await MonobankAccount.get_or_none(id=account_id)):
+        logger.warning(f"Received a statement for an unknown Monobank account: {account_id=}")
+        return web.Response()
+
+    if account_statement := await save_account_statement(monobank_account, statement_item):
+        task = asyncio.create_task(process_new_account_statements([account_statement]))
+
+        # Keep a reference to the task, so it's not garbage collected before it's done
+        request.app["background_tasks"].add(task)
+        task.add_done_callback(request.app["background_tasks"].discard)
+
+    return web.Response()
+
+
+async def set_monobank_web_hooks() -> None:
+    """Make all the Monobank clients send their statements to this server."""
+    web_hook_url: str = get_web_hook_url()
+
+    for monobank_client in await MonobankClient.all():
+        if monobank_client.web_hook_url == web_hook_url:
+            continue
+
+        try:
+            await set_web_hook(monobank_client, web_hook_url)
+        except Exception as e:
+            logger.error(
+                f"Failed to set the web hook for {monobank_client.pk=}: {e} ({e.__class__})"
+            )
+
+
+async def on_startup(_app: web.Application) -> None:
+    """Start up the web server."""
+    logger.debug("Initializing the database connection...")
+    await tortoise_orm.init(role="webhooks")
+
+    if settings.MONOBANK_WEBHOOK_BASE_URL:
+        logger.debug("Setting the Monobank web hooks...")
+        await set_monobank_web_hooks()
+
+    logger.info("Startup complete.")
+
+
+async def on_shutdown(app: web.Application) -> None:
+    """Shut down the web server, letting the statements being processed finish."""
+    logger.info("Shutting down...")
+
+    if app["background_tasks"]:
+        await asyncio.gather(*app["background_tasks"], return_exceptions=True)
+
+    logger.debug("Closing the Monobank API connections...")
+    await monobank_api.close()
+
+    logger.debug("Closing the database connection...")
+    await tortoise_orm.shutdown()
+
+    logger.info("Shutdown complete.")
+
+
+def make_app() -> web.Application:
+    """Make the web application."""
+    app = web.Application()
+    app["background_tasks"] = set()
+
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(make_app(), host=settings.WEB_SERVER_HOST, port=settings.PORT)
@@ -1,18 +1,27 @@
 """All the tasks that are run periodically."""
 import asyncio
 
-from tasks import monitor_paychecks
+from settings import settings
+from tasks import monitor_paychecks, rematch_account_statements, retain_messages
+from utils.bootstrap import on_shutdown, on_startup
+from utils.job_queue import job_queue
 
 
 async def main():
     """Run all the tasks."""
-    # Initial setup for the worker
-    from main import on_startup
-
+    # Initial setup for the worker, without the bot's dispatcher
     await on_startup()
 
-    await monitor_paychecks()
-    # In the future, we can add more tasks here
+    try:
+        await asyncio.gather(
+            monitor_paychecks(),
+            rematch_account_statements(),
+            retain_messages(),
+            job_queue.consume(consumers=settings.JOB_QUEUE_CONSUMERS),
+            # In the future, we can add more tasks here
+        )
+    finally:
+        await on_shutdown()
 
 
 if __name__ == "__main__":